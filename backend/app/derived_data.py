@@ -0,0 +1,133 @@
+"""
+Per-frame data derived from a recording's skeleton: center of mass and base of support.
+
+Arrays freemocap saved to `output_data/center_of_mass` are memory-mapped, so a
+windowed request only reads the frames it returns. Anything missing on disk is
+computed once from the loaded skeleton and kept with the session, keyed on the
+skeleton's fingerprint so a recalculated skeleton recomputes it. Every array is
+handled as (F, N, 3), so windows, the LOD pyramid and the binary payload work
+the same as for the trajectory data.
+
+    "com"          total body center of mass              (F, 1, 3)
+    "segment_com"  center of mass of every segment        (F, S, 3)
+    "bos"          base of support, the outline of the feet (F, 4, 3)
+"""
+import logging
+import math
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from trajectory_lod import TrajectoryPyramid
+from trajectory_payload import skeleton_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DERIVED_ARRAYS = ("com", "segment_com", "bos")
+CENTER_OF_MASS_FILE_NAMES = {
+    "com": "{tracker}_total_body_center_of_mass_xyz.npy",
+    "segment_com": "{tracker}_segmentCOM_frame_joint_xyz.npy",
+}
+# trajectories added to the model by `calculate()`
+CENTER_OF_MASS_TRAJECTORY_NAMES = {
+    "com": "total_body_com",
+    "segment_com": "segment_com",
+}
+# in outline order, heel to toe on the left and back on the right
+BASE_OF_SUPPORT_MARKERS = ("left_heel", "left_foot_index", "right_foot_index", "right_heel")
+
+
+class DerivedDataUnavailable(LookupError):
+    pass
+
+
+def _as_points(array: np.ndarray) -> np.ndarray:
+    """View an (F, 3) or (F, N, 3) array as (F, N, 3)"""
+    return array.reshape(array.shape[0], -1, 3)
+
+
+class DerivedData:
+    def __init__(self, recording_folder_path: Path, tracker: str, skeleton):
+        self.recording_folder_path = Path(recording_folder_path)
+        self.tracker = tracker
+        self.skeleton = skeleton
+        # name -> (fingerprint or None for files on disk, (F, N, 3) array, labels)
+        self._arrays: dict[str, tuple[str | None, np.ndarray, list[str]]] = {}
+        self._pyramids: dict[str, tuple[int, TrajectoryPyramid]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def center_of_mass_folder_path(self) -> Path:
+        return self.recording_folder_path/'output_data'/'center_of_mass'
+
+    def get(self, name: str) -> tuple[np.ndarray, list[str]]:
+        """The (F, N, 3) array and the N labels. Memory-mapped arrays are returned as is, not copied."""
+        if name not in DERIVED_ARRAYS:
+            raise KeyError(name)
+        fingerprint = skeleton_fingerprint(self.skeleton)
+        with self._lock:
+            cached = self._arrays.get(name)
+            if cached is not None and cached[0] in (None, fingerprint):
+                return cached[1], cached[2]
+
+            array, labels, from_disk = self._load(name)
+            self._arrays[name] = (None if from_disk else fingerprint, array, labels)
+            self._pyramids.pop(name, None)
+            return array, labels
+
+    def window(self, name: str, start: int = 0, end: int | None = None, stride: int = 1, max_points: int | None = None):
+        """(frames, float32 values, bucket_size, labels) for a window, as `TrajectoryPyramid.window`"""
+        array, labels = self.get(name)
+        num_frames = array.shape[0]
+        end = num_frames if end is None else min(end, num_frames)
+        if max_points is None or math.ceil((end - start) / stride) <= max_points:
+            # only the frames in the window are read from a memory-mapped file
+            values = np.asarray(array[start:end:stride], dtype="<f4")
+            values = np.where(np.isfinite(values), values, np.nan).astype("<f4", copy=False)
+            return np.arange(start, end, stride)[:len(values)], values, 1, labels
+
+        frames, values, bucket_size = self._pyramid(name, array).window(start, end, stride, max_points)
+        return frames, values, bucket_size, labels
+
+    def _pyramid(self, name: str, array: np.ndarray) -> TrajectoryPyramid:
+        with self._lock:
+            cached = self._pyramids.get(name)
+            if cached is None or cached[0] != id(array):
+                values = np.asarray(array, dtype="<f4")
+                values = np.where(np.isfinite(values), values, np.nan).astype("<f4", copy=False)
+                cached = (id(array), TrajectoryPyramid(values))
+                self._pyramids[name] = cached
+            return cached[1]
+
+    def _load(self, name: str) -> tuple[np.ndarray, list[str], bool]:
+        if name in CENTER_OF_MASS_FILE_NAMES:
+            file_path = self.center_of_mass_folder_path/CENTER_OF_MASS_FILE_NAMES[name].format(tracker=self.tracker)
+            if file_path.exists():
+                logger.info(f"Memory-mapping {file_path}")
+                array = _as_points(np.load(file_path, mmap_mode='r'))
+                return array, self._labels(name, array.shape[1]), True
+
+            trajectories = getattr(self.skeleton.body, "trajectories", {})
+            trajectory = trajectories.get(CENTER_OF_MASS_TRAJECTORY_NAMES[name])
+            if trajectory is None:
+                raise DerivedDataUnavailable(f"No {file_path.name} and the {self.tracker} model has no "
+                                             f"'{CENTER_OF_MASS_TRAJECTORY_NAMES[name]}' trajectory")
+            array = np.stack(list(trajectory.as_dict.values()), axis=1).astype("<f4")
+            return array, self._labels(name, array.shape[1]), False
+
+        # base of support
+        rigid_xyz = self.skeleton.body.rigid_xyz.as_dict
+        missing = [marker for marker in BASE_OF_SUPPORT_MARKERS if marker not in rigid_xyz]
+        if missing:
+            raise DerivedDataUnavailable(f"The {self.tracker} model has no {', '.join(missing)} markers for the base of support")
+        array = np.stack([rigid_xyz[marker] for marker in BASE_OF_SUPPORT_MARKERS], axis=1).astype("<f4")
+        return array, list(BASE_OF_SUPPORT_MARKERS), False
+
+    def _labels(self, name: str, count: int) -> list[str]:
+        if name == "com":
+            return ["total_body"] * count
+        segment_names = list(self.skeleton.body.anatomical_structure.segment_connections)
+        if len(segment_names) == count:
+            return segment_names
+        return [f"segment_{index}" for index in range(count)]
@@ -0,0 +1,274 @@
+"""
+Export jobs run in a separate process pool.
+
+Every job gets an id and its own staging folder. The web process and the
+worker talk only through files in that folder, which keeps the API event loop
+free of encoding work and works the same with fork and spawn:
+
+    frames/<n>.img     decoded uploaded frames waiting to be composited (upload jobs)
+    progress.json      frames done / total, written by the worker as it goes
+    cancel             created by the web process to ask the worker to stop
+
+Jobs rendered in chunks (`start_chunked`) are coordinated from a thread of
+the web process instead, and their chunks go to one process pool shared by all
+such jobs, so an export worker never starts a pool of its own inside the
+export pool. The chunks get the job's context and check the same cancel file.
+
+A cancelled job reports "cancelling" until the worker notices, then
+"cancelled", and its partial output is deleted. Finished jobs are forgotten
+after `job_ttl` seconds, along with their staging folder and output video.
+"""
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from metrics import export_frames, export_frames_per_second, export_job_seconds
+
+logger = logging.getLogger(__name__)
+
+MAX_CONCURRENT_EXPORTS = 2
+PROGRESS_INTERVAL_FRAMES = 30
+STAGED_FRAME_POLL_SECONDS = 0.05
+STAGED_FRAME_TIMEOUT_SECONDS = 600    # how long an upload job waits while no new frames are staged
+JOB_TTL_SECONDS = 3600
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handle passed to the job function in the worker process"""
+
+    def __init__(self, staging_folder_path: Path):
+        self.staging_folder_path = Path(staging_folder_path)
+        self.started_at = time.time()
+        self._last_report = 0
+
+    @property
+    def frames_folder_path(self) -> Path:
+        return self.staging_folder_path / "frames"
+
+    def cancelled(self) -> bool:
+        return (self.staging_folder_path / "cancel").exists()
+
+    def raise_if_cancelled(self):
+        if self.cancelled():
+            raise JobCancelled()
+
+    def report(self, frames_done: int, frames_total: int, force: bool = False, stats: dict | None = None):
+        """Record progress, throttled to every PROGRESS_INTERVAL_FRAMES frames unless forced, with optional job-specific `stats`"""
+        if not force and frames_done - self._last_report < PROGRESS_INTERVAL_FRAMES:
+            return
+        self._last_report = frames_done
+        progress_path = self.staging_folder_path / "progress.json"
+        temporary_path = progress_path.with_suffix(".tmp")
+        temporary_path.write_text(json.dumps({
+            "frames_done": frames_done,
+            "frames_total": frames_total,
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "stats": stats,
+        }))
+        try:
+            os.replace(temporary_path, progress_path)
+        except PermissionError:
+            # the web process is reading the previous report (Windows), the next one will land
+            pass
+
+    def stage_frames(self, encoded_frames: list[tuple[int, bytes]]):
+        """Write uploaded frames for the worker to pick up. Called from the web process."""
+        self.frames_folder_path.mkdir(parents=True, exist_ok=True)
+        for frame_number, contents in encoded_frames:
+            frame_path = self.frames_folder_path / f"{frame_number:08d}.img"
+            temporary_path = frame_path.with_suffix(".tmp")
+            temporary_path.write_bytes(contents)
+            os.replace(temporary_path, frame_path)
+
+    def take_staged_frames(self, below: int) -> list[tuple[int, bytes]]:
+        """Take the uploaded frames staged so far with numbers below `below` out of the staging folder, in frame order"""
+        if not self.frames_folder_path.exists():
+            return []
+        encoded_frames = []
+        for frame_path in sorted(self.frames_folder_path.glob("*.img")):
+            frame_number = int(frame_path.stem)
+            if frame_number >= below:
+                break
+            encoded_frames.append((frame_number, frame_path.read_bytes()))
+            frame_path.unlink()
+        return encoded_frames
+
+
+def _run_job(job_function, staging_folder_path: Path, *args):
+    """Entry point in the worker process, or the coordinating thread of a chunked job"""
+    context = JobContext(staging_folder_path)
+    context.report(0, 0, force=True)
+    return job_function(context, *args)
+
+
+class ExportJob:
+    def __init__(self, job_id: str, kind: str, frames_total: int, output_path: Path, staging_folder_path: Path):
+        self.id = job_id
+        self.kind = kind
+        self.frames_total = frames_total
+        self.output_path = output_path
+        self.context = JobContext(staging_folder_path)
+        self.frames_received = 0  # frames staged so far by upload jobs
+        self.bytes_received = 0
+        self.decode_seconds = 0.0
+        self.upload_format: str | None = None
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self.future: Future | None = None
+        self.cancel_requested = False
+
+    @property
+    def status(self) -> str:
+        if self.future is None:
+            return "cancelled" if self.cancel_requested else "queued"
+        if self.future.cancelled():
+            return "cancelled"
+        if not self.future.done():
+            if self.cancel_requested:
+                return "cancelling"
+            return "running" if self.future.running() else "queued"
+        error = self.future.exception()
+        if error is None:
+            return "cancelled" if self.cancel_requested else "done"
+        return "cancelled" if isinstance(error, JobCancelled) else "failed"
+
+    def progress(self) -> dict:
+        try:
+            return json.loads((self.context.staging_folder_path / "progress.json").read_text())
+        except (OSError, ValueError):
+            return {"frames_done": 0, "frames_total": self.frames_total, "started_at": None, "updated_at": None}
+
+    def to_dict(self) -> dict:
+        status = self.status
+        progress = self.progress()
+        frames_done = self.frames_total if status == "done" else progress["frames_done"]
+
+        # started_at is set by the worker, so time spent queued doesn't count against throughput
+        elapsed = 0.0
+        if progress["started_at"] is not None:
+            end_time = self.finished_at if self.finished_at is not None else time.time()
+            elapsed = max(end_time - progress["started_at"], 0.0)
+        error = None
+        if status == "failed":
+            error = str(self.future.exception())
+
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": status,
+            "frames_done": frames_done,
+            "frames_total": self.frames_total,
+            "progress": frames_done / self.frames_total if self.frames_total else 0.0,
+            "frames_per_second": frames_done / elapsed if elapsed > 0 else 0.0,
+            "elapsed_seconds": elapsed,
+            "output": self.output_path.name,
+            "error": error,
+            "stats": progress.get("stats"),
+        }
+
+
+class ExportJobManager:
+    def __init__(self,
+                 staging_root_path: Path,
+                 max_concurrent: int = MAX_CONCURRENT_EXPORTS,
+                 job_ttl: float = JOB_TTL_SECONDS,
+                 chunk_processes: int | None = None):
+        self.staging_root_path = Path(staging_root_path)
+        self.max_concurrent = max_concurrent
+        self.job_ttl = job_ttl
+        self.jobs: dict[str, ExportJob] = {}
+        self._executor = ProcessPoolExecutor(max_workers=max_concurrent)
+        self._coordinators = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="export-coordinator")
+        # one pool for the chunks of every chunked job, so concurrent exports share the cores instead of oversubscribing them
+        self._chunk_executor = ProcessPoolExecutor(max_workers=chunk_processes or os.cpu_count() or 1)
+
+    def create_job(self, kind: str, frames_total: int, base_output_path: Path) -> ExportJob:
+        """Register a job; its output is `base_output_path` suffixed with the job id so concurrent exports never share a file"""
+        self.evict_expired()
+        job_id = uuid.uuid4().hex[:12]
+        staging_folder_path = self.staging_root_path / job_id
+        staging_folder_path.mkdir(parents=True)
+        base_output_path = Path(base_output_path)
+        output_path = base_output_path.with_name(f"{base_output_path.stem}_{job_id}{base_output_path.suffix}")
+        job = ExportJob(job_id, kind, frames_total, output_path, staging_folder_path)
+        self.jobs[job_id] = job
+        return job
+
+    def start(self, job: ExportJob, job_function, *args):
+        """Queue `job_function(context, *args)` in the process pool. At most `max_concurrent` jobs run at once."""
+        job.future = self._executor.submit(_run_job, job_function, job.context.staging_folder_path, *args)
+        job.future.add_done_callback(lambda future: self._finish(job))
+        logger.info(f"Export job {job.id} ({job.kind}, {job.frames_total} frames) queued")
+
+    def start_chunked(self, job: ExportJob, job_function, *args):
+        """
+        Queue `job_function(context, chunk_executor, *args)` on a coordinating thread of this process. It does no
+        heavy work itself but hands chunks to `chunk_executor`, the shared chunk pool (see
+        `parallel_export.render_segments`). At most `max_concurrent` chunked jobs run at once.
+        """
+        job.future = self._coordinators.submit(_run_job, job_function, job.context.staging_folder_path, self._chunk_executor, *args)
+        job.future.add_done_callback(lambda future: self._finish(job))
+        logger.info(f"Export job {job.id} ({job.kind}, {job.frames_total} frames) queued")
+
+    def get(self, job_id: str) -> ExportJob | None:
+        self.evict_expired()
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> ExportJob | None:
+        """Ask a job to stop. A running job stops at its next cancel check; finished jobs are left alone."""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        if job.future is not None and job.future.done():
+            return job
+        job.cancel_requested = True
+        (job.context.staging_folder_path / "cancel").touch(exist_ok=True)
+        if job.future is not None:
+            job.future.cancel()
+        return job
+
+    def evict_expired(self):
+        """Forget jobs that finished more than `job_ttl` seconds ago and delete their files"""
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            if job.finished_at is None or now - job.finished_at < self.job_ttl:
+                continue
+            del self.jobs[job_id]
+            shutil.rmtree(job.context.staging_folder_path, ignore_errors=True)
+            job.output_path.unlink(missing_ok=True)
+            logger.info(f"Export job {job_id} expired")
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            if job.future is not None and not job.future.done():
+                self.cancel(job.id)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._coordinators.shutdown(wait=False, cancel_futures=True)
+        self._chunk_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, job: ExportJob):
+        job.finished_at = time.time()
+        status = job.status
+        summary = job.to_dict()
+        export_frames.inc(summary["frames_done"], kind=job.kind, status=status)
+        export_job_seconds.observe(summary["elapsed_seconds"], kind=job.kind, status=status)
+        if status == "failed":
+            logger.error(f"Export job {job.id} failed: {job.future.exception()}")
+        else:
+            if status == "done":
+                export_frames_per_second.observe(summary["frames_per_second"], kind=job.kind)
+            logger.info(f"Export job {job.id} {status}: {summary['frames_per_second']:.1f} frames/sec")
+        # keep progress.json for status queries, drop staged frames and what a cancelled job left behind
+        shutil.rmtree(job.context.frames_folder_path, ignore_errors=True)
+        if status == "cancelled":
+            job.output_path.unlink(missing_ok=True)
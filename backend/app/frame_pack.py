@@ -0,0 +1,254 @@
+"""
+Persistent on-disk cache of the downscaled WebP frames of a video.
+
+All encoded frames of a video are written to a single pack file:
+
+    frame 0 | frame 1 | ... | frame N-1      contiguous WebP blobs
+    uint64[N + 1]                            byte offset of each frame in the blob section
+    footer                                   magic, version, N, position of the offset index
+
+The file name carries a key derived from the video's size, mtime, a sampled
+content hash and the encoding settings, so a pack is rebuilt whenever the
+recording or the settings change. Packs are memory-mapped and frames are
+returned as zero-copy `memoryview`s of the mapping.
+
+Builds run in background threads that can be stopped between frames. Stores of
+the same video in one process (the default recording and a session of it, or
+two trackers sharing annotated videos) wait for one build instead of each
+writing the pack, and every build writes its own temporary file.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import uuid
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from frame_store import FRAME_DOWNSCALE_FACTOR, WEBP_QUALITY, encode_frame
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"WEBPPACK"
+PACK_VERSION = 1
+PACK_SUFFIX = ".webpack"
+FOOTER_FORMAT = "<8sIIQ"    # magic, version, frame count, offset of the index
+FOOTER_SIZE = struct.calcsize(FOOTER_FORMAT)
+HASH_SAMPLE_BYTES = 1 << 20  # bytes hashed from the start, middle and end of the video
+KEY_LENGTH = 16              # hex digits of the pack key
+
+_build_locks: dict[Path, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
+
+class FramePackCancelled(Exception):
+    pass
+
+
+def _build_lock(pack_path: Path) -> threading.Lock:
+    with _build_locks_guard:
+        return _build_locks.setdefault(Path(pack_path).resolve(), threading.Lock())
+
+
+def pack_key(video_path: Path, downscale_factor: int = FRAME_DOWNSCALE_FACTOR, quality: int = WEBP_QUALITY) -> str:
+    """
+    Identify the encoded frames of a video.
+
+    Hashing a full multi-gigabyte recording would cost as much as transcoding it,
+    so the content hash covers three 1 MiB samples plus the size and mtime.
+    """
+    stat = video_path.stat()
+    digest = hashlib.blake2b(digest_size=KEY_LENGTH // 2)
+    digest.update(f"{PACK_VERSION}:{stat.st_size}:{stat.st_mtime_ns}:{downscale_factor}:{quality}".encode())
+    with open(video_path, "rb") as f:
+        for position in (0, max(0, stat.st_size // 2 - HASH_SAMPLE_BYTES // 2), max(0, stat.st_size - HASH_SAMPLE_BYTES)):
+            f.seek(position)
+            digest.update(f.read(HASH_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+def pack_path_for(video_path: Path, cache_folder_path: Path, key: str) -> Path:
+    return cache_folder_path / f"{video_path.stem}.{key}{PACK_SUFFIX}"
+
+
+def _packs_of(video_path: Path, cache_folder_path: Path) -> list[Path]:
+    """Packs of this video under any key, and not of other videos whose name starts the same"""
+    prefix, suffix = f"{video_path.stem}.", PACK_SUFFIX
+    return [path for path in cache_folder_path.glob(f"*{PACK_SUFFIX}")
+            if path.name.startswith(prefix) and path.name.endswith(suffix)
+            and len(path.name) == len(prefix) + KEY_LENGTH + len(suffix)
+            and all(character in "0123456789abcdef" for character in path.name[len(prefix):-len(suffix)])]
+
+
+class FramePack:
+    """Read-only, memory-mapped view of a pack file"""
+
+    def __init__(self, pack_path: Path):
+        self.pack_path = Path(pack_path)
+        self._file = open(self.pack_path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+
+        magic, version, frame_count, index_offset = struct.unpack_from(FOOTER_FORMAT, self._mmap, len(self._mmap) - FOOTER_SIZE)
+        if magic != PACK_MAGIC or version != PACK_VERSION:
+            self.close()
+            raise ValueError(f"{self.pack_path} is not a version {PACK_VERSION} frame pack")
+        self.frame_count = frame_count
+        self._offsets = np.frombuffer(self._mmap, dtype="<u8", count=frame_count + 1, offset=index_offset)
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    def __reduce__(self):
+        # mappings can't be pickled, worker processes map the same file themselves
+        return (FramePack, (self.pack_path,))
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+    def get_frame(self, frame_index: int) -> memoryview | None:
+        """Zero-copy view of an encoded frame, None if the frame could not be decoded when the pack was built"""
+        start, end = int(self._offsets[frame_index]), int(self._offsets[frame_index + 1])
+        if start == end:
+            return None
+        return self._view[start:end]
+
+    def close(self):
+        # views handed out must be released before the mapping can close
+        self._offsets = None
+        try:
+            self._view.release()
+            self._mmap.close()
+        except BufferError:
+            logger.warning(f"Frame pack {self.pack_path.name} still has frames in use, leaving it mapped")
+        self._file.close()
+
+
+def build_frame_pack(video_path: Path,
+                     pack_path: Path,
+                     downscale_factor: int = FRAME_DOWNSCALE_FACTOR,
+                     quality: int = WEBP_QUALITY,
+                     stop_event: threading.Event | None = None) -> Path:
+    """
+    Transcode a video into a pack file, streaming frames to disk as they are encoded.
+
+    Raises FramePackCancelled, leaving no pack behind, once `stop_event` is set.
+    """
+    temporary_path = pack_path.with_name(f"{pack_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    pack_path.parent.mkdir(parents=True, exist_ok=True)
+
+    cap = cv2.VideoCapture(str(video_path))
+    offsets = [0]
+    try:
+        with open(temporary_path, "wb") as f:
+            while True:
+                if stop_event is not None and stop_event.is_set():
+                    raise FramePackCancelled(f"Stopped building the frame pack of {video_path.name}")
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                f.write(encode_frame(frame, downscale_factor, quality))
+                offsets.append(f.tell())
+
+            frame_count = len(offsets) - 1
+            index_offset = f.tell()
+            f.write(np.asarray(offsets, dtype="<u8").tobytes())
+            f.write(struct.pack(FOOTER_FORMAT, PACK_MAGIC, PACK_VERSION, frame_count, index_offset))
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+    finally:
+        cap.release()
+
+    os.replace(temporary_path, pack_path)
+    logger.info(f"Built frame pack {pack_path.name}: {frame_count} frames, {pack_path.stat().st_size / 1e6:.1f} MB")
+    return pack_path
+
+
+def open_or_build_frame_pack(video_path: Path,
+                             cache_folder_path: Path,
+                             downscale_factor: int = FRAME_DOWNSCALE_FACTOR,
+                             quality: int = WEBP_QUALITY,
+                             stop_event: threading.Event | None = None) -> FramePack:
+    """
+    Map the pack for the current contents of the video, rebuilding it and removing stale packs if needed.
+
+    If the same pack is already being built in this process, waits for that build and maps its result.
+    """
+    video_path = Path(video_path)
+    cache_folder_path = Path(cache_folder_path)
+    key = pack_key(video_path, downscale_factor, quality)
+    pack_path = pack_path_for(video_path, cache_folder_path, key)
+
+    with _build_lock(pack_path):
+        if pack_path.exists():
+            try:
+                pack = FramePack(pack_path)
+                os.utime(pack_path)  # mark as recently used for eviction
+                return pack
+            except (ValueError, struct.error) as e:
+                logger.warning(f"Discarding unreadable frame pack {pack_path.name}: {e}")
+                pack_path.unlink(missing_ok=True)
+
+        for stale_pack_path in _packs_of(video_path, cache_folder_path):
+            if stale_pack_path == pack_path:
+                continue
+            logger.info(f"Removing stale frame pack {stale_pack_path.name}")
+            try:
+                stale_pack_path.unlink()
+            except OSError as e:
+                logger.warning(f"Could not remove stale frame pack {stale_pack_path.name}: {e}")
+
+        build_frame_pack(video_path, pack_path, downscale_factor, quality, stop_event)
+        return FramePack(pack_path)
+
+
+def evict_frame_packs(cache_folder_path: Path, budget_bytes: int, keep: set[Path] = frozenset()):
+    """Delete the least recently used packs until the cache folder fits in the disk budget"""
+    pack_paths = sorted(cache_folder_path.glob(f"*{PACK_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+    total_bytes = sum(path.stat().st_size for path in pack_paths)
+    keep = {Path(path).resolve() for path in keep}
+
+    for pack_path in pack_paths:
+        if total_bytes <= budget_bytes:
+            break
+        if pack_path.resolve() in keep:
+            continue
+        size = pack_path.stat().st_size
+        try:
+            pack_path.unlink()
+        except OSError as e:
+            logger.warning(f"Could not evict frame pack {pack_path.name}: {e}")
+            continue
+        total_bytes -= size
+        logger.info(f"Evicted frame pack {pack_path.name} ({size / 1e6:.1f} MB)")
+
+
+def attach_frame_packs(frame_stores: dict, cache_folder_path: Path, budget_bytes: int, stop_event: threading.Event | None = None):
+    """
+    Build or map the pack of every frame store and switch the stores over to them.
+
+    Meant to run in a background thread after startup: the stores keep decoding
+    on demand until their pack is ready. Returns early once `stop_event` is set.
+    """
+    pack_paths = set()
+    for frame_store in frame_stores.values():
+        if stop_event is not None and stop_event.is_set():
+            return
+        try:
+            pack = open_or_build_frame_pack(frame_store.video_path, cache_folder_path, frame_store.downscale_factor,
+                                            frame_store.quality, stop_event)
+        except FramePackCancelled:
+            logger.info(f"Stopped building frame packs in {cache_folder_path}")
+            return
+        except Exception as e:
+            logger.error(f"Could not build frame pack for {frame_store.name}: {e}")
+            continue
+        frame_store.attach_pack(pack)
+        pack_paths.add(pack.pack_path)
+    evict_frame_packs(cache_folder_path, budget_bytes, keep=pack_paths)
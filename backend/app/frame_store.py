@@ -0,0 +1,324 @@
+"""
+On-demand access to the downscaled WebP frames of the annotated videos.
+
+Instead of transcoding every frame of every camera at startup, each video gets a
+`VideoFrameStore` that decodes frames when they are requested, keeps the encoded
+bytes in a bounded LRU cache and reads a few frames ahead of the playhead in the
+background so sequential playback is served from memory.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from metrics import frame_cache_requests, frames_decoded, function_seconds, timed
+
+logger = logging.getLogger(__name__)
+
+FRAME_DOWNSCALE_FACTOR = 4
+WEBP_QUALITY = 70
+CACHE_SIZE = 512            # encoded frames kept per camera
+READ_AHEAD_FRAMES = 15      # frames decoded past the last requested one
+MAX_FORWARD_SKIP = 60       # forward jumps shorter than this are grabbed instead of seeked
+
+_read_ahead_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="frame-read-ahead")
+
+
+def encode_frame(frame: np.ndarray, downscale_factor: int = FRAME_DOWNSCALE_FACTOR, quality: int = WEBP_QUALITY) -> bytes:
+    """Downscale a BGR frame and encode it as WebP"""
+    new_height, new_width = int(frame.shape[0]/downscale_factor), int(frame.shape[1]/downscale_factor)
+    frame = cv2.resize(frame, (new_width, new_height))
+    ret, buffer = cv2.imencode('.webp', frame, [int(cv2.IMWRITE_WEBP_QUALITY), quality])
+    if not ret:
+        raise ValueError("Error encoding frame as WebP")
+    return buffer.tobytes()
+
+
+@timed(function_seconds, function="capture_all_frames_from_video")
+def capture_all_frames_from_video(path_to_video: Path, downscale_factor: int = FRAME_DOWNSCALE_FACTOR, quality: int = WEBP_QUALITY) -> list[bytes]:
+    """Eagerly decode and encode every frame of a video"""
+    preprocessed_frames = []
+    cap = cv2.VideoCapture(str(path_to_video))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    for frame_number in tqdm(range(total_frames), desc="Capturing frames"):
+        ret, frame = cap.read()
+        if not ret:
+            logger.warning(f"Error reading frame {frame_number}")
+            continue
+        preprocessed_frames.append(encode_frame(frame, downscale_factor, quality))
+    cap.release()
+    logger.info(f"Captured {len(preprocessed_frames)} frames")
+    return preprocessed_frames
+
+
+class VideoFrameStore:
+    """
+    Lazily decoded, LRU-cached WebP frames of a single video.
+
+    Behaves like a read-only sequence of encoded frames (`len(store)`, `store[i]`)
+    so it can be used wherever a list of preprocessed frames was used before.
+    """
+
+    def __init__(self,
+                 video_path: Path,
+                 downscale_factor: int = FRAME_DOWNSCALE_FACTOR,
+                 quality: int = WEBP_QUALITY,
+                 cache_size: int = CACHE_SIZE,
+                 read_ahead: int = READ_AHEAD_FRAMES):
+        self.video_path = Path(video_path)
+        self.downscale_factor = downscale_factor
+        self.quality = quality
+        self.cache_size = cache_size
+        self.read_ahead = read_ahead
+
+        self._lock = threading.Lock()
+        self._cache: OrderedDict[int, bytes] = OrderedDict()
+        self._cache_nbytes = 0
+        self._closed = False
+        self._capture = None
+        self._next_frame = 0        # index the decoder will return on the next read
+        self._playhead = 0          # last frame requested by a client
+        self._pack = None           # on-disk frame pack, see frame_pack.py
+        self.frame_map = None       # frame of this video for every skeleton frame, see frame_sync.py
+        self.time_source = None
+
+        cap = cv2.VideoCapture(str(self.video_path))
+        if not cap.isOpened():
+            raise FileNotFoundError(f"Could not open video {self.video_path}")
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self._capture = cap
+
+        stat = self.video_path.stat()
+        self.version = f"{stat.st_size}-{stat.st_mtime_ns}-{downscale_factor}-{quality}"
+
+    @property
+    def name(self) -> str:
+        return self.video_path.name
+
+    def __len__(self) -> int:
+        return self.frame_count
+
+    @property
+    def cache_nbytes(self) -> int:
+        """Bytes held by the in-memory frame cache (frame packs are memory-mapped and not counted)"""
+        return self._cache_nbytes
+
+    @property
+    def packed(self) -> bool:
+        """Whether frames are served from an on-disk frame pack rather than decoded"""
+        return self._pack is not None
+
+    def __getitem__(self, frame_index: int) -> bytes | memoryview:
+        frame = self.get_frame(frame_index, read_ahead=False)
+        if frame is None:
+            raise IndexError(f"Frame {frame_index} could not be read from {self.name}")
+        return frame
+
+    def __getstate__(self):
+        # decoder, lock and cache are per process, a copy sent to a worker reopens the video
+        return {
+            "video_path": self.video_path,
+            "downscale_factor": self.downscale_factor,
+            "quality": self.quality,
+            "cache_size": self.cache_size,
+            "read_ahead": self.read_ahead,
+            "pack": self._pack,
+            "frame_map": self.frame_map,
+            "time_source": self.time_source,
+        }
+
+    def __setstate__(self, state):
+        pack = state.pop("pack")
+        frame_map, time_source = state.pop("frame_map"), state.pop("time_source")
+        self.__init__(**state)
+        if pack is not None:
+            self.attach_pack(pack)
+        if frame_map is not None:
+            self.attach_frame_map(frame_map, time_source)
+
+    def attach_pack(self, pack):
+        """Serve frames from a built frame pack from now on and drop the decoder and cache"""
+        with self._lock:
+            if self._closed:
+                pack.close()
+                return
+            if self._pack is not None:
+                self._pack.close()
+            self._pack = pack
+            self.frame_count = len(pack)
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
+            self._clear_cache()
+
+    def attach_frame_map(self, frame_map: np.ndarray, time_source: str):
+        """Look up skeleton frames through `frame_map` (-1 where this camera has no frame) from now on"""
+        self.frame_map = frame_map
+        self.time_source = time_source
+
+    def synced_frame_numbers(self, start: int, stop: int) -> np.ndarray:
+        """Frame of this video for each skeleton frame start..stop, -1 where there is none"""
+        frame_map = self.frame_map
+        frame_numbers = np.full(max(stop - start, 0), -1, dtype=np.int32)
+        if frame_map is None:
+            # not synced (yet): the skeleton frame number is the video frame number
+            available = np.arange(start, min(stop, self.frame_count), dtype=np.int32)
+        else:
+            # the map can point past the end if the store shrank after it was built (a shorter frame pack)
+            available = frame_map[start:stop]
+            available = np.where(available < self.frame_count, available, -1)
+        frame_numbers[:len(available)] = available
+        return frame_numbers
+
+    def get_synced_frame(self, skeleton_frame: int, read_ahead: bool = True) -> bytes | memoryview | None:
+        """The frame shown at a skeleton frame, or None if this camera has none"""
+        frame_index = int(self.synced_frame_numbers(skeleton_frame, skeleton_frame + 1)[0])
+        return None if frame_index < 0 else self.get_frame(frame_index, read_ahead)
+
+    def get_synced_frames(self, start: int, count: int) -> list[bytes | memoryview | None]:
+        """Frames shown at `count` skeleton frames from `start`, read in one sequential pass"""
+        frame_numbers = self.synced_frame_numbers(start, start + count)
+        available = frame_numbers[frame_numbers >= 0]
+        if len(available) == 0:
+            return [None] * len(frame_numbers)
+        first = int(available.min())
+        frames = self.get_frames(first, int(available.max()) - first + 1)
+        return [frames[frame_index - first] if 0 <= frame_index - first < len(frames) else None for frame_index in frame_numbers]
+
+    def get_frame(self, frame_index: int, read_ahead: bool = True) -> bytes | memoryview | None:
+        """Return the encoded frame, decoding it if it is not cached. Returns None if it cannot be read."""
+        if not 0 <= frame_index < self.frame_count:
+            raise IndexError(f"Frame {frame_index} out of range for {self.name} ({self.frame_count} frames)")
+
+        pack = self._pack
+        if pack is not None:
+            frame_cache_requests.inc(result="pack")
+            return pack.get_frame(frame_index)
+
+        with self._lock:
+            self._playhead = frame_index
+            frame = self._cached(frame_index)
+            frame_cache_requests.inc(result="memory" if frame is not None else "decode")
+            if frame is None:
+                frame = self._decode(frame_index)
+
+        if read_ahead and self.read_ahead > 0:
+            _read_ahead_executor.submit(self._read_ahead_from, frame_index)
+        return frame
+
+    def get_frames(self, start: int, count: int) -> list[bytes | memoryview | None]:
+        """Return `count` consecutive frames from `start` (clipped to the video) decoding them in one sequential pass"""
+        stop = min(start + count, self.frame_count)
+        pack = self._pack
+        if pack is not None:
+            frame_cache_requests.inc(max(stop - start, 0), result="pack")
+            return [pack.get_frame(frame_index) for frame_index in range(start, stop)]
+
+        with self._lock:
+            self._playhead = stop - 1
+            frames = []
+            for frame_index in range(start, stop):
+                frame = self._cached(frame_index)
+                frame_cache_requests.inc(result="memory" if frame is not None else "decode")
+                frames.append(frame if frame is not None else self._decode(frame_index))
+
+        if stop > start and self.read_ahead > 0:
+            _read_ahead_executor.submit(self._read_ahead_from, stop - 1)
+        return frames
+
+    def close(self):
+        with self._lock:
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
+            if self._pack is not None:
+                self._pack.close()
+                self._pack = None
+            self._clear_cache()
+            self._closed = True
+
+    def _cached(self, frame_index: int) -> bytes | None:
+        frame = self._cache.get(frame_index)
+        if frame is not None:
+            self._cache.move_to_end(frame_index)
+        return frame
+
+    def _store(self, frame_index: int, frame: bytes):
+        previous = self._cache.pop(frame_index, None)
+        if previous is not None:
+            self._cache_nbytes -= len(previous)
+        self._cache[frame_index] = frame
+        self._cache_nbytes += len(frame)
+        while len(self._cache) > self.cache_size:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_nbytes -= len(evicted)
+
+    def _clear_cache(self):
+        self._cache.clear()
+        self._cache_nbytes = 0
+
+    def _seek(self, frame_index: int):
+        """
+        Position the decoder so the next read returns `frame_index`.
+
+        Seeking makes the decoder jump back to the preceding keyframe and decode
+        forward, so short forward jumps are cheaper done with `grab()`, which
+        skips frames without converting them.
+        """
+        skip = frame_index - self._next_frame
+        if 0 <= skip <= MAX_FORWARD_SKIP:
+            for _ in range(skip):
+                if not self._capture.grab():
+                    self._capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+                    break
+        else:
+            self._capture.set(cv2.CAP_PROP_POS_FRAMES, frame_index)
+        self._next_frame = frame_index
+
+    def _decode(self, frame_index: int) -> bytes | None:
+        """Decode and cache a frame. Caller must hold the lock."""
+        if self._capture is None:
+            return None
+        if frame_index != self._next_frame:
+            self._seek(frame_index)
+
+        ret, frame = self._capture.read()
+        if not ret:
+            logger.warning(f"Error reading frame {frame_index} from {self.name}")
+            # force a real seek next time, the decoder position is unknown
+            self._next_frame = -1
+            return None
+        self._next_frame = frame_index + 1
+
+        with function_seconds.time(function="encode_frame"):
+            encoded = encode_frame(frame, self.downscale_factor, self.quality)
+        frames_decoded.inc()
+        self._store(frame_index, encoded)
+        return encoded
+
+    def _read_ahead_from(self, frame_index: int):
+        """Decode the frames following `frame_index` until the window is full or a client moves the playhead"""
+        for next_index in range(frame_index + 1, min(frame_index + 1 + self.read_ahead, self.frame_count)):
+            with self._lock:
+                if self._playhead != frame_index or self._pack is not None:
+                    return
+                if next_index in self._cache:
+                    continue
+                if self._decode(next_index) is None:
+                    return
+
+
+def open_frame_stores(list_of_video_paths: list[Path], **store_kwargs) -> dict[int, VideoFrameStore]:
+    """Open a frame store per video, keyed by video number like the old `results_dict`"""
+    frame_stores = {}
+    for video_number, video_path in enumerate(list_of_video_paths):
+        frame_stores[video_number] = VideoFrameStore(video_path, **store_kwargs)
+        logger.info(f"Opened {video_path.name}: {frame_stores[video_number].frame_count} frames")
+    return frame_stores
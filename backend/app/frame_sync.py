@@ -0,0 +1,254 @@
+"""
+Frame-timestamp index that lines the cameras up with the skeleton.
+
+Cameras that dropped frames have fewer frames than the skeleton, so indexing
+every camera with the skeleton's frame number drifts out of sync after the
+first drop. Instead every camera gets the time of each of its frames, from the
+FreeMoCap timestamp files of the recording when there are any and otherwise
+from the container (`CAP_PROP_POS_MSEC`, which only shows drops in variable
+frame rate videos), and a map from skeleton frame number to the camera frame
+nearest in time. The skeleton is assumed to run on the clock of the camera
+with the most frames, continued at its median frame period past its end.
+
+The maps are one (F,) int32 array per camera, attached to the frame stores as
+`frame_map` with -1 where the camera wasn't recording, so a prefetch window or
+export range is a slice. Reading container timestamps means demuxing every
+frame, so the camera times are cached in the frame cache folder, keyed on the
+video versions, and maps are attached from a background thread after startup;
+until then frames are looked up by frame number as before. Map entries past
+the end of a video are only dropped at lookup, since attaching a frame pack
+can change how many frames a store has.
+"""
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMPS_FOLDER_NAMES = ('synchronized_videos/timestamps', 'synchronized_videos', 'timestamps')
+TIMESTAMP_SUFFIXES = ('.npy', '.csv')
+# stem suffixes of annotated videos that aren't part of the camera name
+VIDEO_STEM_SUFFIXES = ('_annotated', '_synchronized')
+FRAME_TIMES_FILE_NAME = 'frame_times.npz'
+
+
+class FrameSyncCancelled(Exception):
+    pass
+
+
+def _camera_name(video_path: Path) -> str:
+    stem = Path(video_path).stem
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in VIDEO_STEM_SUFFIXES:
+            if stem.endswith(suffix):
+                stem, stripped = stem[:-len(suffix)], True
+    return stem
+
+
+def find_timestamp_file(recording_folder_path: Path, video_path: Path) -> Path | None:
+    """FreeMoCap timestamp file of the camera a video was recorded with, e.g. synchronized_videos/timestamps/Camera_000_timestamps.npy"""
+    camera_name = _camera_name(video_path)
+    for folder_name in TIMESTAMPS_FOLDER_NAMES:
+        folder_path = Path(recording_folder_path)/folder_name
+        if not folder_path.is_dir():
+            continue
+        for path in sorted(folder_path.glob(f"{camera_name}*")):
+            if path.suffix in TIMESTAMP_SUFFIXES and "timestamp" in path.stem.lower():
+                return path
+    return None
+
+
+def _to_seconds(timestamps: np.ndarray) -> np.ndarray:
+    """Seconds from the frame period's order of magnitude: nanoseconds, milliseconds or seconds"""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    period = np.median(np.diff(timestamps)) if len(timestamps) > 1 else 0.0
+    if period > 1e5:
+        return timestamps / 1e9
+    if period > 1:
+        return timestamps / 1e3
+    return timestamps
+
+
+def read_timestamp_file(path: Path) -> np.ndarray:
+    """Frame times in seconds from a `.npy` array or the first timestamp column of a `.csv`"""
+    if path.suffix == '.npy':
+        timestamps = np.load(path)
+        timestamps = timestamps if timestamps.ndim == 1 else timestamps[:, 0]
+    else:
+        table = np.genfromtxt(path, delimiter=',', names=True)
+        columns = [name for name in table.dtype.names if "timestamp" in name.lower()] or list(table.dtype.names)
+        timestamps = table[columns[0]]
+    return _to_seconds(timestamps[np.isfinite(timestamps)])
+
+
+def container_timestamps(video_path: Path, stop_event=None) -> np.ndarray:
+    """Presentation time in seconds of every frame, demuxed without decoding to images. Raises FrameSyncCancelled once `stop_event` is set."""
+    capture = cv2.VideoCapture(str(video_path))
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Could not open video {video_path}")
+    timestamps = []
+    try:
+        while capture.grab():
+            if stop_event is not None and stop_event.is_set():
+                raise FrameSyncCancelled(f"Stopped reading the timestamps of {video_path.name}")
+            timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+    finally:
+        capture.release()
+    return np.asarray(timestamps, dtype=np.float64) / 1e3
+
+
+def camera_times(video_path: Path, recording_folder_path: Path | None, stop_event=None) -> tuple[np.ndarray, str]:
+    """Frame times of a camera in seconds and where they came from"""
+    timestamp_path = None if recording_folder_path is None else find_timestamp_file(recording_folder_path, video_path)
+    if timestamp_path is not None:
+        try:
+            return read_timestamp_file(timestamp_path), timestamp_path.name
+        except (OSError, ValueError, IndexError) as e:
+            logger.warning(f"Could not read timestamps from {timestamp_path}, using the container's: {e}")
+    return container_timestamps(video_path, stop_event), "container"
+
+
+def align_clocks(times_per_camera: list[np.ndarray], sources: list[str]) -> list[np.ndarray]:
+    """
+    Put every camera on one clock. Timestamp files share the recording's clock,
+    while container times start at zero for each video, so those are taken to
+    start with the earliest camera that has a timestamp file.
+    """
+    file_starts = [times[0] for times, source in zip(times_per_camera, sources) if source != "container" and len(times)]
+    origin = min(file_starts, default=0.0)
+    return [times - times[0] + origin if source == "container" and len(times) else times
+            for times, source in zip(times_per_camera, sources)]
+
+
+def _median_period(times: np.ndarray) -> float:
+    return float(np.median(np.diff(times))) if len(times) > 1 else 0.0
+
+
+def skeleton_times(times_per_camera: list[np.ndarray], num_skeleton_frames: int) -> np.ndarray:
+    """Time of every skeleton frame: the clock of the camera with the most frames, continued at its frame period"""
+    reference = max(times_per_camera, key=len)
+    period = _median_period(reference) or 1 / 30
+    times = np.empty(num_skeleton_frames, dtype=np.float64)
+    known = min(len(reference), num_skeleton_frames)
+    times[:known] = reference[:known]
+    last_time = reference[known - 1] if known else 0.0
+    times[known:] = last_time + period * np.arange(1, num_skeleton_frames - known + 1)
+    return times
+
+
+def nearest_frames(times: np.ndarray, target_times: np.ndarray) -> np.ndarray:
+    """
+    Index of the frame in `times` nearest to each target time, or -1 where a
+    target is more than half a frame period outside the span of `times`.
+    """
+    if len(times) == 0:
+        return np.full(len(target_times), -1, dtype=np.int32)
+    order = np.argsort(times, kind="stable")
+    sorted_times = times[order]
+    after = np.clip(np.searchsorted(sorted_times, target_times), 1, max(len(times) - 1, 1))
+    before = after - 1
+    if len(times) == 1:
+        nearest = np.zeros(len(target_times), dtype=np.intp)
+    else:
+        nearest = np.where(np.abs(sorted_times[after] - target_times) < np.abs(target_times - sorted_times[before]), after, before)
+    frames = order[nearest].astype(np.int32)
+
+    half_period = _median_period(sorted_times) / 2
+    outside = (target_times < sorted_times[0] - half_period) | (target_times > sorted_times[-1] + half_period)
+    frames[outside] = -1
+    return frames
+
+
+def _load_cached_times(cache_path: Path, versions: list[str]) -> tuple[list[np.ndarray], list[str]] | None:
+    try:
+        with np.load(cache_path) as cached:
+            if cached["versions"].tolist() != versions:
+                return None
+            return [cached[f"times_{index}"] for index in range(len(versions))], cached["sources"].tolist()
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def load_camera_times(frame_stores: dict, recording_folder_path: Path | None, cache_folder_path: Path,
+                      stop_event=None) -> tuple[list[np.ndarray], list[str]]:
+    """Times of every camera's frames, read from the cache when none of the videos changed"""
+    cache_path = Path(cache_folder_path)/FRAME_TIMES_FILE_NAME
+    versions = [frame_store.version for frame_store in frame_stores.values()]
+    cached = _load_cached_times(cache_path, versions)
+    if cached is not None:
+        return cached
+
+    times_per_camera, sources = [], []
+    for frame_store in frame_stores.values():
+        times, source = camera_times(frame_store.video_path, recording_folder_path, stop_event)
+        times_per_camera.append(times)
+        sources.append(source)
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(cache_path, versions=np.array(versions), sources=np.array(sources),
+                 **{f"times_{index}": times for index, times in enumerate(times_per_camera)})
+    except OSError as e:
+        logger.warning(f"Could not cache frame times in {cache_path}: {e}")
+    return times_per_camera, sources
+
+
+def attach_frame_maps(frame_stores: dict, recording_folder_path: Path | None, num_skeleton_frames: int, cache_folder_path: Path,
+                      stop_event=None):
+    """
+    Build the skeleton-to-camera frame map of every frame store and attach it.
+
+    Meant to run in a background thread after startup like `attach_frame_packs`,
+    and returns early once `stop_event` is set.
+    """
+    if not frame_stores:
+        return
+    try:
+        times_per_camera, sources = load_camera_times(frame_stores, recording_folder_path, cache_folder_path, stop_event)
+    except FrameSyncCancelled:
+        logger.info(f"Stopped syncing the cameras of {recording_folder_path}")
+        return
+    except Exception as e:
+        logger.error(f"Could not read the frame times of {recording_folder_path}, cameras stay indexed by frame number: {e}")
+        return
+    times_per_camera = align_clocks(times_per_camera, sources)
+    target_times = skeleton_times(times_per_camera, num_skeleton_frames)
+    for frame_store, times, source in zip(frame_stores.values(), times_per_camera, sources):
+        frame_map = nearest_frames(times, target_times)
+        frame_store.attach_frame_map(frame_map, source)
+        without_frame = (frame_map < 0) | (frame_map >= len(frame_store))
+        logger.info(f"Synced {frame_store.name} by {source} timestamps: {len(times)} frames for {num_skeleton_frames} skeleton frames, "
+                    f"{int(without_frame.sum())} without a frame")
+
+
+def camera_frame_numbers(frame_stores: dict, camera_ids: list, start: int, stop: int) -> np.ndarray:
+    """(cameras, frames) camera frame numbers for skeleton frames start..stop, -1 where a camera has none"""
+    frame_numbers = np.full((len(camera_ids), max(stop - start, 0)), -1, dtype=np.int32)
+    for row, camera_id in enumerate(camera_ids):
+        frame_numbers[row] = frame_stores[camera_id].synced_frame_numbers(start, stop)
+    return frame_numbers
+
+
+class SyncedFrames:
+    """
+    A frame store indexed by skeleton frame number, for the export compositors.
+
+    Frames the camera doesn't have are None.
+    """
+
+    def __init__(self, frame_store):
+        self.frame_store = frame_store
+
+    def __len__(self) -> int:
+        frame_map = self.frame_store.frame_map
+        return len(self.frame_store) if frame_map is None else len(frame_map)
+
+    def __getitem__(self, frame_number: int):
+        return self.frame_store.get_synced_frame(frame_number, read_ahead=False)
+
+
+def synced_frames(frame_stores: dict) -> dict:
+    return {camera_id: SyncedFrames(frame_store) for camera_id, frame_store in frame_stores.items()}
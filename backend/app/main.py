@@ -1,22 +1,25 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, HTTPException, Request, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi import APIRouter, FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from starlette.middleware.cors import CORSMiddleware
 import numpy as np
 from pathlib import Path
+import argparse
+import asyncio
+import cProfile
+import json
+import threading
 import logging
-import cv2
+import os
 from io import BytesIO
 import base64
+from typing import TYPE_CHECKING
 
-
-import logging
-from tqdm import tqdm
-
-from skellymodels.managers.board import Board
-from skellymodels.managers.human import Human
-from skellymodels.managers.animal import Animal
-from skellymodels.models.tracking_model_info import MediapipeModelInfo
+# skellymodels and the modules built on cv2 (frame_sync, skeleton_render, streaming_export)
+# are imported where they are used so importing the app stays fast
+if TYPE_CHECKING:
+    from skellymodels.managers.human import Human
 # from skellymodels.create_model_skeleton import create_mediapipe_skeleton_model, create_openpose_skeleton_model, create_qualisys_skeleton_model, create_qualisys_tf01_skeleton_model 
 # from skellymodels.model_info.mediapipe_model_info import MediapipeModelInfo
 
@@ -24,22 +27,37 @@ from skellymodels.models.tracking_model_info import MediapipeModelInfo
 # from skellymodels.experimental.model_redo.tracker_info.model_info import MediapipeModelInfo, ModelInfo
 
 
-from multiprocessing import Pool
 import time
 
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from derived_data import DERIVED_ARRAYS, DerivedData, DerivedDataUnavailable
+from metrics import (PROFILING_ENABLED, PROMETHEUS_MEDIA_TYPE, function_seconds, http_request_bytes, http_request_seconds,
+                     http_response_bytes, profile_report, register_collector, render_metrics, timed, uploaded_frame_bytes)
+from playback_stream import PlaybackSession
+from response_cache import ResponseCache
+from segment_analytics import OUTLIER_PERCENTILES, RIGIDITY_THRESHOLD, skeleton_rigidity_report
+from sessions import DEFAULT_TRACKER, FRAME_CACHE_BUDGET_BYTES, SESSION_MEMORY_BUDGET_BYTES, RecordingSession, SessionManager
+from export_jobs import ExportJobManager
+from tracker_loaders import TRACKERS, available_trackers, load_tracked_points, quantized_sidecar_path
+from trajectory_codec import DEFAULT_PRECISION, QUANTIZED_MEDIA_TYPE, cached_quantized, encode_quantized
+from trajectory_lod import pyramid_for, skeleton_window_header
+from trajectory_payload import (BINARY_MEDIA_TYPE, NDJSON_MEDIA_TYPE, STREAM_CHUNK_FRAMES, human_to_binary_payload,
+                                iter_binary_chunks, iter_ndjson_chunks, json_values, marker_gaps, pack_binary_payload,
+                                skeleton_fingerprint, trajectory_array)
+from video_payload import MAX_FRAMES_PER_REQUEST, frame_range_etag, pack_frame_records
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-import traceback
-import math 
 # recording_folder_path = Path(r'C:\Users\aaron\FreeMocap_Data\recording_sessions\freemocap_test_data')
 # recording_folder_path = Path(r'D:\2023-05-17_MDN_NIH_data\1.0_recordings\calib_3\sesh_2023-05-17_13_37_32_MDN_treadmill_1')
 # recording_folder_path = Path(r'C:\Users\aaron\FreeMocap_Data\recording_sessions\sesh_2022-09-19_16_16_50_in_class_jsm')
 # recording_folder_path = Path(r'D:\2024-04-25_P01\1.0_recordings\sesh_2024-04-25_15_44_19_P01_WalkRun_Trial1')
 # recording_folder_path = Path(r'D:\2024-08-01_treadmill_KK_JSM_ATC\1.0_recordings\sesh_2024-08-01_16_18_26_JSM_wrecking_ball')
-
-recording_folder_path = Path(r'D:\2023-05-17_MDN_NIH_data\1.0_recordings\calib_3\sesh_2023-05-17_15_36_03_MDN_OneLeg_Trial1')
-recording_folder_path = Path(r'D:\2023-05-17_MDN_NIH_data\1.0_recordings\calib_3\sesh_2023-05-17_13_48_44_MDN_treadmill_2')
-recording_folder_path = Path(r'D:\2023-06-07_TF01\1.0_recordings\treadmill_calib\sesh_2023-06-07_12_06_15_TF01_flexion_neutral_trial_1')
+# recording_folder_path = Path(r'D:\2023-05-17_MDN_NIH_data\1.0_recordings\calib_3\sesh_2023-05-17_15_36_03_MDN_OneLeg_Trial1')
+# recording_folder_path = Path(r'D:\2023-05-17_MDN_NIH_data\1.0_recordings\calib_3\sesh_2023-05-17_13_48_44_MDN_treadmill_2')
+# recording_folder_path = Path(r'D:\2023-06-07_TF01\1.0_recordings\treadmill_calib\sesh_2023-06-07_12_06_15_TF01_flexion_neutral_trial_1')
 # mediapipe_output_data_folder_path = recording_folder_path / 'aligned_data'
 # # mediapipe_output_data_folder_path = recording_folder_path / 'output_data'/'aligned_data
 # mediapipe_output_data_folder_path = recording_folder_path / 'mediapipe_dlc_output_data'/'aligned_data'
@@ -48,18 +66,8 @@ recording_folder_path = Path(r'D:\2023-06-07_TF01\1.0_recordings\treadmill_calib
 # tracker_type = 'mediapipe'
 # data_3d_path = output_data_folder_path / f'{tracker_type}_body_3d_xyz.npy'
 
-def sanitize_for_json(data):
-    """Recursively replace NaN and inf in dicts/lists with None"""
-    if isinstance(data, dict):
-        return {k: sanitize_for_json(v) for k, v in data.items()}
-    elif isinstance(data, list):
-        return [sanitize_for_json(v) for v in data]
-    elif isinstance(data, float):
-        return None if math.isnan(data) or math.isinf(data) else data
-    else:
-        return data
-    
-def human_to_custom_dict(human: Human) -> dict:
+@timed(function_seconds, function="human_to_custom_dict")
+def human_to_custom_dict(human: "Human") -> dict:
     """
     Mirror the legacy `to_custom_dict` for the new Human/Trajectory API.
     Returns only what the thin-client viewer needs.
@@ -68,331 +76,831 @@ def human_to_custom_dict(human: Human) -> dict:
     markers = traj.landmark_names                     # list[str]  :contentReference[oaicite:0]{index=0}:contentReference[oaicite:1]{index=1}
     num_frames = traj.num_frames                      # int        :contentReference[oaicite:2]{index=2}:contentReference[oaicite:3]{index=3}
 
-    return sanitize_for_json({
+    # non-finite samples become null; `gaps` lists the [start, stop) frames each marker is missing
+    array = trajectory_array(human)
+    return {
         "markers"     : markers,
-        "trajectories": {k: v.tolist() for k, v in traj.as_dict.items()},
+        "trajectories": dict(zip(markers, json_values(array.transpose(1, 0, 2)))),
+        "gaps"        : marker_gaps(markers, array),
         "segments"    : human.body.anatomical_structure.segment_connections,
         "num_frames"  : num_frames,
-    })
+    }
 
 
-recording_folder_path = Path(r'D:\recording_12_57_19_gmt-4__JSM_class_balance_control')
-recording_folder_path = Path(r"D:\ferret_em_talk\ferret_04_28_25")
+# recording_folder_path = Path(r'D:\recording_12_57_19_gmt-4__JSM_class_balance_control')
+# recording_folder_path = Path(r"D:\ferret_em_talk\ferret_04_28_25")
 # recording_folder_path= Path(r"D:\2025-05-21_groundplane_fun\recording_14_34_47_gmt-4")
-recording_folder_path= Path(r"D:\2025-04-28-calibration")
-recording_folder_path = Path(r'D:\2025_07_31_JSM_pilot\freemocap\2025-07-31_16-35-10_GMT-4_jsm_treadmill_trial_1')
+# recording_folder_path= Path(r"D:\2025-04-28-calibration")
+DEFAULT_RECORDING_FOLDER_PATH = Path(r'D:\2025_07_31_JSM_pilot\freemocap\2025-07-31_16-35-10_GMT-4_jsm_treadmill_trial_1')
 
-data_folder_path = recording_folder_path / 'output_data'
+UPLOAD_BATCH_SIZE = 500 # frames per /upload-frames batch, must match BATCH_SIZE in DownloadButton.vue
+EXPORT_VIDEO_NAME = 'test_video.mp4'
+origins = ["http://localhost:5173"]
 
 
-video_name = recording_folder_path/'test_video.mp4'
-annotated_video_folder_path = recording_folder_path/'annotated_videos'
-
-# Global variable to store frames
-frames = {}
-results_dict = None
-tracker = "mediapipe"
-
-if tracker == "charuco":
-    data3d = np.load(data_folder_path/"charuco_3d_xyz.npy")
-    skeleton = Board.from_board_definition(columns = 5, rows = 3)
-    skeleton.add_tracked_points_numpy(data3d)
-    skeleton.calculate()
-    annotated_video_folder_path = recording_folder_path/'charuco_annotated_videos'
-
-elif tracker == "mediapipe":
-    skeleton = Human.from_data(recording_folder_path/'validation'/'mediapipe')
-    # skeleton = Human.from_data(recording_folder_path/'validation'/'original_model_mediapipe')
-    annotated_video_folder_path = recording_folder_path/'annotated_videos'
-
-elif tracker == "human_dlc":
-    data_folder_path = recording_folder_path / 'output_data'/'dlc_rigidified'
-    skeleton:Human = Human.from_parquet(data_folder_path/'freemocap_data_by_frame.parquet')
-    skeleton.put_skeleton_on_ground()
-    skeleton.calculate()
-    annotated_video_folder_path = recording_folder_path/'dlc_annotated_videos'
+class AppConfig:
+    """
+    The recording the app serves by default, its tracker, and where caches go.
 
-elif tracker == "ferret_dlc":
-    data_folder_path = recording_folder_path / 'output_data'/'dlc'
-    skeleton = Animal.from_data(data_folder_path)
+    `from_env` reads VIZ_RECORDING_PATH, VIZ_TRACKER, VIZ_RECORDINGS_ROOT and
+    VIZ_CACHE_DIR; running main.py takes the same settings on the command line.
+    Without a cache folder, frame packs and frame times are kept next to the videos.
+    """
 
+    def __init__(self,
+                 recording_folder_path: Path = DEFAULT_RECORDING_FOLDER_PATH,
+                 tracker: str = DEFAULT_TRACKER,
+                 recordings_root_path: Path | None = None,
+                 cache_folder_path: Path | None = None):
+        if tracker not in TRACKERS:
+            raise ValueError(f"Unknown tracker '{tracker}', expected one of {TRACKERS}")
+        self.recording_folder_path = Path(recording_folder_path)
+        self.tracker = tracker
+        # other recordings next to this one can be opened through the /sessions routes
+        self.recordings_root_path = self.recording_folder_path.parent if recordings_root_path is None else Path(recordings_root_path)
+        self.cache_folder_path = None if cache_folder_path is None else Path(cache_folder_path)
+
+    @classmethod
+    def from_env(cls, environ=os.environ) -> "AppConfig":
+        return cls(environ.get("VIZ_RECORDING_PATH", DEFAULT_RECORDING_FOLDER_PATH),
+                   environ.get("VIZ_TRACKER", DEFAULT_TRACKER),
+                   environ.get("VIZ_RECORDINGS_ROOT"),
+                   environ.get("VIZ_CACHE_DIR"))
+
+    @property
+    def video_name(self) -> Path:
+        return self.recording_folder_path/EXPORT_VIDEO_NAME
+
+    @property
+    def export_staging_folder_path(self) -> Path:
+        return self.recording_folder_path/'export_staging'
+
+
+config: AppConfig | None = None    # set by create_app
 
-list_of_annotated_videos = list(annotated_video_folder_path.glob('*.mp4'))
+# Global variable to store frames
+frames = {}
+# the configured recording, loaded in a background thread after startup (see /ready)
+default_session: RecordingSession | None = None
+default_session_error: str | None = None
+default_session_load_seconds: float | None = None
+export_job_manager = None
+session_memory_budget_bytes = SESSION_MEMORY_BUDGET_BYTES
+# downscaled WebP frames are packed to disk so restarts don't re-transcode unchanged videos
+frame_cache_budget_bytes = FRAME_CACHE_BUDGET_BYTES
+session_manager = None
+
+# serialized /data responses, shared by the plots that all fetch the same skeleton
+response_cache = ResponseCache()
+
+router = APIRouter()
+
+
+def load_default_recording(app_config: AppConfig):
+    """Load the configured recording and start indexing its videos. Runs in a background thread so the server binds right away."""
+    global default_session, default_session_error, default_session_load_seconds
+    start_time = time.perf_counter()
+    try:
+        session = RecordingSession(app_config.recording_folder_path.name, app_config.recording_folder_path,
+                                   app_config.tracker, app_config.cache_folder_path)
+    except Exception as e:
+        logger.error(f"Could not load {app_config.recording_folder_path} ({app_config.tracker}): {e}")
+        default_session_error = f"{type(e).__name__}: {e}"
+        return
+    default_session_load_seconds = time.perf_counter() - start_time
+    default_session = session
+    session.start_indexing(frame_cache_budget_bytes)
+    logger.info(f"Loaded {session.id} ({session.tracker}) in {default_session_load_seconds:.2f} seconds")
 
 
+def _default_session() -> RecordingSession:
+    """The configured recording, or a 503 while it is still loading"""
+    if default_session is not None:
+        return default_session
+    if default_session_error is not None:
+        raise HTTPException(status_code=503, detail=f"Could not load {config.recording_folder_path}: {default_session_error}")
+    raise HTTPException(status_code=503, detail=f"Still loading {config.recording_folder_path}, see /ready", headers={"Retry-After": "1"})
 
 
 @asynccontextmanager
 async def lifespan_manager(app:FastAPI):
     logger.info("Starting up FastAPI app - access API backend interface at http://localhost:8000/docs")
-    global results_dict
-    results_dict = preproccess_annotated_videos(list_of_annotated_videos)
+    global export_job_manager, session_manager, default_session, default_session_error, default_session_load_seconds
+    default_session, default_session_error, default_session_load_seconds = None, None, None
+    export_job_manager = ExportJobManager(config.export_staging_folder_path)
+    session_manager = SessionManager(config.recordings_root_path, session_memory_budget_bytes, frame_cache_budget_bytes,
+                                     config.cache_folder_path)
+    loader = threading.Thread(target=load_default_recording, args=(config,), daemon=True, name="default-recording-loader")
+    loader.start()
     yield
+    export_job_manager.shutdown()
+    session_manager.close()
+    # a recording still loading would start indexing after being closed
+    loader.join()
+    if default_session is not None:
+        default_session.close()
     logger.info("Shutting down FastAPI app")
 
-app = FastAPI(lifespan=lifespan_manager)
 
-origins = ["http://localhost:5173"]  
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def create_app(app_config: AppConfig | None = None) -> FastAPI:
+    """
+    The app serving `app_config`, read from the environment by default.
 
+    Nothing is loaded until startup and the recording loads in the background,
+    so the server binds right away and `/ready` reports when the data is in, e.g.
+    `VIZ_RECORDING_PATH=... uvicorn main:create_app --factory --reload`.
+    """
+    global config
+    config = app_config or AppConfig.from_env()
+    app = FastAPI(lifespan=lifespan_manager)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(record_request_metrics)
+    app.include_router(router)
+    return app
+
+
+async def _count_response_bytes(body_iterator, route: str):
+    async for chunk in body_iterator:
+        http_response_bytes.inc(len(chunk), route=route)
+        yield chunk
+
+
+async def record_request_metrics(request: Request, call_next):
+    """Time every request and count its bytes by route template, or profile it when asked to"""
+    if PROFILING_ENABLED and request.query_params.get("profile"):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+            async for _ in response.body_iterator:
+                pass
+        finally:
+            profiler.disable()
+        return Response(content=profile_report(profiler), media_type="text/plain")
+
+    start_time = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "unmatched")
+    http_request_seconds.observe(time.perf_counter() - start_time, method=request.method, route=route, status=response.status_code)
+    http_request_bytes.inc(int(request.headers.get("content-length", 0) or 0), route=route)
+    response.body_iterator = _count_response_bytes(response.body_iterator, route)
+    return response
+
+
+def _process_metrics():
+    """Cache and session figures that live on their own objects, read at scrape time"""
+    collected = [
+        ("viz_response_cache_hits_total", "counter", "Serialized skeleton responses served from the cache", response_cache.hits),
+        ("viz_response_cache_misses_total", "counter", "Serialized skeleton responses built", response_cache.misses),
+        ("viz_response_cache_bytes", "gauge", "Bytes held by the response cache", response_cache.nbytes),
+    ]
+    if default_session is not None:
+        collected.append(("viz_frame_cache_bytes", "gauge", "Encoded frames cached in memory for the default recording",
+                          sum(frame_store.cache_nbytes for frame_store in default_session.frame_stores.values())))
+    if session_manager is not None:
+        collected.append(("viz_session_bytes", "gauge", "Estimated memory of loaded sessions",
+                          sum(session.nbytes for session in session_manager.loaded_sessions())))
+    return collected
+
+
+register_collector(_process_metrics)
+
+
+@router.get("/ready")
+async def get_ready():
+    """200 once the configured recording is loaded, 503 while it loads or when it failed to"""
+    if default_session is None:
+        return JSONResponse(status_code=503, content={
+            "status": "loading" if default_session_error is None else "failed",
+            "recording": str(config.recording_folder_path),
+            "tracker": config.tracker,
+            "error": default_session_error,
+        })
+    frame_stores = default_session.frame_stores.values()
+    return {
+        "status": "ready",
+        "recording": str(config.recording_folder_path),
+        "tracker": config.tracker,
+        "load_seconds": default_session_load_seconds,
+        "cameras": len(frame_stores),
+        # built in the background after loading; until then frames are decoded on demand and looked up by frame number
+        "frame_packs": sum(frame_store.packed for frame_store in frame_stores),
+        "frame_maps": sum(frame_store.frame_map is not None for frame_store in frame_stores),
+    }
 
 
-@app.get("/data/{tracker_type}")
-async def get_data(tracker_type:str):
-        return human_to_custom_dict(skeleton)
+@router.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type=PROMETHEUS_MEDIA_TYPE)
 
-    
-@app.get("/data_extra/com")
-async def get_com_data():
-    try:
-        com_data = np.load(mediapipe_output_data_folder_path / 'center_of_mass' / 'mediapipe_total_body_center_of_mass_xyz.npy')
-        return {"com_data": com_data.tolist()}
-eton.to_custom_dict()
 
-    except Exception as e:
-        logger.error(f"Error serving COM data: {e}")
-        raise HTTPException(status_code=500, detail=f"Error serving COM data: {e}")
 
-# app.mount("/static", StaticFiles(directory="skeleton-visualization/fast_api"), name="static")
+def _quantized_header(skeleton) -> dict:
+    return {
+        "markers"    : skeleton.body.rigid_xyz.landmark_names,
+        "segments"   : skeleton.body.anatomical_structure.segment_connections,
+        "num_frames" : int(skeleton.body.rigid_xyz.num_frames),
+        "fingerprint": skeleton_fingerprint(skeleton),
+    }
+
+
+def _skeleton_data_body(skeleton, format: str, start: int, end: int | None, stride: int, max_points: int | None,
+                        precision: float = DEFAULT_PRECISION, sidecar_path: Path | None = None):
+    """Serialize the skeleton (or a window of it) to (body, media type)"""
+    if start == 0 and end is None and stride == 1 and max_points is None:
+        if format == "binary":
+            with function_seconds.time(function="human_to_binary_payload"):
+                return human_to_binary_payload(skeleton), BINARY_MEDIA_TYPE
+        if format == "quantized":
+            build = lambda: encode_quantized(_quantized_header(skeleton), trajectory_array(skeleton),
+                                             list(skeleton.body.rigid_xyz.landmark_names), precision)
+            with function_seconds.time(function="encode_quantized"):
+                if sidecar_path is None:
+                    return build(), QUANTIZED_MEDIA_TYPE
+                return cached_quantized(sidecar_path, skeleton_fingerprint(skeleton), build), QUANTIZED_MEDIA_TYPE
+        custom_dict = human_to_custom_dict(skeleton)
+        with function_seconds.time(function="json_dumps"):
+            return json.dumps(custom_dict, default=jsonable_encoder).encode("utf-8"), "application/json"
+
+    # a window of the recording, min/max-downsampled from the cached pyramid when it has more than max_points frames
+    frames, values, bucket_size = pyramid_for(skeleton).window(start, end, stride, max_points)
+    header = skeleton_window_header(skeleton, frames, values, bucket_size)
+    if format == "binary":
+        return pack_binary_payload(header, values), BINARY_MEDIA_TYPE
+    if format == "quantized":
+        window_header = {**_quantized_header(skeleton), "frames": header["frames"], "bucket_size": bucket_size}
+        return encode_quantized(window_header, values, header["markers"], precision), QUANTIZED_MEDIA_TYPE
+    return json.dumps({
+        "markers"     : header["markers"],
+        "trajectories": dict(zip(header["markers"], json_values(values.transpose(1, 0, 2)))),
+        "gaps"        : marker_gaps(header["markers"], values, frames=frames),
+        "segments"    : header["segments"],
+        "num_frames"  : header["num_frames"],
+        "frames"      : header["frames"],
+        "bucket_size" : bucket_size,
+    }, default=jsonable_encoder).encode("utf-8"), "application/json"
+
+
+def _cached_response(request: Request, cache_key: tuple, skeleton, build):
+    """`build()` -> (body, media type) served from the response cache, rebuilt only when the skeleton has been recalculated. Blocking."""
+    entry = response_cache.get_or_build(cache_key, skeleton_fingerprint(skeleton), build)
+    return response_cache.response(entry, request)
+
+
+def _check_window_params(format: str, start: int, stride: int, max_points: int | None, formats: tuple = ("json", "binary")):
+    if format not in formats:
+        raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected one of {', '.join(formats)}")
+    if start < 0 or stride < 1 or (max_points is not None and max_points < 2):
+        raise HTTPException(status_code=400, detail="start must be >= 0, stride >= 1 and max_points >= 2")
+
+
+async def _skeleton_data_response(request: Request, cache_key: tuple, skeleton, format: str, start: int = 0, end: int | None = None,
+                                  stride: int = 1, max_points: int | None = None, precision: float = DEFAULT_PRECISION,
+                                  sidecar_path: Path | None = None):
+    _check_window_params(format, start, stride, max_points, formats=("json", "binary", "quantized"))
+    if format != "quantized":
+        precision, sidecar_path = None, None
+    elif not precision > 0:
+        raise HTTPException(status_code=400, detail="precision must be positive")
+    return await run_in_threadpool(_cached_response, request, (*cache_key, "rigid_xyz", format, start, end, stride, max_points, precision),
+                                   skeleton, lambda: _skeleton_data_body(skeleton, format, start, end, stride, max_points, precision, sidecar_path))
+
+
+@router.get("/data/{tracker_type}")
+async def get_data(request: Request, tracker_type:str, format:str = "json", start: int = 0, end: int | None = None, stride: int = 1,
+                   max_points: int | None = None, precision: float = DEFAULT_PRECISION):
+    """`format` is json, binary (float32) or quantized (see trajectory_codec.py, `precision` in millimetres)"""
+    return await _skeleton_data_response(request, ("default",), await _session_skeleton(_default_session()), format, start, end, stride, max_points,
+                                         precision, quantized_sidecar_path(config.recording_folder_path, config.tracker, precision))
+
+
+async def _session_skeleton(session: RecordingSession):
+    """The session's skellymodels model, loaded in the thread pool the first time a route needs more than its trajectory"""
+    return await run_in_threadpool(session.ensure_skeleton)
+
+
+def _skeleton_stream_response(skeleton, format: str, chunk_frames: int):
+    """Serialize the skeleton one window of frames at a time while it is being sent"""
+    if chunk_frames < 1:
+        raise HTTPException(status_code=400, detail="chunk_frames must be >= 1")
+    if format == "binary":
+        return StreamingResponse(iter_binary_chunks(skeleton, chunk_frames), media_type=BINARY_MEDIA_TYPE)
+    if format == "ndjson":
+        return StreamingResponse(iter_ndjson_chunks(skeleton, chunk_frames), media_type=NDJSON_MEDIA_TYPE)
+    raise HTTPException(status_code=400, detail=f"Unknown format '{format}', expected 'ndjson' or 'binary'")
+
+
+@router.get("/data/{tracker_type}/stream")
+async def stream_data(tracker_type: str, format: str = "ndjson", chunk_frames: int = STREAM_CHUNK_FRAMES):
+    return _skeleton_stream_response(await _session_skeleton(_default_session()), format, chunk_frames)
 
-def preproccess_annotated_videos(list_of_video_paths:list[Path]):
-    with Pool(processes=10) as pool:
-        results = pool.map(capture_all_frames_from_video, list_of_video_paths)
     
-    global results_dict    
-    results_dict = {video_number: frames for video_number, frames in enumerate(results)}
+def _derived_data_body(derived: DerivedData, name: str, format: str, start: int, end: int | None, stride: int, max_points: int | None):
+    """Serialize a window of a derived array to (body, media type). JSON keeps the `<name>_data[frame]` layout of the COM plot."""
+    frames, values, bucket_size, labels = derived.window(name, start, end, stride, max_points)
+    header = {
+        "name"       : name,
+        "labels"     : labels,
+        "num_frames" : int(derived.get(name)[0].shape[0]),
+        "frames"     : frames.tolist(),
+        "bucket_size": bucket_size,
+    }
+    if format == "binary":
+        header.update(shape=list(values.shape), dtype="float32", byte_order="little", nan_sentinel="NaN")
+        return pack_binary_payload(header, values), BINARY_MEDIA_TYPE
+    header[f"{name}_data"] = json_values(values[:, 0] if name == "com" else values)
+    header["gaps"] = marker_gaps(labels, values, frames=frames)
+    return json.dumps(header).encode("utf-8"), "application/json"
+
+
+async def _derived_data_response(request: Request, cache_key: tuple, skeleton, derived: DerivedData, name: str, format: str,
+                                 start: int, end: int | None, stride: int, max_points: int | None):
+    _check_window_params(format, start, stride, max_points)
+    if name not in DERIVED_ARRAYS:
+        raise HTTPException(status_code=404, detail=f"Unknown derived data '{name}', expected one of {DERIVED_ARRAYS}")
+    try:
+        return await run_in_threadpool(_cached_response, request, (*cache_key, name, format, start, end, stride, max_points), skeleton,
+                                       lambda: _derived_data_body(derived, name, format, start, end, stride, max_points))
+    except DerivedDataUnavailable as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-    return results_dict
 
-    f = 2
+@router.get("/data_extra/{name}")
+async def get_derived_data(request: Request, name: str, format: str = "json", start: int = 0, end: int | None = None,
+                           stride: int = 1, max_points: int | None = None):
+    session = _default_session()
+    return await _derived_data_response(request, ("default",), await _session_skeleton(session), session.derived_data, name, format, start, end, stride, max_points)
 
-def capture_all_frames_from_video(path_to_video:Path):
-    preprocessed_frames = []
-    cap = cv2.VideoCapture(str(path_to_video))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+def _rigidity_body(skeleton, threshold: float, low_percentile: float, high_percentile: float):
+    report = skeleton_rigidity_report(trajectory_array(skeleton),
+                                      list(skeleton.body.rigid_xyz.landmark_names),
+                                      skeleton.body.anatomical_structure.segment_connections,
+                                      threshold,
+                                      (low_percentile, high_percentile))
+    return json.dumps(report).encode("utf-8"), "application/json"
 
-    for frame_number in tqdm(range(total_frames), desc="Capturing frames"):
-        ret, frame = cap.read()
-        if not ret:
-            logger.warning(f"Error reading frame {frame_number}")
-            continue
 
-        new_height,new_width = int(frame.shape[0]/4), int(frame.shape[1]/4)
-        frame = cv2.resize(frame, (new_width, new_height))
+async def _rigidity_response(request: Request, cache_key: tuple, skeleton, threshold: float, low_percentile: float, high_percentile: float):
+    """Segment length QA of the rigid skeleton, cached until the skeleton is recalculated"""
+    if threshold < 0 or not 0 <= low_percentile <= high_percentile <= 100:
+        raise HTTPException(status_code=400, detail="threshold must be >= 0 and 0 <= low_percentile <= high_percentile <= 100")
+    return await run_in_threadpool(_cached_response, request, (*cache_key, "rigidity", threshold, low_percentile, high_percentile), skeleton,
+                                   lambda: _rigidity_body(skeleton, threshold, low_percentile, high_percentile))
 
-        ret, buffer = cv2.imencode('.webp', frame, [int(cv2.IMWRITE_WEBP_QUALITY), 70])
-        if not ret:
-            raise HTTPException(status_code=500, detail=f"Error encoding frame {frame_number}")
 
-        preprocessed_frames.append(buffer.tobytes())
-    cap.release()
-    logger.info(f"Captured {len(preprocessed_frames)} frames")
-    return preprocessed_frames
+@router.get("/analytics/rigidity")
+async def get_rigidity(request: Request, threshold: float = RIGIDITY_THRESHOLD,
+                       low_percentile: float = OUTLIER_PERCENTILES[0], high_percentile: float = OUTLIER_PERCENTILES[1]):
+    return await _rigidity_response(request, ("default",), await _session_skeleton(_default_session()), threshold, low_percentile, high_percentile)
 
-@app.get("/video-info")
-async def get_video_info():
+# app.mount("/static", StaticFiles(directory="skeleton-visualization/fast_api"), name="static")
+
+def _video_info(frame_stores: dict):
     return {
         "videos": [
             {
-                "name": video_path.name,
-                "frame_count": len(frames)
+                "name": frame_store.name,
+                "frame_count": len(frame_store),
+                "fps": frame_store.fps,
+                "time_source": frame_store.time_source,
             }
-            for video_path, frames in zip(list_of_annotated_videos, results_dict.values())
+            for frame_store in frame_stores.values()
         ],
-        "total_videos": len(results_dict)
+        "total_videos": len(frame_stores)
     }
 
 
-@app.get("/video/frames/{frame_index}")
-async def get_video_frames(frame_index: int):
-    global results_dict
-    
-    if results_dict is None:
+@router.get("/video-info")
+async def get_video_info():
+    return _video_info(_default_session().frame_stores)
+
+
+async def _video_frame_range_response(request: Request, frame_stores: dict, start: int, count: int, cameras: str | None):
+    """Binary stream of raw WebP frames for `count` frames from `start`, see video_payload.py for the layout"""
+    if frame_stores is None:
+        raise HTTPException(status_code=500, detail="Video data not initialized")
+    if start < 0 or not 0 < count <= MAX_FRAMES_PER_REQUEST:
+        raise HTTPException(status_code=400, detail=f"start must be >= 0 and count between 1 and {MAX_FRAMES_PER_REQUEST}")
+
+    if cameras is None:
+        camera_ids = list(frame_stores.keys())
+    else:
+        try:
+            camera_ids = [int(camera_id) for camera_id in cameras.split(",") if camera_id]
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid camera list '{cameras}'")
+        unknown_ids = [camera_id for camera_id in camera_ids if camera_id not in frame_stores]
+        if unknown_ids:
+            raise HTTPException(status_code=404, detail=f"Unknown cameras {unknown_ids}")
+
+    etag = frame_range_etag(frame_stores, camera_ids, start, count)
+    cache_headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=cache_headers)
+
+    # records are keyed by skeleton frame, each camera contributes the frame nearest in time (see frame_sync.py)
+    from frame_sync import camera_frame_numbers
+    frame_numbers = camera_frame_numbers(frame_stores, camera_ids, start, start + count)
+    frames_per_camera = await asyncio.gather(*(run_in_threadpool(frame_stores[camera_id].get_synced_frames, start, count) for camera_id in camera_ids))
+    records = (
+        (start + offset, camera_id, frames[offset])
+        for offset in range(count)
+        for row, (camera_id, frames) in enumerate(zip(camera_ids, frames_per_camera))
+        if frame_numbers[row, offset] >= 0
+    )
+    return Response(content=pack_frame_records(records), media_type=BINARY_MEDIA_TYPE, headers=cache_headers)
+
+
+@router.get("/video/frames")
+async def get_video_frame_range(request: Request, start: int = 0, count: int = 30, cameras: str | None = None):
+    return await _video_frame_range_response(request, _default_session().frame_stores, start, count, cameras)
+
+
+async def _video_frames_json(frame_stores: dict, frame_index: int):
+    if frame_stores is None:
         raise HTTPException(status_code=500, detail="Video data not initialized")
     
+    # decode the cameras concurrently off the event loop, cached frames return immediately
+    video_ids = [video_id for video_id, frame_store in frame_stores.items()
+                 if frame_index >= 0 and frame_store.synced_frame_numbers(frame_index, frame_index + 1)[0] >= 0]
+    encoded_frames = await asyncio.gather(*(run_in_threadpool(frame_stores[video_id].get_synced_frame, frame_index) for video_id in video_ids))
+
     frames = {}
-    for video_id, video_frames in results_dict.items():
-        if 0 <= frame_index < len(video_frames):
-            # Convert bytes to base64-encoded string
-            frames[video_id] = base64.b64encode(video_frames[frame_index]).decode('utf-8')
+    with function_seconds.time(function="base64_encode_frames"):
+        for video_id, encoded_frame in zip(video_ids, encoded_frames):
+            if encoded_frame is not None:
+                # Convert bytes to base64-encoded string
+                frames[video_id] = base64.b64encode(encoded_frame).decode('utf-8')
     
     return JSONResponse(content=frames)
 
-@app.post("/upload-frames")
-async def upload_frames(request: Request, background_tasks: BackgroundTasks):
-    global frames
+
+@router.get("/video/frames/{frame_index}")
+async def get_video_frames(frame_index: int):
+    return await _video_frames_json(_default_session().frame_stores, frame_index)
+
+
+async def _acquire_session(session_id: str, tracker: str):
+    """The session, held until `release` so eviction can't close it mid-request"""
     try:
-        start_time = time.time()
-        form = await request.form()
-        files = form.getlist("files")
-        width = int(form.get("width", 0))
-        height = int(form.get("height", 0))
-        batch_index = int(form.get("batchIndex", 0))
-        total_frames = int(form.get("totalFrames", 0))
+        return await session_manager.acquire(session_id, tracker)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No recording named '{session_id}' under {config.recordings_root_path}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        if not files:
-            raise HTTPException(status_code=400, detail="No files uploaded")
-        if width == 0 or height == 0:
-            raise HTTPException(status_code=400, detail="Invalid width or height")
 
-        logger.info(f"Received batch {batch_index} with {len(files)} files. Total frames: {total_frames}")
-
-        for i, file in enumerate(files):
-            frame_number = batch_index * 500 + i  
-            contents = await file.read()
-            nparr = np.frombuffer(contents, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            frames[frame_number] = img
-        
-        frames_list = list(frames.values())
-        logger.info(f"Processed batch {batch_index} in {time.time() - start_time:.2f} seconds")
-        logger.info(f"Received {len(frames)} frames out of {total_frames} expected.")
-
-        if len(frames) >= total_frames:
-            logger.info("All frames received. Starting video creation.")
-            background_tasks.add_task(create_multi_video_composite, video_name, frames, results_dict, width, height)
-            # background_tasks.add_task(create_composite_video, video_name, frames_list, preprocessed_frames, width, height)
-            # background_tasks.add_task(create_combined_video, video_name, frames_list, preprocessed_frames, width, height)
-            # background_tasks.add_task(create_video_from_frames, video_name, total_frames, width, height)
-            return JSONResponse(status_code=202, content={'status': 'processing', 'message': 'Video creation started'})
-        else:
-            return JSONResponse(status_code=200, content={'status': 'success', 'message': f'Batch {batch_index} received'})
+@asynccontextmanager
+async def _use_session(session_id: str, tracker: str):
+    session = await _acquire_session(session_id, tracker)
+    try:
+        yield session
+    finally:
+        await session_manager.release(session)
 
-    except Exception as e:
-        logger.error(f"Error in upload_frames: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-    
-def create_multi_video_composite(video_name, threejs_frames, video_frames_dict, width, height):
+
+@router.get("/sessions")
+async def list_sessions(refresh: bool = False):
+    loaded = {(session.id, session.tracker): session for session in session_manager.loaded_sessions()}
+    return {
+        "sessions": [
+            {
+                "id": session_id,
+                "path": str(recording_folder_path),
+                "loaded_trackers": [tracker for (loaded_id, tracker) in loaded if loaded_id == session_id],
+            }
+            for session_id, recording_folder_path in (await session_manager.recordings(refresh=refresh)).items()
+        ],
+        "loaded_bytes": sum(session.nbytes for session in loaded.values()),
+    }
+
+
+async def _recording_folder_path(session_id: str) -> Path:
+    recording_folder_path = await session_manager.find(session_id)
+    if recording_folder_path is None:
+        raise HTTPException(status_code=404, detail=f"No recording named '{session_id}' under {config.recordings_root_path}")
+    return recording_folder_path
+
+
+@router.get("/sessions/{session_id}/trackers")
+async def get_session_trackers(session_id: str):
+    recording_folder_path = await _recording_folder_path(session_id)
+    return {
+        "available": await run_in_threadpool(available_trackers, recording_folder_path),
+        "loaded": [session.tracker for session in session_manager.loaded_sessions() if session.id == session_id],
+    }
+
+
+@router.post("/sessions/{session_id}/load")
+async def load_session_trackers(session_id: str, trackers: str = DEFAULT_TRACKER):
+    """Load a comma-separated list of trackers of one recording concurrently"""
+    tracker_list = [tracker for tracker in trackers.split(",") if tracker]
+    try:
+        sessions = await session_manager.load_trackers(session_id, tracker_list)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No recording named '{session_id}' under {config.recordings_root_path}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"loaded": [session.tracker for session in sessions]}
+
+
+@router.get("/sessions/{session_id}/tracked_points")
+async def get_session_tracked_points(session_id: str, tracker: str = DEFAULT_TRACKER, start: int = 0, end: int | None = None, stride: int = 1):
+    """The tracker's points as one float32 (F, J, 3) binary payload, read without building its model when a fast path exists"""
+    if start < 0 or stride < 1:
+        raise HTTPException(status_code=400, detail="start must be >= 0 and stride >= 1")
+    recording_folder_path = await _recording_folder_path(session_id)
     try:
-        # Get the size of the threejs frames
-        first_threejs_frame = list(threejs_frames.values())[0]
-        frame_height, frame_width = first_threejs_frame.shape[:2]
+        array, marker_names = await run_in_threadpool(load_tracked_points, recording_folder_path, tracker)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    values = np.asarray(array[start:end:stride], dtype="<f4")
+    header = {
+        "markers"     : marker_names,
+        "num_frames"  : int(array.shape[0]),
+        "start"       : start,
+        "stride"      : stride,
+        "shape"       : list(values.shape),
+        "dtype"       : "float32",
+        "byte_order"  : "little",
+        "nan_sentinel": "NaN",
+    }
+    return Response(content=pack_binary_payload(header, values), media_type=BINARY_MEDIA_TYPE)
 
-        # Initialize VideoWriter
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, (frame_width, frame_height))
-
-        # Calculate the size for each video overlay
-        num_videos = len(video_frames_dict)
-        overlay_height = int(frame_height / 4)
-        max_overlay_width = int(frame_width / 2)
-        padding = 5
-
-        # Pre-calculate video sizes
-        video_sizes = []
-        for video_frames in video_frames_dict.values():
-            if len(video_frames) > 0:
-                first_frame = cv2.imdecode(np.frombuffer(video_frames[0], np.uint8), cv2.IMREAD_COLOR)
-                aspect_ratio = first_frame.shape[1] / first_frame.shape[0]
-                new_height = overlay_height
-                new_width = min(int(new_height * aspect_ratio), max_overlay_width)
-                video_sizes.append((new_width, new_height))
-            else:
-                video_sizes.append((0, 0))
 
-        # Calculate the width for each column (including padding)
-        column_width = max(size[0] for size in video_sizes) + padding
+@router.get("/sessions/{session_id}/data")
+async def get_session_data(request: Request, session_id: str, tracker: str = DEFAULT_TRACKER, format: str = "json",
+                           start: int = 0, end: int | None = None, stride: int = 1, max_points: int | None = None,
+                           precision: float = DEFAULT_PRECISION):
+    async with _use_session(session_id, tracker) as session:
+        return await _skeleton_data_response(request, ("session", session_id, tracker), await _session_skeleton(session), format, start, end, stride, max_points,
+                                             precision, quantized_sidecar_path(session.recording_folder_path, tracker, precision))
 
-        total_frames = len(threejs_frames)
-        for frame_number in tqdm(range(total_frames), desc="Creating composite video"):
-            # Get the threejs frame
-            threejs_frame = cv2.resize(threejs_frames[frame_number], (frame_width, frame_height))
-            composite_frame = threejs_frame.copy()
 
-            # Prepare and overlay video frames
-            for i, (video_frames, (new_width, new_height)) in enumerate(zip(video_frames_dict.values(), video_sizes)):
-                if frame_number < len(video_frames):
-                    video_frame = cv2.imdecode(np.frombuffer(video_frames[frame_number], np.uint8), cv2.IMREAD_COLOR)
-                    video_frame_resized = cv2.resize(video_frame, (new_width, new_height))
+@router.get("/sessions/{session_id}/data_extra/{name}")
+async def get_session_derived_data(request: Request, session_id: str, name: str, tracker: str = DEFAULT_TRACKER, format: str = "json",
+                                   start: int = 0, end: int | None = None, stride: int = 1, max_points: int | None = None):
+    async with _use_session(session_id, tracker) as session:
+        return await _derived_data_response(request, ("session", session_id, tracker), await _session_skeleton(session), session.derived_data,
+                                            name, format, start, end, stride, max_points)
 
-                    # Calculate position for 2-column layout
-                    row = i // 2
-                    col = i % 2
-                    y_start = row * (overlay_height + padding)
-                    x_start = col * column_width
 
-                    # Overlay the video frame
-                    composite_frame[y_start:y_start+new_height, x_start:x_start+new_width] = video_frame_resized
+@router.get("/sessions/{session_id}/analytics/rigidity")
+async def get_session_rigidity(request: Request, session_id: str, tracker: str = DEFAULT_TRACKER, threshold: float = RIGIDITY_THRESHOLD,
+                               low_percentile: float = OUTLIER_PERCENTILES[0], high_percentile: float = OUTLIER_PERCENTILES[1]):
+    async with _use_session(session_id, tracker) as session:
+        return await _rigidity_response(request, ("session", session_id, tracker), await _session_skeleton(session), threshold, low_percentile, high_percentile)
 
-            out.write(composite_frame)
 
-        out.release()
-        logger.info(f"Composite video saved as {video_name}")
+@router.get("/sessions/{session_id}/data/stream")
+async def stream_session_data(session_id: str, tracker: str = DEFAULT_TRACKER, format: str = "ndjson", chunk_frames: int = STREAM_CHUNK_FRAMES):
+    session = await _acquire_session(session_id, tracker)
+    try:
+        response = _skeleton_stream_response(await _session_skeleton(session), format, chunk_frames)
+    except BaseException:
+        await session_manager.release(session)
+        raise
+    # held until the last chunk is sent
+    response.background = BackgroundTask(session_manager.release, session)
+    return response
 
-    except Exception as e:
-        logger.error(f"Error in create_multi_video_composite: {str(e)}")
-def create_combined_video(video_name, threejs_frames, video_frames, width, height):
+
+@router.get("/sessions/{session_id}/video-info")
+async def get_session_video_info(session_id: str, tracker: str = DEFAULT_TRACKER):
+    async with _use_session(session_id, tracker) as session:
+        return _video_info(session.frame_stores)
+
+
+@router.get("/sessions/{session_id}/video/frames")
+async def get_session_video_frame_range(request: Request, session_id: str, tracker: str = DEFAULT_TRACKER,
+                                        start: int = 0, count: int = 30, cameras: str | None = None):
+    async with _use_session(session_id, tracker) as session:
+        return await _video_frame_range_response(request, session.frame_stores, start, count, cameras)
+
+
+@router.get("/sessions/{session_id}/video/frames/{frame_index}")
+async def get_session_video_frames(session_id: str, frame_index: int, tracker: str = DEFAULT_TRACKER):
+    async with _use_session(session_id, tracker) as session:
+        return await _video_frames_json(session.frame_stores, frame_index)
+
+
+def _upload_format(value: str | None) -> str:
+    """Frame format of an upload batch from its `format` field, which may also be the blob's MIME type"""
+    from streaming_export import UPLOAD_FORMATS
+    frame_format = (value or "png").lower().removeprefix("image/")
+    frame_format = "jpeg" if frame_format == "jpg" else frame_format
+    if frame_format not in UPLOAD_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported frame format '{value}', expected one of {', '.join(UPLOAD_FORMATS)}")
+    return frame_format
+
+
+def _split_raw_frames(buffer: bytes, offsets: str | None, frame_bytes: int) -> list[bytes]:
+    """
+    Frames of a concatenated raw RGBA buffer, starting at the comma-separated byte
+    `offsets` or, without them, back to back.
+    """
+    if offsets:
+        try:
+            starts = [int(offset) for offset in offsets.split(",")]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="offsets must be comma-separated byte offsets")
+    else:
+        starts = list(range(0, len(buffer), frame_bytes))
+    if any(start < 0 or start + frame_bytes > len(buffer) for start in starts):
+        raise HTTPException(status_code=400, detail=f"Raw frames of {frame_bytes} bytes don't fit the {len(buffer)} byte buffer at the given offsets")
+    view = memoryview(buffer)
+    return [view[start:start + frame_bytes] for start in starts]
+
+
+@router.post("/upload-frames")
+async def upload_frames(request: Request):
+    """
+    Stage a batch of browser-rendered frames for a composite export.
+
+    Frames are either encoded images in repeated `files` fields (PNG, or the
+    cheaper WebP and JPEG, named by `format`) or, with `format=rgba`, one `frames`
+    field holding the raw RGBA pixels of every frame at comma-separated byte
+    `offsets`. Frames are numbered from `firstFrame`, by default the batch's
+    position in batches of UPLOAD_BATCH_SIZE. The batch is decoded in a thread
+    pool and staged for the export job as raw frames; the response reports the
+    decode time and bytes of this batch under `decode` and of the whole job so
+    far under `decodeTotals`.
+    """
+    from frame_sync import synced_frames
+    from streaming_export import RAW_RGBA, export_staged_upload, stage_upload_batch
     try:
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, (width * 2, height))
-
-        num_frames = min(len(threejs_frames), len(video_frames))
-        for i in tqdm(range(num_frames)):
-            threejs_frame = threejs_frames[i]
-            video_frame = video_frames[i]
-            
-            video_img = cv2.imdecode(np.frombuffer(video_frame, np.uint8), cv2.IMREAD_COLOR)
-            video_img = cv2.resize(video_img, (width, height))
-            threejs_frame = cv2.resize(threejs_frame, (width, height))
-            
-            combined_frame = np.hstack((video_img, threejs_frame))
-            out.write(combined_frame)
+        start_time = time.time()
+        form = await request.form()
+        width = int(form.get("width", 0))
+        height = int(form.get("height", 0))
+        batch_index = int(form.get("batchIndex", 0))
+        total_frames = int(form.get("totalFrames", 0))
+        first_frame = int(form.get("firstFrame", batch_index * UPLOAD_BATCH_SIZE))
+        frame_format = _upload_format(form.get("format"))
+        job_id = form.get("jobId")
 
-        out.release()
-        logger.info(f"Combined video saved as {video_name}")
+        if width == 0 or height == 0:
+            raise HTTPException(status_code=400, detail="Invalid width or height")
+        if frame_format == RAW_RGBA:
+            raw_frames = form.get("frames")
+            if raw_frames is None:
+                raise HTTPException(status_code=400, detail="No frames uploaded")
+            contents = _split_raw_frames(await raw_frames.read(), form.get("offsets"), width * height * 4)
+        else:
+            files = form.getlist("files")
+            if not files:
+                raise HTTPException(status_code=400, detail="No files uploaded")
+            contents = [await file.read() for file in files]
+        batch_bytes = sum(len(frame) for frame in contents)
+
+        logger.info(f"Received batch {batch_index} with {len(contents)} {frame_format} frames ({batch_bytes / 1e6:.1f} MB). Total frames: {total_frames}")
+
+        # the first batch starts an export job, later batches name the job they belong to
+        if job_id is None:
+            job = export_job_manager.create_job("upload", total_frames, config.video_name)
+            job.upload_format = frame_format
+            export_job_manager.start(job, export_staged_upload, job.output_path, synced_frames(_default_session().frame_stores), total_frames,
+                                     (width, height))
+        else:
+            job = export_job_manager.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail=f"Unknown export job {job_id}")
+            if job.cancel_requested or job.finished_at is not None:
+                raise HTTPException(status_code=409, detail=f"Export job {job_id} is {job.status}")
+            if job.upload_format != frame_format:
+                raise HTTPException(status_code=400, detail=f"Export job {job_id} takes {job.upload_format} frames, got {frame_format}")
+
+        encoded_frames = [(first_frame + i, frame) for i, frame in enumerate(contents)]
+        decode_seconds, stage_seconds = await run_in_threadpool(stage_upload_batch, job.context, encoded_frames, frame_format, (width, height))
+        job.frames_received += len(encoded_frames)
+        job.bytes_received += batch_bytes
+        job.decode_seconds += decode_seconds
+        uploaded_frame_bytes.inc(batch_bytes, format=frame_format)
+
+        logger.info(f"Staged batch {batch_index} in {time.time() - start_time:.2f} seconds ({decode_seconds:.2f} decoding)")
+        logger.info(f"Received {job.frames_received} frames out of {total_frames} expected.")
+
+        batch_stats = {
+            'jobId': job.id,
+            'frames': len(encoded_frames),
+            'bytes': batch_bytes,
+            'format': frame_format,
+            'stageSeconds': stage_seconds,
+            'seconds': time.time() - start_time,
+            'decode': {'frames': len(encoded_frames), 'bytes': batch_bytes, 'seconds': decode_seconds},
+            'decodeTotals': {'frames': job.frames_received, 'bytes': job.bytes_received, 'seconds': job.decode_seconds},
+        }
+        if job.frames_received >= total_frames:
+            logger.info("All frames received. Finishing video creation.")
+            return JSONResponse(status_code=202, content={'status': 'processing', 'message': 'Video creation started', **batch_stats})
+        else:
+            return JSONResponse(status_code=200, content={'status': 'success', 'message': f'Batch {batch_index} received', **batch_stats})
 
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error in create_combined_video: {str(e)}")
+        logger.error(f"Error in upload_frames: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-def create_composite_video(video_name, threejs_frames, video_frames, width, height):
+
+def _parse_vector(name: str, value: str | None, default: tuple) -> tuple:
+    if value is None:
+        return default
+    try:
+        vector = tuple(float(component) for component in value.split(","))
+    except ValueError:
+        vector = ()
+    if len(vector) != 3:
+        raise HTTPException(status_code=400, detail=f"{name} must be three comma-separated numbers, got '{value}'")
+    return vector
+
+
+async def _start_render_export(session: RecordingSession, base_output_path: Path, width: int, height: int,
+                               position: str | None, target: str | None, up: str | None, fov: float | None,
+                               start: int, end: int | None, fps: float):
+    """Queue an export job that renders the skeleton on the server instead of compositing uploaded browser frames"""
+    from frame_sync import synced_frames
+    from skeleton_render import (DEFAULT_CAMERA_POSITION, DEFAULT_CAMERA_TARGET, DEFAULT_CAMERA_UP, DEFAULT_FOV_DEGREES, Camera,
+                                 export_rendered_skeleton)
+    fov = DEFAULT_FOV_DEGREES if fov is None else fov
+    if width <= 0 or height <= 0 or width % 2 or height % 2:
+        raise HTTPException(status_code=400, detail="width and height must be positive and even")
+    if not 0 < fov < 180 or fps <= 0:
+        raise HTTPException(status_code=400, detail="fov must be between 0 and 180 degrees and fps positive")
+    num_frames = len(session.skeleton_frames)
+    end = num_frames if end is None else min(end, num_frames)
+    if not 0 <= start < end:
+        raise HTTPException(status_code=400, detail=f"Frame range {start}..{end} is empty for {num_frames} frames")
     try:
-        # Get the size of the threejs frames (height, width, channels)
-        first_threejs_frame = threejs_frames[0]
-        frame_height, frame_width = first_threejs_frame.shape[:2]
+        camera = Camera(_parse_vector("position", position, DEFAULT_CAMERA_POSITION),
+                        _parse_vector("target", target, DEFAULT_CAMERA_TARGET),
+                        _parse_vector("up", up, DEFAULT_CAMERA_UP),
+                        fov)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    job = export_job_manager.create_job("render", end - start, base_output_path)
+    export_job_manager.start_chunked(job, export_rendered_skeleton, job.output_path, synced_frames(session.frame_stores),
+                                     np.asarray(session.skeleton_frames), session.marker_names, session.segment_connections, camera, width, height, start, end, fps)
+    return JSONResponse(status_code=202, content={'status': 'processing', 'message': 'Video rendering started', 'jobId': job.id})
+
+
+@router.post("/export/render")
+async def render_export(width: int = 1280, height: int = 720, position: str | None = None, target: str | None = None,
+                        up: str | None = None, fov: float | None = None, start: int = 0, end: int | None = None, fps: float = 30.0):
+    """
+    Export the composite video with the skeleton drawn by the server, see skeleton_render.py.
 
-        # Initialize VideoWriter with the correct frame size (width, height)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, (frame_width, frame_height))
+    Camera vectors are "x,y,z"; the camera and `fov` default to the viewer's starting view.
+    """
+    session = _default_session()
+    return await _start_render_export(session, config.video_name, width, height,
+                                      position, target, up, fov, start, end, fps)
 
-        # Get the size of the first video frame to determine aspect ratio
-        first_video_frame = cv2.imdecode(np.frombuffer(video_frames[0], np.uint8), cv2.IMREAD_COLOR)
-        video_height, video_width = first_video_frame.shape[:2]
-        video_aspect_ratio = video_width / video_height
 
-        # Calculate the size of the overlay video
-        overlay_height = int(frame_height / 4)
-        overlay_width = int(overlay_height * video_aspect_ratio)
+@router.post("/sessions/{session_id}/export/render")
+async def render_session_export(session_id: str, tracker: str = DEFAULT_TRACKER, width: int = 1280, height: int = 720,
+                                position: str | None = None, target: str | None = None, up: str | None = None,
+                                fov: float | None = None, start: int = 0, end: int | None = None, fps: float = 30.0):
+    async with _use_session(session_id, tracker) as session:
+        return await _start_render_export(session, session.recording_folder_path/EXPORT_VIDEO_NAME, width, height,
+                                          position, target, up, fov, start, end, fps)
 
-        # Process frames
-        num_frames = min(len(threejs_frames), len(video_frames))
-        for i in tqdm(range(num_frames)):
-            # Resize and copy the threejs frame
-            threejs_frame = cv2.resize(threejs_frames[i], (frame_width, frame_height))
-            composite_frame = threejs_frame.copy()
 
-            # Decode and resize the video frame
-            video_frame = cv2.imdecode(np.frombuffer(video_frames[i], np.uint8), cv2.IMREAD_COLOR)
-            video_frame_resized = cv2.resize(video_frame, (overlay_width, overlay_height))
+def _get_export_job(job_id: str):
+    job = export_job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown export job {job_id}")
+    return job
 
-            # Overlay the video frame onto the threejs frame
-            composite_frame[0:overlay_height, 0:overlay_width] = video_frame_resized
 
-            # Write the composite frame to the video
-            out.write(composite_frame)
+@router.get("/jobs/{job_id}")
+async def get_export_job(job_id: str):
+    return _get_export_job(job_id).to_dict()
 
-        out.release()
-        logger.info(f"Composite video saved as {video_name}")
 
-    except Exception as e:
-        logger.error(f"Error in create_composite_video: {str(e)}")
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_export_job(job_id: str):
+    _get_export_job(job_id)
+    return export_job_manager.cancel(job_id).to_dict()
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(job_id: str):
+    job = _get_export_job(job_id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Export job {job_id} is {job.status}")
+    return FileResponse(job.output_path, media_type="video/mp4", filename=job.output_path.name)
 
-@app.get("/available_joint_names")
+@router.get("/available_joint_names")
 async def get_available_joint_names():
     try:
         skeleton = create_mediapipe_skeleton_model()
@@ -401,13 +909,13 @@ async def get_available_joint_names():
         logger.error(f"Error fetching joint names: {e}")
         raise HTTPException(status_code=500, detail="Error fetching joint names")
 
-@app.get("/")
+@router.get("/")
 async def get_index():
     logger.info("Serving index.html")
     return FileResponse("backend/static/index.html")
 
 
-@app.get("/video/frame/{frame_index}")
+@router.get("/video/frame/{frame_index}")
 async def get_video_frame(frame_index:int):
     if frame_index < 0 or frame_index >= len(preprocessed_frames):
         raise HTTPException(status_code=404, detail="Frame not found")
@@ -415,15 +923,41 @@ async def get_video_frame(frame_index:int):
 
 
 
-@app.websocket("/ws")
+@router.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    """Synchronized skeleton + video playback stream, see playback_stream.py for the protocol"""
     await websocket.accept()
-    while True:
-        data = await websocket.receive_text()
-        await websocket.send_text(f"Message text was: {data}")
+    if default_session is None:
+        await websocket.close(code=1013, reason=f"{config.recording_folder_path.name} is still loading, see /ready")
+        return
+    await _run_playback(websocket, default_session.skeleton_frames, default_session.frame_stores)
+
+
+@router.websocket("/sessions/{session_id}/ws")
+async def session_websocket_endpoint(websocket: WebSocket, session_id: str, tracker: str = DEFAULT_TRACKER):
+    await websocket.accept()
+    try:
+        session = await session_manager.acquire(session_id, tracker)
+    except (KeyError, ValueError):
+        await websocket.close(code=1008, reason=f"Unknown session '{session_id}' or tracker '{tracker}'")
+        return
+    try:
+        await _run_playback(websocket, session.skeleton_frames, session.frame_stores)
+    finally:
+        await session_manager.release(session)
+
+
+async def _run_playback(websocket: WebSocket, skeleton_frames, frame_stores: dict):
+    fps = next((frame_store.fps for frame_store in frame_stores.values() if frame_store.fps > 0), 30.0)
+    playback = PlaybackSession(websocket, skeleton_frames, frame_stores, fps=fps)
+    try:
+        await playback.run()
+    except WebSocketDisconnect:
+        logger.info("Playback client disconnected")
 
 def create_video_from_frames(output_filename, total_frames, width, height):
-    global frames
+    import cv2
+    from tqdm import tqdm
     try:
         start_time = time.time()
         logger.info(f"Starting video creation with {total_frames} frames")
@@ -451,7 +985,7 @@ def create_video_from_frames(output_filename, total_frames, width, height):
         # Ensure frames are cleared even if an error occurred
         frames.clear()
 
-# @app.get("/video/frame/{frame_index}")
+# @router.get("/video/frame/{frame_index}")
 # async def get_frame(frame_index: int):
 #     with cap_lock:
 #         total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
@@ -481,6 +1015,26 @@ def create_video_from_frames(output_filename, total_frames, width, height):
 
 
 
-if __name__ == "__main__":
+def main():
+    env_config = AppConfig.from_env()
+    parser = argparse.ArgumentParser(description="Serve a recording to the viewer. Defaults come from the VIZ_* environment variables.")
+    parser.add_argument("--recording", type=Path, default=env_config.recording_folder_path, help="recording folder served by default")
+    parser.add_argument("--tracker", choices=TRACKERS, default=env_config.tracker)
+    parser.add_argument("--recordings-root", type=Path, default=None,
+                        help="folder the /sessions routes find recordings in, defaults to the recording's parent")
+    parser.add_argument("--cache-dir", type=Path, default=env_config.cache_folder_path,
+                        help="folder for frame packs and frame times, defaults to next to the videos")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
\ No newline at end of file
+    recordings_root = args.recordings_root
+    if recordings_root is None and args.recording == env_config.recording_folder_path:
+        recordings_root = env_config.recordings_root_path
+    app_config = AppConfig(args.recording, args.tracker, recordings_root, args.cache_dir)
+    uvicorn.run(create_app(app_config), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,174 @@
+"""
+Counters and timing histograms for the hot paths, exposed in Prometheus text format.
+
+Deliberately dependency-free: metrics are plain in-process objects guarded by
+a lock, created at import time by the modules they measure, and rendered by
+`render_metrics` for the `/metrics` route. Values that already live elsewhere
+(cache hit counts, resident bytes) are read when rendering through
+`register_collector` instead of being copied on every change.
+
+Export jobs run in worker processes, so their frames/sec is recorded by the job
+manager in the web process when a job finishes.
+
+Setting VIZ_PROFILE_REQUESTS=1 lets a request add `?profile=1` to get a cProfile
+report of itself instead of its response. The profiler sees the event loop
+thread only: work handed to the thread pool shows up as time spent waiting.
+"""
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# seconds, from a cached frame (~0.1 ms) to a long export
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_metrics: dict[str, "Metric"] = {}
+_collectors = []
+_lock = threading.Lock()
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, label_values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: dict[tuple, object] = {}
+        with _lock:
+            if name in _metrics:
+                raise ValueError(f"Metric {name} is already registered")
+            _metrics[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with _lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), [0, 0.0]))
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[index] += 1
+            total[0] += 1
+            total[1] += value
+            self._values[key] = (counts, total)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_value(self, key: tuple, value) -> list[str]:
+        counts, (count, total) = value
+        lines = []
+        for upper_bound, bucket_count in [*zip(map(str, self.buckets), counts), ("+Inf", count)]:
+            bucket_labels = _format_labels(self.label_names, key, f'le="{upper_bound}"')
+            lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+        lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(total)}")
+        lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+def timed(histogram: Histogram, **labels):
+    """Decorator recording the duration of every call in `histogram`"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_collector(collector):
+    """`collector()` returns [(name, type, documentation, value)] and is called on every scrape"""
+    with _lock:
+        _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collector in collectors:
+        for name, type_name, documentation, value in collector():
+            lines.extend([f"# HELP {name} {documentation}", f"# TYPE {name} {type_name}", f"{name} {_format_value(value)}"])
+    return "\n".join(lines) + "\n"
+
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PROFILING_ENABLED = os.environ.get("VIZ_PROFILE_REQUESTS", "") == "1"
+PROFILE_REPORT_LINES = 60
+
+
+def profile_report(profiler: cProfile.Profile, limit: int = PROFILE_REPORT_LINES) -> str:
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+# shared across modules
+function_seconds = Histogram("viz_function_seconds", "Duration of instrumented hot-path functions", ("function",))
+http_request_seconds = Histogram("viz_http_request_seconds", "Duration of HTTP requests by route", ("method", "route", "status"))
+http_response_bytes = Counter("viz_http_response_bytes_total", "Response body bytes sent, by route", ("route",))
+http_request_bytes = Counter("viz_http_request_bytes_total", "Request body bytes received, by route", ("route",))
+frame_cache_requests = Counter("viz_frame_cache_requests_total", "Video frame lookups by where they were served from", ("result",))
+uploaded_frame_bytes = Counter("viz_uploaded_frame_bytes_total", "Bytes of frames uploaded for composite exports, by format", ("format",))
+frames_decoded = Counter("viz_frames_decoded_total", "Video frames decoded and encoded to WebP")
+export_frames = Counter("viz_export_frames_total", "Frames written by finished export jobs", ("kind", "status"))
+export_job_seconds = Histogram("viz_export_job_seconds", "Run time of export jobs", ("kind", "status"))
+export_frames_per_second = Histogram("viz_export_frames_per_second", "Throughput of finished export jobs", ("kind",),
+                                     buckets=(1, 2, 5, 10, 20, 30, 60, 120, 240, 480, 1000))
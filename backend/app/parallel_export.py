@@ -0,0 +1,238 @@
+"""
+Chunked, multi-process rendering of the composite export videos.
+
+The frame range is split into chunks; each chunk is composited and encoded by
+a worker process into its own segment file, and the segments are then joined
+without re-encoding using ffmpeg's concat demuxer. Every layout in
+`video_export` is supported:
+
+    "multi"      create_multi_video_composite   all cameras in a 2-column grid over the three.js frame
+    "combined"   create_combined_video          one camera and the three.js frame side by side
+    "composite"  create_composite_video         one camera in the top-left corner of the three.js frame
+
+`render_segments` does the chunking for any per-chunk renderer, and is also
+used by the server-side skeleton export in `skeleton_render`, whose chunks go to
+the export job manager's shared chunk pool rather than a pool of their own.
+Chunk durations are recorded in the calling process, since the workers' metrics
+are never scraped.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed, wait
+from functools import partial
+from pathlib import Path
+
+import cv2
+
+from frame_store import VideoFrameStore
+from frame_sync import SyncedFrames
+from metrics import function_seconds, timed
+from video_export import (MultiVideoCompositor, combined_video_frame, composite_video_frame,
+                          composite_video_layout, multi_video_layout)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 300
+LAYOUTS = ("multi", "combined", "composite")
+
+
+class FrameSlice:
+    """
+    Frames `offset` to `offset + len(frames)` of a longer list of encoded frames.
+
+    Indexed with absolute frame numbers so the per-frame compositing helpers
+    can be used unchanged on the part of a video sent to one worker.
+    """
+
+    def __init__(self, frames: list, offset: int, total_length: int):
+        self.frames = frames
+        self.offset = offset
+        self.total_length = total_length
+
+    def __len__(self) -> int:
+        return self.total_length
+
+    def __getitem__(self, frame_number: int):
+        return self.frames[frame_number - self.offset]
+
+
+def _chunk_of(video_frames, start: int, stop: int):
+    """What a worker needs to read frames start..stop of a video"""
+    if isinstance(video_frames, (VideoFrameStore, SyncedFrames)):
+        # pickles to the video's path, frame pack and frame map, the worker reads the frames itself
+        return video_frames
+    frames = [video_frames[i] for i in range(start, min(stop, len(video_frames)))]
+    return FrameSlice(frames, start, len(video_frames))
+
+
+def _render_chunk(layout_name, layout, start, threejs_frames, video_frames, fps, segment_path, on_frame=None):
+    """Composite and encode one chunk into its own segment file. Runs in a worker process."""
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(str(segment_path), fourcc, fps, layout["output_size"])
+    compositor = MultiVideoCompositor(layout) if layout_name == "multi" else None
+    try:
+        for offset, threejs_frame in enumerate(threejs_frames):
+            frame_number = start + offset
+            if layout_name == "multi":
+                frame = compositor.composite(threejs_frame, frame_number, video_frames)
+            elif layout_name == "combined":
+                frame = combined_video_frame(threejs_frame, video_frames[frame_number], *layout["frame_size"])
+            else:
+                frame = composite_video_frame(threejs_frame, video_frames[frame_number], layout)
+            out.write(frame)
+            if on_frame is not None:
+                on_frame(offset + 1)
+    finally:
+        out.release()
+    return len(threejs_frames)
+
+
+@timed(function_seconds, function="concatenate_segments")
+def concatenate_segments(segment_paths: list[Path], video_name: Path, fps: float = 30.0):
+    """Join segments without re-encoding, or by re-encoding them with OpenCV if ffmpeg isn't installed"""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        list_path = Path(segment_paths[0]).parent / "segments.txt"
+        list_path.write_text("".join(f"file '{Path(path).as_posix()}'\n" for path in segment_paths))
+        subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                        "-i", str(list_path), "-c", "copy", str(video_name)], check=True)
+        return
+
+    logger.warning("ffmpeg not found, re-encoding segments with OpenCV to concatenate them")
+    out = None
+    for segment_path in segment_paths:
+        cap = cv2.VideoCapture(str(segment_path))
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if out is None:
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                out = cv2.VideoWriter(str(video_name), fourcc, fps, (frame.shape[1], frame.shape[0]))
+            out.write(frame)
+        cap.release()
+    if out is not None:
+        out.release()
+
+
+def _run_chunk(render, segment_path):
+    start_time = time.perf_counter()
+    frames_rendered = render(segment_path)
+    return frames_rendered, time.perf_counter() - start_time
+
+
+def render_segments(chunk_renderer,
+                    video_name: Path,
+                    start: int,
+                    end: int,
+                    fps: float = 30.0,
+                    chunk_size: int = CHUNK_SIZE,
+                    processes: int | None = None,
+                    on_progress=None,
+                    executor: Executor | None = None) -> int:
+    """
+    Render frames start..end into `video_name` one chunk per worker process, then join the segments.
+
+    `chunk_renderer(chunk_start, chunk_stop)` is called here and returns a picklable
+    `render(segment_path, on_frame=None)` (a `functools.partial` of a module-level function)
+    that writes those frames and returns how many it wrote. `on_progress(frames_done)` is called
+    here as frames are done; an exception from it stops the render.
+
+    Chunks, and joining them, go to `executor` when one is given, such as the export job
+    manager's shared chunk pool. Otherwise a pool of `processes` is started for this render,
+    and a range that fits in one chunk, or a single process, renders in this process straight
+    into `video_name`, reporting every frame.
+    """
+    chunk_starts = list(range(start, end, chunk_size)) or [start]
+    if executor is None:
+        processes = processes or os.cpu_count() or 1
+        if len(chunk_starts) == 1 or processes == 1:
+            frames_rendered, seconds = _run_chunk(partial(chunk_renderer(start, end), on_frame=on_progress), video_name)
+            function_seconds.observe(seconds, function="render_chunk")
+            return frames_rendered
+
+    frames_rendered = 0
+    with tempfile.TemporaryDirectory(prefix="export_segments_", dir=Path(video_name).parent) as segment_folder:
+        segment_paths = [Path(segment_folder) / f"segment_{chunk_start:08d}.mp4" for chunk_start in chunk_starts]
+        pool = executor or ProcessPoolExecutor(max_workers=min(processes, len(chunk_starts)))
+        futures = []
+        try:
+            futures = [pool.submit(_run_chunk, chunk_renderer(chunk_start, min(chunk_start + chunk_size, end)), segment_path)
+                       for chunk_start, segment_path in zip(chunk_starts, segment_paths)]
+            for future in as_completed(futures):
+                chunk_frames, seconds = future.result()
+                function_seconds.observe(seconds, function="render_chunk")
+                frames_rendered += chunk_frames
+                if on_progress is not None:
+                    on_progress(frames_rendered)
+        finally:
+            if executor is None:
+                pool.shutdown(wait=True, cancel_futures=True)
+            else:
+                # the pool is shared: drop this render's queued chunks and let the running ones finish before their folder goes
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+
+        if len(segment_paths) == 1:
+            os.replace(segment_paths[0], video_name)
+        elif executor is None:
+            concatenate_segments(segment_paths, video_name, fps)
+        else:
+            executor.submit(concatenate_segments, segment_paths, video_name, fps).result()
+    return frames_rendered
+
+
+@timed(function_seconds, function="render_video_parallel")
+def render_video_parallel(layout_name: str,
+                          video_name: Path,
+                          threejs_frames,
+                          video_frames,
+                          width: int,
+                          height: int,
+                          fps: float = 30.0,
+                          chunk_size: int = CHUNK_SIZE,
+                          processes: int | None = None):
+    """
+    Render one of the export layouts with a pool of worker processes.
+
+    Arguments mirror the serial `create_*` functions in `video_export`:
+    `video_frames` is the dict of per-camera frames for the "multi" layout
+    and a single camera's frames otherwise.
+    """
+    if layout_name not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout_name}', expected one of {LAYOUTS}")
+    start_time = time.perf_counter()
+
+    first_threejs_frame = threejs_frames[0]
+    if layout_name == "multi":
+        num_frames = len(threejs_frames)
+        frame_height, frame_width = first_threejs_frame.shape[:2]
+        layout = multi_video_layout(video_frames, frame_width, frame_height)
+        layout["output_size"] = layout["frame_size"]
+    elif layout_name == "combined":
+        num_frames = min(len(threejs_frames), len(video_frames))
+        layout = {"frame_size": (width, height), "output_size": (width * 2, height)}
+    else:
+        num_frames = min(len(threejs_frames), len(video_frames))
+        layout = composite_video_layout(first_threejs_frame, video_frames)
+        layout["output_size"] = layout["frame_size"]
+
+    def chunk_renderer(start: int, stop: int):
+        if layout_name == "multi":
+            chunk_video_frames = {video_id: _chunk_of(frames, start, stop) for video_id, frames in video_frames.items()}
+        else:
+            chunk_video_frames = _chunk_of(video_frames, start, stop)
+        chunk_threejs_frames = [threejs_frames[i] for i in range(start, stop)]
+        return partial(_render_chunk, layout_name, layout, start, chunk_threejs_frames, chunk_video_frames, fps)
+
+    frames_rendered = render_segments(chunk_renderer, video_name, 0, num_frames, fps, chunk_size, processes)
+
+    elapsed = time.perf_counter() - start_time
+    logger.info(f"Rendered {video_name} with layout '{layout_name}': {frames_rendered} frames in {elapsed:.2f} seconds "
+                f"({frames_rendered / elapsed:.1f} frames/sec)")
+    return frames_rendered
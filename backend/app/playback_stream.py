@@ -0,0 +1,228 @@
+"""
+Push-based playback over a WebSocket.
+
+The client drives the session with JSON text messages:
+
+    {"type": "play"}
+    {"type": "pause"}
+    {"type": "seek", "frame": 120}
+    {"type": "rate", "rate": 0.5}
+    {"type": "ack", "frame": 120}       sent after each frame packet has been displayed
+
+The server answers with a JSON `{"type": "state", ...}` text message whenever the
+playback state changes, `{"type": "error", "message": ...}` for a command it
+can't use (binary messages included, the session stays open), and pushes one
+binary packet per displayed frame. A
+packet is a `trajectory_payload` binary payload holding the (J, 3) skeleton
+slice of the frame, with the per-camera WebP frames appended after it:
+
+    header: {"type": "frame", "frame": n, "shape": [J, 3], ...,
+             "cameras": [{"id": 0, "length": L0}, {"id": 1, "length": L1}, ...]}
+    data:   float32 skeleton slice, then L0 bytes of camera 0, L1 bytes of camera 1, ...
+
+Frames are scheduled from the wall clock, so when the client or the decoder
+falls behind, or more than `max_in_flight` packets are waiting for an ack, the
+frames in between are skipped rather than queued. If sending frames fails, the
+socket is closed with code 1011.
+"""
+import asyncio
+import json
+import logging
+import math
+import time
+
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+from starlette.concurrency import run_in_threadpool
+
+from trajectory_payload import pack_binary_payload
+
+logger = logging.getLogger(__name__)
+
+MAX_IN_FLIGHT = 2
+MIN_RATE = 0.05
+MAX_RATE = 8.0
+INTERNAL_ERROR_CLOSE_CODE = 1011
+
+
+class PlaybackCommandError(ValueError):
+    pass
+
+
+def _number(message: dict, key: str) -> float:
+    value = message.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise PlaybackCommandError(f"'{message.get('type')}' needs a number '{key}', got {value!r}")
+    return value
+
+
+class PlaybackSession:
+    def __init__(self,
+                 websocket: WebSocket,
+                 skeleton_frames: np.ndarray,
+                 frame_stores: dict,
+                 fps: float = 30.0,
+                 max_in_flight: int = MAX_IN_FLIGHT):
+        self.websocket = websocket
+        self.skeleton_frames = skeleton_frames
+        self.frame_stores = frame_stores
+        self.fps = fps
+        self.max_in_flight = max_in_flight
+        self.num_frames = skeleton_frames.shape[0]
+
+        self.playing = False
+        self.rate = 1.0
+        self.frames_sent = 0
+        self.frames_dropped = 0
+
+        # playback position is anchor_frame at anchor_time, advancing at fps * rate while playing
+        self._anchor_frame = 0
+        self._anchor_time = time.perf_counter()
+        self._in_flight = 0
+        self._last_sent_frame = None
+        self._wake = asyncio.Event()
+        self._wake.set()
+
+    def current_frame(self) -> int:
+        if not self.playing:
+            return self._anchor_frame
+        elapsed = time.perf_counter() - self._anchor_time
+        return self._anchor_frame + int(elapsed * self.fps * self.rate)
+
+    def _reanchor(self, frame: int):
+        self._anchor_frame = int(np.clip(frame, 0, max(self.num_frames - 1, 0)))
+        self._anchor_time = time.perf_counter()
+        self._wake.set()
+
+    async def run(self):
+        """Serve the session until the client disconnects, or close it if sending frames fails"""
+        await self.send_state()
+        sender = asyncio.create_task(self._send_frames())
+        receiver = asyncio.create_task(self._receive_commands())
+        try:
+            await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            if sender.done() and not receiver.done():
+                error = sender.exception()
+                if isinstance(error, WebSocketDisconnect):
+                    raise error
+                logger.error(f"Playback stream failed: {error!r}")
+                await self.websocket.close(code=INTERNAL_ERROR_CLOSE_CODE, reason=f"Playback failed: {error}"[:120])
+                return
+            await receiver
+        finally:
+            sender.cancel()
+            receiver.cancel()
+            logger.info(f"Playback session closed: {self.frames_sent} frames sent, {self.frames_dropped} dropped")
+
+    async def send_state(self):
+        await self.websocket.send_text(json.dumps({
+            "type": "state",
+            "playing": self.playing,
+            "frame": self.current_frame(),
+            "rate": self.rate,
+            "fps": self.fps,
+            "num_frames": self.num_frames,
+        }))
+
+    async def send_error(self, message: str):
+        await self.websocket.send_text(json.dumps({"type": "error", "message": message}))
+
+    async def _receive_commands(self):
+        while True:
+            received = await self.websocket.receive()
+            if received["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(received.get("code", 1000), received.get("reason"))
+            text = received.get("text")
+            try:
+                if text is None:
+                    # receive_text() would raise on a binary message and end the session
+                    raise PlaybackCommandError("Commands are JSON text messages, got a binary message")
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise PlaybackCommandError(f"Commands are JSON objects, got {text[:100]!r}")
+                await self._apply_command(message)
+            except (json.JSONDecodeError, PlaybackCommandError) as e:
+                logger.warning(f"Rejected playback command: {e}")
+                await self.send_error(str(e))
+
+    async def _apply_command(self, message: dict):
+        command = message.get("type")
+
+        if command == "ack":
+            self._in_flight = max(0, self._in_flight - 1)
+            self._wake.set()
+            return
+
+        if command == "play":
+            if self.num_frames == 0:
+                raise PlaybackCommandError("There are no frames to play")
+            frame = self.current_frame()
+            self._reanchor(0 if frame >= self.num_frames - 1 else frame)
+            self.playing = True
+        elif command == "pause":
+            self._reanchor(self.current_frame())
+            self.playing = False
+        elif command == "seek":
+            frame = _number(message, "frame")
+            self._last_sent_frame = None
+            self._reanchor(int(frame))
+        elif command == "rate":
+            rate = _number(message, "rate")
+            self._reanchor(self.current_frame())
+            self.rate = float(np.clip(rate, MIN_RATE, MAX_RATE))
+        else:
+            raise PlaybackCommandError(f"Unknown playback command {command!r}")
+        await self.send_state()
+
+    async def _send_frames(self):
+        while True:
+            await self._wake.wait()
+            if self.num_frames == 0:
+                # nothing to send, the state sent on connect already says so
+                self.playing = False
+                self._wake.clear()
+                continue
+            frame = self.current_frame()
+
+            if frame >= self.num_frames:
+                self._reanchor(self.num_frames - 1)
+                self.playing = False
+                await self.send_state()
+                continue
+
+            if frame != self._last_sent_frame:
+                if self._in_flight < self.max_in_flight:
+                    if self._last_sent_frame is not None and self.playing:
+                        self.frames_dropped += max(0, frame - self._last_sent_frame - 1)
+                    await self.websocket.send_bytes(await self._build_packet(frame))
+                    self._last_sent_frame = frame
+                    self._in_flight += 1
+                    self.frames_sent += 1
+                elif not self.playing:
+                    # paused on a new frame while the client is behind, wait for an ack
+                    self._wake.clear()
+                    continue
+
+            if not self.playing:
+                self._wake.clear()
+                continue
+
+            next_frame_time = self._anchor_time + (frame + 1 - self._anchor_frame) / (self.fps * self.rate)
+            await asyncio.sleep(max(0.0, next_frame_time - time.perf_counter()))
+
+    async def _build_packet(self, frame: int) -> bytes:
+        camera_ids = [camera_id for camera_id, frame_store in self.frame_stores.items() if frame_store.synced_frame_numbers(frame, frame + 1)[0] >= 0]
+        encoded_frames = await asyncio.gather(*(run_in_threadpool(self.frame_stores[camera_id].get_synced_frame, frame) for camera_id in camera_ids))
+
+        skeleton_slice = self.skeleton_frames[frame]
+        header = {
+            "type"      : "frame",
+            "frame"     : frame,
+            "shape"     : list(skeleton_slice.shape),
+            "dtype"     : "float32",
+            "byte_order": "little",
+            "cameras"   : [{"id": camera_id, "length": 0 if encoded is None else len(encoded)}
+                           for camera_id, encoded in zip(camera_ids, encoded_frames)],
+        }
+        return b"".join([pack_binary_payload(header, skeleton_slice),
+                         *(encoded for encoded in encoded_frames if encoded is not None)])
@@ -0,0 +1,152 @@
+"""
+Cache of serialized skeleton responses.
+
+The skeleton plots all fetch the same trajectory on page load, so the
+serialized body is built once per (session, trajectory, format, range) and kept
+together with its compressed variants. Entries are keyed on the skeleton's
+fingerprint as well, so a recalculated skeleton simply stops matching its old
+entries, which then age out of the LRU. Bodies are served with a weak ETag
+and `If-None-Match` gets a 304 without touching the body.
+
+Compression uses zstd and brotli when `zstandard` / `brotli` are installed and
+falls back to gzip from the standard library.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from trajectory_codec import QUANTIZED_MEDIA_TYPE
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RESPONSE_CACHE_BUDGET_BYTES = 512 * 1024**2
+# bodies smaller than this go out uncompressed, compressing them costs more than it saves
+MIN_COMPRESS_BYTES = 1024
+# bodies that are compressed already and sent as they are
+PRECOMPRESSED_MEDIA_TYPES = {QUANTIZED_MEDIA_TYPE}
+
+# preferred first
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda body: zstandard.ZstdCompressor(level=6).compress(body)
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=5)
+COMPRESSORS["gzip"] = lambda body: gzip.compress(body, compresslevel=6)
+
+
+def choose_encoding(accept_encoding: str | None) -> str:
+    """Best content coding we can produce that the client accepts"""
+    accepted = set()
+    for coding in (accept_encoding or "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in COMPRESSORS:
+        if encoding in accepted or "*" in accepted:
+            return encoding
+    return "identity"
+
+
+class CachedBody:
+    def __init__(self, key: tuple, body: bytes, media_type: str, version: str):
+        self.key = key
+        self.media_type = media_type
+        self.etag = f'W/"{version}-{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+        self.bodies = {"identity": body}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(body) for body in self.bodies.values())
+
+
+class ResponseCache:
+    def __init__(self, budget_bytes: int = RESPONSE_CACHE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries: OrderedDict[tuple, CachedBody] = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get_or_build(self, key: tuple, version: str, build) -> CachedBody:
+        """
+        Cached body for `key` at `version`, or `build()` -> (body, media_type) stored under it.
+
+        Blocking: call from a worker thread.
+        """
+        full_key = (*key, version)
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None:
+                self._entries.move_to_end(full_key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # concurrent misses on the same key each build; the bodies are identical
+        body, media_type = build()
+        entry = CachedBody(full_key, body, media_type, version)
+        with self._lock:
+            previous = self._entries.pop(full_key, None)
+            if previous is not None:
+                self._nbytes -= previous.nbytes
+            self._entries[full_key] = entry
+            self._nbytes += entry.nbytes
+            self._evict()
+        return entry
+
+    def encoded_body(self, entry: CachedBody, encoding: str) -> tuple[bytes, str]:
+        """Body in the requested coding, compressing it on first use. Returns the body and the coding used."""
+        identity = entry.bodies["identity"]
+        if encoding == "identity" or len(identity) < MIN_COMPRESS_BYTES or entry.media_type in PRECOMPRESSED_MEDIA_TYPES:
+            return identity, "identity"
+        body = entry.bodies.get(encoding)
+        if body is None:
+            body = COMPRESSORS[encoding](identity)
+            with self._lock:
+                if encoding not in entry.bodies:
+                    entry.bodies[encoding] = body
+                    if self._entries.get(entry.key) is entry:
+                        self._nbytes += len(body)
+                        self._evict()
+        return body, encoding
+
+    def response(self, entry: CachedBody, request: Request, headers: dict | None = None) -> Response:
+        """304 if the client has this version, otherwise the body in the best coding it accepts. Blocking."""
+        cache_headers = {"ETag": entry.etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding", **(headers or {})}
+        if_none_match = request.headers.get("if-none-match", "")
+        if entry.etag in (tag.strip() for tag in if_none_match.split(",")) or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=cache_headers)
+
+        body, encoding = self.encoded_body(entry, choose_encoding(request.headers.get("accept-encoding")))
+        if encoding != "identity":
+            cache_headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=entry.media_type, headers=cache_headers)
+
+    def invalidate(self, key_prefix: tuple = ()):
+        """Drop every entry whose key starts with `key_prefix` (everything by default)"""
+        with self._lock:
+            for full_key in [full_key for full_key in self._entries if full_key[:len(key_prefix)] == key_prefix]:
+                self._nbytes -= self._entries.pop(full_key).nbytes
+
+    def _evict(self):
+        while self._nbytes > self.budget_bytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._nbytes -= entry.nbytes
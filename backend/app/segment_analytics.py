@@ -0,0 +1,151 @@
+"""
+Rigidity QA: segment lengths of a trajectory over every frame.
+
+All segments are measured at once by gathering the proximal and distal
+markers of every `segment_connections` entry with two index arrays, so a
+report is a handful of NumPy reductions over an (F, S) array regardless of the
+number of segments. A segment is rigid when the standard deviation of its
+length is below the threshold; for the ones that aren't, the report lists the
+frame ranges whose length is more than the threshold away from the median.
+
+Also runs from the command line, replacing `test_it_works` in minimal/main.py:
+
+    python backend/app/segment_analytics.py <recording folder> --tracker mediapipe --threshold 1e-6
+"""
+import argparse
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+RIGIDITY_THRESHOLD = 1e-6
+OUTLIER_PERCENTILES = (1.0, 99.0)
+MAX_RUNS_PER_SEGMENT = 100
+
+
+def segment_indices(markers: list[str], segment_connections: dict) -> tuple[list[str], np.ndarray, np.ndarray, list[str]]:
+    """Segment names with proximal and distal marker indices, and the segments whose markers aren't tracked"""
+    marker_index = {marker: index for index, marker in enumerate(markers)}
+    names, proximal, distal, skipped = [], [], [], []
+    for segment_name, connection in segment_connections.items():
+        if connection["proximal"] in marker_index and connection["distal"] in marker_index:
+            names.append(segment_name)
+            proximal.append(marker_index[connection["proximal"]])
+            distal.append(marker_index[connection["distal"]])
+        else:
+            skipped.append(segment_name)
+    return names, np.asarray(proximal, dtype=np.intp), np.asarray(distal, dtype=np.intp), skipped
+
+
+def segment_lengths(array: np.ndarray, proximal: np.ndarray, distal: np.ndarray) -> np.ndarray:
+    """(F, S) lengths of every segment in every frame of an (F, J, 3) trajectory"""
+    return np.linalg.norm(array[:, distal] - array[:, proximal], axis=2)
+
+
+def _runs_by_column(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(column, start, stop) of every run of True in each column of an (F, S) mask"""
+    padding = np.zeros((1, mask.shape[1]), dtype=np.int8)
+    edges = np.diff(np.concatenate([padding, mask.astype(np.int8), padding]), axis=0).T
+    # nonzero of the transposed edges is ordered by column, then frame, so starts and stops pair up
+    start_columns, starts = np.nonzero(edges == 1)
+    _, stops = np.nonzero(edges == -1)
+    return start_columns, starts, stops
+
+
+def rigidity_report(lengths: np.ndarray,
+                    names: list[str],
+                    threshold: float = RIGIDITY_THRESHOLD,
+                    outlier_percentiles: tuple[float, float] = OUTLIER_PERCENTILES) -> dict:
+    num_frames = lengths.shape[0]
+    valid = np.isfinite(lengths)
+    with warnings.catch_warnings():
+        # segments that are never tracked reduce over all-NaN columns
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(lengths, axis=0)
+        std = np.nanstd(lengths, axis=0)
+        median = np.nanmedian(lengths, axis=0)
+        low, high = np.nanpercentile(lengths, outlier_percentiles, axis=0)
+        outliers = (lengths < low) | (lengths > high)
+        failing = np.abs(lengths - median) > threshold
+
+    rigid = std < threshold
+    failing &= ~rigid  # only report frames of segments that fail the check
+    run_columns, run_starts, run_stops = _runs_by_column(failing)
+
+    segments = {}
+    for column, name in enumerate(names):
+        in_column = run_columns == column
+        segments[name] = {
+            "mean": _finite_or_none(mean[column]),
+            "std": _finite_or_none(std[column]),
+            "median": _finite_or_none(median[column]),
+            "percentiles": [_finite_or_none(low[column]), _finite_or_none(high[column])],
+            "outlier_frames": int(outliers[:, column].sum()),
+            "missing_frames": int(num_frames - valid[:, column].sum()),
+            "rigid": bool(rigid[column]),
+            "failing_frames": int(failing[:, column].sum()),
+            "failing_ranges": np.stack([run_starts[in_column], run_stops[in_column]], axis=1)[:MAX_RUNS_PER_SEGMENT].tolist(),
+        }
+    return {
+        "num_frames": num_frames,
+        "threshold": threshold,
+        "outlier_percentiles": list(outlier_percentiles),
+        "rigid": bool(rigid.all()),
+        "segments": segments,
+    }
+
+
+def skeleton_rigidity_report(array: np.ndarray,
+                             markers: list[str],
+                             segment_connections: dict,
+                             threshold: float = RIGIDITY_THRESHOLD,
+                             outlier_percentiles: tuple[float, float] = OUTLIER_PERCENTILES) -> dict:
+    """Rigidity report for every segment of an (F, J, 3) trajectory"""
+    names, proximal, distal, skipped = segment_indices(markers, segment_connections)
+    report = rigidity_report(segment_lengths(array, proximal, distal), names, threshold, outlier_percentiles)
+    report["skipped_segments"] = skipped
+    return report
+
+
+def _finite_or_none(value) -> float | None:
+    return float(value) if np.isfinite(value) else None
+
+
+def print_report(report: dict):
+    print(f"\nRigid segment variance check ({report['num_frames']} frames):\n")
+    print(f"{'Segment':<25} {'Std Dev':>10}   Status")
+    for name, segment in report["segments"].items():
+        std = segment["std"]
+        if std is None:
+            status = "never tracked"
+        elif segment["rigid"]:
+            status = "OK"
+        else:
+            status = f"NOT RIGID (>{report['threshold']}), {segment['failing_frames']} frames"
+        print(f"{name:<25} {std if std is not None else float('nan'):10.6f}   {status}")
+    for name in report["skipped_segments"]:
+        print(f"{name:<25} {'':>10}   skipped, markers not tracked")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the segments of a recording's rigid skeleton keep their length")
+    parser.add_argument("recording_folder_path", type=Path)
+    parser.add_argument("--tracker", default="mediapipe")
+    parser.add_argument("--threshold", type=float, default=RIGIDITY_THRESHOLD)
+    args = parser.parse_args()
+
+    # imported here so the analytics themselves don't need skellymodels
+    from tracker_loaders import load_skeleton
+    from trajectory_payload import trajectory_array
+
+    skeleton, _ = load_skeleton(args.recording_folder_path, args.tracker)
+    report = skeleton_rigidity_report(trajectory_array(skeleton),
+                                      list(skeleton.body.rigid_xyz.landmark_names),
+                                      skeleton.body.anatomical_structure.segment_connections,
+                                      args.threshold)
+    print_report(report)
+    raise SystemExit(0 if report["rigid"] else 1)
+
+
+if __name__ == "__main__":
+    main()
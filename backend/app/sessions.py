@@ -0,0 +1,270 @@
+"""
+Recording sessions loaded on demand.
+
+A session is one recording folder loaded with one tracker: its skeleton and
+the frame stores of its annotated videos. Sessions are loaded in a worker
+thread the first time they are requested, so other sessions keep being served
+while a large recording loads, and are kept in an LRU that closes whole
+sessions once their estimated memory use exceeds the budget. Requests hold
+the sessions they use (`SessionManager.use`), and an evicted session that is
+still held is closed when its last user releases it. Closing waits for the
+indexing threads and scanning for recordings walks the folder tree, so both run
+in the thread pool rather than on the event loop, and a request for an unknown
+recording rescans at most every RECORDINGS_REFRESH_SECONDS.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+from derived_data import DerivedData
+from tracker_loaders import TRACKERS, annotated_videos_path, load_skeleton, load_skeleton_frames
+from trajectory_lod import pyramid_nbytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACKER = "mediapipe"
+SESSION_MEMORY_BUDGET_BYTES = 8 * 1024**3
+FRAME_CACHE_BUDGET_BYTES = 20 * 1024**3
+# skellymodels keeps several float64 trajectories per model, the float32 (F, J, 3) array underestimates it
+SKELETON_MEMORY_FACTOR = 8
+SESSION_SEARCH_DEPTH = 4
+RECORDINGS_REFRESH_SECONDS = 10
+
+
+class RecordingSession:
+    def __init__(self, session_id: str, recording_folder_path: Path, tracker: str, cache_root_path: Path | None = None):
+        self.id = session_id
+        self.recording_folder_path = recording_folder_path
+        self.tracker = tracker
+
+        # a recording opened before memory-maps its trajectory sidecar and loads the model on first use
+        self.skeleton_frames, self.marker_names, self.segment_connections, self._skeleton = load_skeleton_frames(recording_folder_path, tracker)
+        self._derived_data = None if self._skeleton is None else DerivedData(recording_folder_path, tracker, self._skeleton)
+        self._skeleton_lock = threading.Lock()
+        self.annotated_video_folder_path = annotated_videos_path(recording_folder_path, tracker)
+        # the frame modules bring in cv2, which importing the app shouldn't pay for
+        from frame_store import open_frame_stores
+        self.frame_stores = open_frame_stores(sorted(self.annotated_video_folder_path.glob('*.mp4')))
+        # frame packs and frame times live next to the videos unless a cache folder is configured
+        if cache_root_path is None:
+            self.frame_cache_folder_path = self.annotated_video_folder_path/'frame_cache'
+        else:
+            self.frame_cache_folder_path = Path(cache_root_path)/self.id/self.annotated_video_folder_path.name
+
+        self._stop_indexing = threading.Event()
+        self._indexing_threads: list[threading.Thread] = []
+        self._users = 0
+        self._retired = False
+        self._users_lock = threading.Lock()
+
+    @property
+    def skeleton(self):
+        """The skellymodels model, loaded on first use. Call `ensure_skeleton` off the event loop before using it there."""
+        return self.ensure_skeleton()
+
+    @property
+    def derived_data(self) -> DerivedData:
+        self.ensure_skeleton()
+        return self._derived_data
+
+    def ensure_skeleton(self):
+        """Load the model if the session was opened from the trajectory sidecar, and return it"""
+        with self._skeleton_lock:
+            if self._skeleton is None:
+                self._skeleton, _ = load_skeleton(self.recording_folder_path, self.tracker)
+                self._derived_data = DerivedData(self.recording_folder_path, self.tracker, self._skeleton)
+            return self._skeleton
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated resident memory of the session"""
+        skeleton_bytes = self.skeleton_frames.nbytes
+        if self._skeleton is not None:
+            skeleton_bytes = skeleton_bytes * SKELETON_MEMORY_FACTOR + pyramid_nbytes(self._skeleton)
+        return skeleton_bytes + sum(frame_store.cache_nbytes for frame_store in self.frame_stores.values())
+
+    def start_indexing(self, frame_cache_budget_bytes: int = FRAME_CACHE_BUDGET_BYTES):
+        """Build the frame packs and frame maps in background threads, stopped and waited for by `close`"""
+        from frame_pack import attach_frame_packs
+        from frame_sync import attach_frame_maps
+        self._indexing_threads = [
+            threading.Thread(target=attach_frame_packs,
+                             args=(self.frame_stores, self.frame_cache_folder_path, frame_cache_budget_bytes, self._stop_indexing),
+                             daemon=True,
+                             name=f"frame-pack-builder-{self.id}"),
+            threading.Thread(target=attach_frame_maps,
+                             args=(self.frame_stores, self.recording_folder_path, len(self.skeleton_frames), self.frame_cache_folder_path,
+                                   self._stop_indexing),
+                             daemon=True,
+                             name=f"frame-sync-{self.id}"),
+        ]
+        for thread in self._indexing_threads:
+            thread.start()
+
+    def acquire(self) -> bool:
+        """Mark the session in use, False if it has already been evicted"""
+        with self._users_lock:
+            if self._retired:
+                return False
+            self._users += 1
+            return True
+
+    def release(self) -> bool:
+        """Mark one use done. True if the session has been evicted and this was its last user, so it is due to be closed."""
+        with self._users_lock:
+            self._users -= 1
+            return self._retired and self._users == 0
+
+    def retire(self) -> int:
+        """Stop new uses of the session. Returns the number of users still holding it; it is due to be closed once that is 0."""
+        with self._users_lock:
+            self._retired = True
+            return self._users
+
+    def close(self):
+        # the indexing threads decode the videos, they have to be done before the stores close
+        self._stop_indexing.set()
+        for thread in self._indexing_threads:
+            thread.join()
+        for frame_store in self.frame_stores.values():
+            frame_store.close()
+
+
+def find_recordings(recordings_root_path: Path, max_depth: int = SESSION_SEARCH_DEPTH) -> dict[str, Path]:
+    """Recording folders (folders with an `output_data` subfolder) under the root, keyed by folder name"""
+    recordings = {}
+    for depth in range(max_depth):
+        for output_data_path in sorted(recordings_root_path.glob("/".join(["*"] * depth + ["output_data"]))):
+            recording_folder_path = output_data_path.parent
+            if recording_folder_path.name in recordings:
+                logger.warning(f"Ignoring {recording_folder_path}, a recording named {recording_folder_path.name} was already found")
+                continue
+            recordings[recording_folder_path.name] = recording_folder_path
+    return recordings
+
+
+class SessionManager:
+    def __init__(self,
+                 recordings_root_path: Path,
+                 memory_budget_bytes: int = SESSION_MEMORY_BUDGET_BYTES,
+                 frame_cache_budget_bytes: int = FRAME_CACHE_BUDGET_BYTES,
+                 cache_root_path: Path | None = None):
+        self.recordings_root_path = Path(recordings_root_path)
+        self.memory_budget_bytes = memory_budget_bytes
+        self.frame_cache_budget_bytes = frame_cache_budget_bytes
+        self.cache_root_path = cache_root_path
+
+        self._recordings: dict[str, Path] | None = None
+        self._recordings_found_at = 0.0
+        self._closing: set[asyncio.Future] = set()
+        self._sessions: OrderedDict[tuple[str, str], RecordingSession] = OrderedDict()
+        self._loading: dict[tuple[str, str], asyncio.Future] = {}
+
+    async def recordings(self, refresh: bool = False) -> dict[str, Path]:
+        """Recordings under the root, rescanned on `refresh` unless the last scan was less than RECORDINGS_REFRESH_SECONDS ago"""
+        if self._recordings is None or (refresh and time.monotonic() - self._recordings_found_at >= RECORDINGS_REFRESH_SECONDS):
+            # set before scanning so requests arriving during the scan don't start another one
+            self._recordings_found_at = time.monotonic()
+            self._recordings = await run_in_threadpool(find_recordings, self.recordings_root_path)
+        return self._recordings
+
+    async def find(self, session_id: str) -> Path | None:
+        """Folder of a recording, rescanning for recordings added since the last scan if it isn't known"""
+        recording_folder_path = (await self.recordings()).get(session_id)
+        if recording_folder_path is None:
+            recording_folder_path = (await self.recordings(refresh=True)).get(session_id)
+        return recording_folder_path
+
+    def loaded_sessions(self) -> list[RecordingSession]:
+        return list(self._sessions.values())
+
+    async def get(self, session_id: str, tracker: str = DEFAULT_TRACKER) -> RecordingSession:
+        """Return a loaded session, loading it off the event loop if needed. Concurrent requests share one load."""
+        if tracker not in TRACKERS:
+            raise ValueError(f"Unknown tracker '{tracker}', expected one of {TRACKERS}")
+        key = (session_id, tracker)
+
+        session = self._sessions.get(key)
+        if session is not None:
+            self._sessions.move_to_end(key)
+            return session
+
+        loading = self._loading.get(key)
+        if loading is None:
+            recording_folder_path = await self.find(session_id)
+            if recording_folder_path is None:
+                raise KeyError(session_id)
+            # another request may have started loading it while the recordings were scanned
+            if key in self._sessions or key in self._loading:
+                return await self.get(session_id, tracker)
+            loading = asyncio.ensure_future(run_in_threadpool(RecordingSession, session_id, recording_folder_path, tracker, self.cache_root_path))
+            self._loading[key] = loading
+            loading.add_done_callback(lambda future: self._finish_loading(key, future))
+
+        return await asyncio.shield(loading)
+
+    async def acquire(self, session_id: str, tracker: str = DEFAULT_TRACKER) -> RecordingSession:
+        """Like `get`, but the session can't be closed by eviction until `release` is called on it"""
+        while True:
+            session = await self.get(session_id, tracker)
+            if session.acquire():
+                return session
+            # evicted between loading and now, load it again
+
+    async def release(self, session: RecordingSession):
+        """Release a session from `acquire`, closing it if it was evicted while held"""
+        if session.release():
+            await run_in_threadpool(session.close)
+
+    @asynccontextmanager
+    async def use(self, session_id: str, tracker: str = DEFAULT_TRACKER):
+        session = await self.acquire(session_id, tracker)
+        try:
+            yield session
+        finally:
+            await self.release(session)
+
+    async def load_trackers(self, session_id: str, trackers) -> list[RecordingSession]:
+        """Load several trackers of one recording concurrently"""
+        return list(await asyncio.gather(*(self.get(session_id, tracker) for tracker in trackers)))
+
+    def _finish_loading(self, key: tuple[str, str], future: asyncio.Future):
+        self._loading.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            logger.error(f"Could not load session {key[0]} ({key[1]}): {future.exception() if not future.cancelled() else 'cancelled'}")
+            return
+        session = future.result()
+        self._sessions[key] = session
+        logger.info(f"Loaded session {session.id} ({session.tracker}), ~{session.nbytes / 1e6:.0f} MB")
+        session.start_indexing(self.frame_cache_budget_bytes)
+        self._evict(keep=key)
+
+    def _evict(self, keep: tuple[str, str]):
+        total_bytes = sum(session.nbytes for session in self._sessions.values())
+        for key in list(self._sessions.keys()):
+            if total_bytes <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            session = self._sessions.pop(key)
+            total_bytes -= session.nbytes
+            users = session.retire()
+            if users == 0:
+                self._close_in_background(session)
+            logger.info(f"Evicted session {session.id} ({session.tracker})" + (f", closing once {users} users are done" if users else ""))
+
+    def _close_in_background(self, session: RecordingSession):
+        closing = asyncio.ensure_future(run_in_threadpool(session.close))
+        self._closing.add(closing)
+        closing.add_done_callback(self._closing.discard)
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
@@ -0,0 +1,219 @@
+"""
+Headless skeleton rendering for exports, with OpenCV on the CPU.
+
+Instead of the browser stepping through every frame and uploading PNGs of its
+three.js canvas, the server projects the rigid trajectory through a pinhole
+camera and draws the segments as lines and the markers as dots. The default
+camera is the one Skeleton3DPlot.vue starts with (fov 75, at (0, 250, 500)
+looking at the origin, z up) on the same white background and ground grid.
+Camera and grid are in the units of the three.js scene, which draws the
+trajectory (in millimetres) scaled by SCENE_SCALE, so a camera read off the
+browser view renders the same picture.
+
+The whole trajectory is projected with a single `cv2.projectPoints` call since
+the camera doesn't move, and the grid is drawn once into the background, so a
+frame costs a copy of the background plus the line and dot drawing. Frames go
+straight into the `MultiVideoCompositor` used by the other exports. Longer
+exports are split into chunks with `parallel_export.render_segments`, rendered
+on the export job manager's shared chunk pool.
+"""
+import logging
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+from parallel_export import render_segments
+from segment_analytics import segment_indices
+from video_export import MultiVideoCompositor, multi_video_layout
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAMERA_POSITION = (0.0, 250.0, 500.0)
+DEFAULT_CAMERA_TARGET = (0.0, 0.0, 0.0)
+DEFAULT_CAMERA_UP = (0.0, 0.0, 1.0)
+DEFAULT_FOV_DEGREES = 75.0
+NEAR_PLANE = 0.1
+SCENE_SCALE = 0.1                    # Skeleton3DPlot.vue divides marker positions by 10
+
+BACKGROUND_COLOR = (255, 255, 255)   # BGR
+SEGMENT_COLOR = (0, 0, 0)
+MARKER_COLOR = (0, 0, 0)
+GRID_COLOR = (136, 136, 136)
+GRID_SIZE = 500.0                    # matches the GridHelper in Skeleton3DPlot.vue
+GRID_DIVISIONS = 10
+SEGMENT_THICKNESS = 2
+MARKER_RADIUS = 3
+CANCEL_CHECK_INTERVAL_FRAMES = 30
+
+# sub-pixel precision of the drawing calls: coordinates are passed as fixed point with this many fractional bits
+DRAW_SHIFT = 4
+
+
+class Camera:
+    """Pinhole camera looking from `position` at `target`, with a vertical field of view like three.js"""
+
+    def __init__(self,
+                 position=DEFAULT_CAMERA_POSITION,
+                 target=DEFAULT_CAMERA_TARGET,
+                 up=DEFAULT_CAMERA_UP,
+                 fov: float = DEFAULT_FOV_DEGREES):
+        self.position = np.asarray(position, dtype=np.float64)
+        self.target = np.asarray(target, dtype=np.float64)
+        self.up = np.asarray(up, dtype=np.float64)
+        self.fov = float(fov)
+
+        forward = self.target - self.position
+        if not np.linalg.norm(forward) > 0:
+            raise ValueError("Camera position and target must differ")
+        forward /= np.linalg.norm(forward)
+        right = np.cross(forward, self.up)
+        if not np.linalg.norm(right) > 0:
+            raise ValueError("Camera up direction must not be parallel to the view direction")
+        right /= np.linalg.norm(right)
+        # OpenCV camera axes: x right, y down, z forward
+        self.rotation = np.stack([right, np.cross(forward, right), forward])
+
+    def intrinsics(self, width: int, height: int) -> np.ndarray:
+        focal_length = (height / 2) / np.tan(np.radians(self.fov) / 2)
+        return np.array([[focal_length, 0, width / 2], [0, focal_length, height / 2], [0, 0, 1]], dtype=np.float64)
+
+    def project(self, points: np.ndarray, width: int, height: int) -> tuple[np.ndarray, np.ndarray]:
+        """Pixel coordinates of (..., 3) points, and whether each is finite and in front of the camera"""
+        flat_points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        visible = np.isfinite(flat_points).all(axis=1)
+        visible &= (flat_points - self.position) @ self.rotation[2] > NEAR_PLANE
+
+        rotation_vector, _ = cv2.Rodrigues(self.rotation)
+        translation = -self.rotation @ self.position
+        pixels, _ = cv2.projectPoints(np.where(visible[:, None], flat_points, 0.0), rotation_vector, translation,
+                                      self.intrinsics(width, height), None)
+        shape = np.shape(points)[:-1]
+        return pixels.reshape(*shape, 2), visible.reshape(shape)
+
+
+def _fixed_point(pixels: np.ndarray, width: int, height: int) -> np.ndarray:
+    """Pixel coordinates as the int32 fixed point OpenCV draws with, clamped well outside the frame"""
+    limit = 8 * max(width, height)
+    return np.round(np.clip(pixels, -limit, limit) * (1 << DRAW_SHIFT)).astype(np.int32)
+
+
+class SkeletonRenderer:
+    """
+    Draws frames of an (F, J, 3) trajectory as seen by a camera.
+
+    `render` returns the same buffer every call, like `MultiVideoCompositor.composite`,
+    so write or copy it before rendering the next frame.
+    """
+
+    def __init__(self,
+                 skeleton_frames: np.ndarray,
+                 markers: list[str],
+                 segment_connections: dict,
+                 camera: Camera,
+                 width: int,
+                 height: int,
+                 draw_grid: bool = True):
+        self.width = width
+        self.height = height
+        pixels, visible = camera.project(np.asarray(skeleton_frames) * SCENE_SCALE, width, height)
+        self._points = _fixed_point(pixels, width, height)
+        self._visible = visible
+        _, self._proximal, self._distal, skipped = segment_indices(markers, segment_connections)
+        if skipped:
+            logger.info(f"Not drawing segments without tracked markers: {skipped}")
+
+        self._background = np.full((height, width, 3), BACKGROUND_COLOR, dtype=np.uint8)
+        if draw_grid:
+            self._draw_grid(camera)
+        self._frame = np.empty_like(self._background)
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _draw_grid(self, camera: Camera):
+        ticks = np.linspace(-GRID_SIZE / 2, GRID_SIZE / 2, GRID_DIVISIONS + 1)
+        half = GRID_SIZE / 2
+        endpoints = np.array([[[tick, -half, 0], [tick, half, 0]] for tick in ticks] +
+                             [[[-half, tick, 0], [half, tick, 0]] for tick in ticks])
+        pixels, visible = camera.project(endpoints, self.width, self.height)
+        lines = _fixed_point(pixels, self.width, self.height)[visible.all(axis=1)]
+        cv2.polylines(self._background, list(lines), False, GRID_COLOR, 1, cv2.LINE_AA, DRAW_SHIFT)
+
+    def render(self, frame_number: int) -> np.ndarray:
+        np.copyto(self._frame, self._background)
+        points = self._points[frame_number]
+        visible = self._visible[frame_number]
+
+        drawn = visible[self._proximal] & visible[self._distal]
+        if drawn.any():
+            segments = np.stack([points[self._proximal[drawn]], points[self._distal[drawn]]], axis=1)
+            cv2.polylines(self._frame, list(segments), False, SEGMENT_COLOR, SEGMENT_THICKNESS, cv2.LINE_AA, DRAW_SHIFT)
+        for x, y in points[visible]:
+            cv2.circle(self._frame, (int(x), int(y)), MARKER_RADIUS << DRAW_SHIFT, MARKER_COLOR, -1, cv2.LINE_AA, DRAW_SHIFT)
+        return self._frame
+
+
+def _render_chunk(context,
+                  video_frames_dict: dict,
+                  skeleton_frames: np.ndarray,
+                  markers: list[str],
+                  segment_connections: dict,
+                  camera: Camera,
+                  width: int,
+                  height: int,
+                  start: int,
+                  fps: float,
+                  segment_path,
+                  on_frame=None) -> int:
+    """Render and composite `skeleton_frames`, which are frames start.. of the recording, into one segment"""
+    renderer = SkeletonRenderer(skeleton_frames, markers, segment_connections, camera, width, height)
+    compositor = MultiVideoCompositor(multi_video_layout(video_frames_dict, width, height))
+    out = cv2.VideoWriter(str(segment_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for offset in range(len(renderer)):
+            if offset % CANCEL_CHECK_INTERVAL_FRAMES == 0:
+                context.raise_if_cancelled()
+            out.write(compositor.composite(renderer.render(offset), start + offset, video_frames_dict))
+            if on_frame is not None:
+                on_frame(offset + 1)
+    finally:
+        out.release()
+    return len(renderer)
+
+
+def export_rendered_skeleton(context,
+                             chunk_executor,
+                             video_name,
+                             video_frames_dict: dict,
+                             skeleton_frames: np.ndarray,
+                             markers: list[str],
+                             segment_connections: dict,
+                             camera: Camera,
+                             width: int,
+                             height: int,
+                             start: int,
+                             end: int,
+                             fps: float = 30.0):
+    """
+    Export job rendering frames start..end of the skeleton on the server and compositing the cameras over them.
+
+    Started with `ExportJobManager.start_chunked`: runs on a thread of the web process with an
+    `export_jobs.JobContext`, and the chunks render on `chunk_executor`, the manager's shared chunk pool.
+    """
+    start_time = time.perf_counter()
+    total_frames = end - start
+
+    def chunk_renderer(chunk_start: int, chunk_stop: int):
+        return partial(_render_chunk, context, video_frames_dict, skeleton_frames[chunk_start:chunk_stop], markers,
+                       segment_connections, camera, width, height, chunk_start, fps)
+
+    def on_progress(frames_done: int):
+        context.report(frames_done, total_frames)
+        context.raise_if_cancelled()
+
+    render_segments(chunk_renderer, video_name, start, end, fps, on_progress=on_progress, executor=chunk_executor)
+
+    context.report(total_frames, total_frames, force=True)
+    logger.info(f"Rendered export saved as {video_name} ({total_frames} frames in {time.perf_counter() - start_time:.2f} seconds)")
@@ -0,0 +1,332 @@
+"""
+Incremental composite export fed directly by `/upload-frames`.
+
+The upload handler decodes every batch in a thread pool (`stage_upload_batch`)
+and stages the raw BGR frames for the export job. In the job, frames are parked
+in a small reorder window keyed by frame number, and a writer thread composites
+and encodes them in order as soon as the next frame is available. Frames are
+dropped as soon as they are written, so peak memory depends on the window size
+rather than on the length of the recording. A frame that still
+hasn't shown up `frame_timeout` seconds after a later frame was submitted is
+logged as missing and skipped, so one lost frame can't stall the export.
+Upload jobs hand frames to the writer in whatever order they are staged.
+A `cancelled` callback, such as the export job's, is polled while waiting and
+before every frame, so a cancelled job stops mid-encode.
+
+Frames arrive as encoded images (PNG, or the much cheaper to encode and decode
+WebP and JPEG) or as raw RGBA pixels, which cost no decoding beyond dropping
+the alpha channel but are several times larger to upload. The handler reports
+the decode time and bytes of every batch in its response.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from export_jobs import STAGED_FRAME_POLL_SECONDS, STAGED_FRAME_TIMEOUT_SECONDS
+from metrics import function_seconds
+from video_export import MultiVideoCompositor, multi_video_layout
+
+logger = logging.getLogger(__name__)
+
+REORDER_WINDOW = 32     # decoded frames allowed ahead of the writer
+DECODE_WORKERS = 4
+FRAME_TIMEOUT_SECONDS = 30      # how long the writer waits on a gap before skipping the frame
+SUBMIT_TIMEOUT_SECONDS = 120    # how long submit_batch waits for the writer to make room
+CANCEL_POLL_SECONDS = 0.25
+
+IMAGE_FORMATS = ("png", "jpeg", "webp")
+RAW_RGBA = "rgba"
+UPLOAD_FORMATS = IMAGE_FORMATS + (RAW_RGBA,)
+RAW_BGR = "bgr"     # decoded frames, as staged by stage_upload_batch
+FRAME_FORMATS = UPLOAD_FORMATS + (RAW_BGR,)
+
+
+def decode_frame(contents: bytes, frame_format: str, frame_size: tuple[int, int] | None = None) -> np.ndarray | None:
+    """BGR image of an encoded or raw frame, None if it doesn't decode. Raw frames need the (width, height) `frame_size`."""
+    if frame_format in IMAGE_FORMATS:
+        return cv2.imdecode(np.frombuffer(contents, np.uint8), cv2.IMREAD_COLOR)
+    width, height = frame_size
+    channels = 4 if frame_format == RAW_RGBA else 3
+    if len(contents) != width * height * channels:
+        return None
+    pixels = np.frombuffer(contents, np.uint8).reshape(height, width, channels)
+    return cv2.cvtColor(pixels, cv2.COLOR_RGBA2BGR) if frame_format == RAW_RGBA else pixels
+
+
+def stage_upload_batch(context, encoded_frames: list[tuple[int, bytes]], frame_format: str,
+                       frame_size: tuple[int, int]) -> tuple[float, float]:
+    """
+    Decode a batch of uploaded (frame number, frame) pairs and stage them as raw BGR frames of `frame_size`.
+
+    Frames are decoded a few at a time in a thread pool, OpenCV releases the GIL
+    while decoding, and staged before the next ones are decoded so a decoded
+    batch never sits in memory. Frames that don't decode are staged empty and
+    written as missing. Returns the seconds spent decoding and staging.
+    """
+    width, height = frame_size
+
+    def decode(encoded_frame):
+        frame_number, contents = encoded_frame
+        with function_seconds.time(function="decode_uploaded_frame"):
+            img = decode_frame(contents, frame_format, frame_size)
+        if img is None:
+            logger.warning(f"Could not decode uploaded frame {frame_number}")
+            return frame_number, b""
+        if img.shape[:2] != (height, width):
+            img = cv2.resize(img, (width, height))
+        return frame_number, img.tobytes()
+
+    decode_seconds = 0.0
+    stage_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="upload-decode") as executor:
+        for chunk_start in range(0, len(encoded_frames), DECODE_WORKERS * 2):
+            start_time = time.perf_counter()
+            decoded_frames = list(executor.map(decode, encoded_frames[chunk_start:chunk_start + DECODE_WORKERS * 2]))
+            decode_seconds += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            context.stage_frames(decoded_frames)
+            stage_seconds += time.perf_counter() - start_time
+    return decode_seconds, stage_seconds
+
+
+class StreamingCompositeWriter:
+    def __init__(self,
+                 video_name: Path,
+                 video_frames_dict: dict,
+                 total_frames: int,
+                 fps: float = 30.0,
+                 window: int = REORDER_WINDOW,
+                 decode_workers: int = DECODE_WORKERS,
+                 frame_format: str = "png",
+                 frame_size: tuple[int, int] | None = None,
+                 frame_timeout: float = FRAME_TIMEOUT_SECONDS,
+                 submit_timeout: float = SUBMIT_TIMEOUT_SECONDS,
+                 cancelled=None):
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(f"Unsupported frame format {frame_format}, expected one of {FRAME_FORMATS}")
+        if frame_format not in IMAGE_FORMATS and frame_size is None:
+            raise ValueError("Raw frames need a frame size")
+        self.video_name = video_name
+        self.video_frames_dict = video_frames_dict
+        self.total_frames = total_frames
+        self.fps = fps
+        self.window = window
+        self.frame_format = frame_format
+        self.frame_size = frame_size    # (width, height)
+        self.frame_timeout = frame_timeout
+        self.submit_timeout = submit_timeout
+        self._is_cancelled = cancelled  # () -> bool, polled
+
+        self._decoded: dict[int, np.ndarray | None] = {}
+        self._next_frame = 0            # next frame the writer will composite
+        self._last_submitted = -1       # highest frame number handed to submit_batch
+        self.frames_skipped = 0
+        self.frames_received = 0
+        self._condition = threading.Condition()
+        self._error: Exception | None = None
+        self._cancelled = False
+        self._decode_seconds = 0.0
+        self._decoded_bytes = 0
+        self._decoded_frames = 0
+        self._decode_executor = ThreadPoolExecutor(max_workers=decode_workers, thread_name_prefix="export-decode")
+        self._writer_thread = threading.Thread(target=self._write_frames, name="export-writer", daemon=True)
+        self._start_time = time.perf_counter()
+        self._writer_thread.start()
+
+    @property
+    def frames_written(self) -> int:
+        return self._next_frame
+
+    def decode_stats(self) -> dict:
+        """Totals over the frames decoded so far; seconds add up across decode threads"""
+        with self._condition:
+            return {
+                "format": self.frame_format,
+                "decoded_frames": self._decoded_frames,
+                "decoded_bytes": self._decoded_bytes,
+                "decode_seconds": self._decode_seconds,
+                "skipped_frames": self.frames_skipped,
+            }
+
+    @property
+    def done(self) -> bool:
+        return not self._writer_thread.is_alive()
+
+    def submit_batch(self, encoded_frames: list[tuple[int, bytes]]):
+        """
+        Decode a batch of (frame number, encoded image) pairs into the reorder window.
+
+        Blocks while a frame is too far ahead of the writer, so callers should run
+        this off the event loop. Raises TimeoutError if the writer makes no room
+        within `submit_timeout` seconds.
+        """
+        futures = []
+        self.frames_received += len(encoded_frames)
+        for frame_number, contents in encoded_frames:
+            with self._condition:
+                self._last_submitted = max(self._last_submitted, frame_number)
+                self._condition.notify_all()
+                deadline = time.monotonic() + self.submit_timeout
+                while not (frame_number < self._next_frame + self.window or self._stopped()):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"Export of {self.video_name} stalled at frame {self._next_frame} for {self.submit_timeout} seconds")
+                    self._condition.wait(min(remaining, CANCEL_POLL_SECONDS))
+                self._raise_if_failed()
+            futures.append(self._decode_executor.submit(self._decode, frame_number, contents))
+        for future in futures:
+            future.result(timeout=self.submit_timeout)
+        self._raise_if_failed()
+
+    def wait(self, timeout: float | None = None):
+        self._writer_thread.join(timeout)
+        self._raise_if_failed()
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    def _stopped(self) -> bool:
+        if not self._cancelled and self._is_cancelled is not None and self._is_cancelled():
+            self._cancelled = True
+        return self._cancelled or self._error is not None
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise RuntimeError(f"Export of {self.video_name} failed: {self._error}") from self._error
+        if self._cancelled:
+            raise RuntimeError(f"Export of {self.video_name} was cancelled")
+
+    def _decode(self, frame_number: int, contents: bytes):
+        start_time = time.perf_counter()
+        with function_seconds.time(function="decode_export_frame"):
+            img = decode_frame(contents, self.frame_format, self.frame_size)
+        decode_seconds = time.perf_counter() - start_time
+        if img is None and len(contents):
+            logger.warning(f"Could not decode frame {frame_number}")
+        with self._condition:
+            self._decode_seconds += decode_seconds
+            self._decoded_bytes += len(contents)
+            self._decoded_frames += 1
+            if frame_number >= self._next_frame:
+                # otherwise the writer already gave up on it
+                self._decoded[frame_number] = img
+            self._condition.notify_all()
+
+    def _wait_for_frame(self, frame_number: int) -> bool:
+        """
+        Wait (holding the condition) until `frame_number` is decoded or given up on. False once stopped.
+
+        Only a gap counts against `frame_timeout`: while nothing later has been
+        submitted the frame may simply not be uploaded yet, and the caller
+        decides how long that may take.
+        """
+        deadline = None
+        while not self._stopped() and frame_number not in self._decoded:
+            if self._last_submitted > frame_number or any(later > frame_number for later in self._decoded):
+                if deadline is None:
+                    deadline = time.monotonic() + self.frame_timeout
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.frames_skipped += 1
+                    logger.warning(f"Frame {frame_number} did not arrive within {self.frame_timeout} seconds")
+                    return True
+                self._condition.wait(min(remaining, CANCEL_POLL_SECONDS))
+            else:
+                self._condition.wait(CANCEL_POLL_SECONDS)
+        return not self._stopped()
+
+    def _write_frames(self):
+        out = None
+        compositor = None
+        try:
+            while self._next_frame < self.total_frames:
+                with self._condition:
+                    frame_number = self._next_frame
+                    if not self._wait_for_frame(frame_number):
+                        break
+                    threejs_frame = self._decoded.pop(frame_number, None)
+
+                if threejs_frame is None:
+                    logger.warning(f"Missing frame: {frame_number}")
+                else:
+                    if out is None:
+                        frame_height, frame_width = threejs_frame.shape[:2]
+                        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                        out = cv2.VideoWriter(str(self.video_name), fourcc, self.fps, (frame_width, frame_height))
+                        compositor = MultiVideoCompositor(multi_video_layout(self.video_frames_dict, frame_width, frame_height))
+                    with function_seconds.time(function="composite_uploaded_frame"):
+                        out.write(compositor.composite(threejs_frame, frame_number, self.video_frames_dict))
+
+                with self._condition:
+                    self._next_frame += 1
+                    self._condition.notify_all()
+
+        except Exception as e:
+            logger.error(f"Error in streaming export: {str(e)}")
+            with self._condition:
+                self._error = e
+                self._condition.notify_all()
+        finally:
+            if out is not None:
+                out.release()
+            self._decode_executor.shutdown(wait=False, cancel_futures=True)
+            with self._condition:
+                self._decoded.clear()
+
+        if self._error is None and not self._cancelled:
+            elapsed = time.perf_counter() - self._start_time
+            logger.info(f"Composite video saved as {self.video_name} ({self.total_frames} frames in {elapsed:.2f} seconds)")
+
+
+def export_staged_upload(context,
+                         video_name: Path,
+                         video_frames_dict: dict,
+                         total_frames: int,
+                         frame_size: tuple[int, int],
+                         fps: float = 30.0,
+                         frame_timeout: float = FRAME_TIMEOUT_SECONDS,
+                         staged_timeout: float = STAGED_FRAME_TIMEOUT_SECONDS):
+    """
+    Export job for `/upload-frames`: composite the raw BGR frames of `frame_size` staged by `stage_upload_batch`.
+
+    Runs in an export worker process with an `export_jobs.JobContext`. Frames
+    are handed to the writer as they land, whatever their order, so a frame
+    that never arrives is skipped after `frame_timeout` seconds instead of
+    holding up the frames behind it. Fails if nothing is staged and the writer
+    makes no progress for `staged_timeout` seconds.
+    """
+    writer = StreamingCompositeWriter(video_name, video_frames_dict, total_frames, fps,
+                                      frame_format=RAW_BGR, frame_size=frame_size,
+                                      frame_timeout=frame_timeout, cancelled=context.cancelled)
+    try:
+        deadline = time.monotonic() + staged_timeout
+        frames_written = writer.frames_written
+        while not writer.done:
+            context.raise_if_cancelled()
+            # frames past the reorder window stay staged until the writer catches up
+            encoded_frames = context.take_staged_frames(writer.frames_written + writer.window)
+            # hand frames over a few at a time so the decode pool works on them in parallel
+            for batch_start in range(0, len(encoded_frames), DECODE_WORKERS * 2):
+                writer.submit_batch(encoded_frames[batch_start:batch_start + DECODE_WORKERS * 2])
+            if encoded_frames or writer.frames_written != frames_written:
+                deadline = time.monotonic() + staged_timeout
+                frames_written = writer.frames_written
+                context.report(frames_written, total_frames, stats=writer.decode_stats())
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f"No frames were uploaded for {staged_timeout} seconds, stopped at frame {frames_written}")
+            else:
+                writer.wait(STAGED_FRAME_POLL_SECONDS)
+        writer.wait()
+    except BaseException:
+        writer.cancel()
+        # the writer reports a cancel as a failure, tell the job manager it was cancelled
+        context.raise_if_cancelled()
+        raise
+    context.report(total_frames, total_frames, force=True, stats=writer.decode_stats())
@@ -0,0 +1,257 @@
+"""
+Tracker loaders driven by `backend/tracker_models/trackers.yaml`.
+
+Each tracker in the registry says where its output lives in a recording folder,
+which file format it is in and which model methods to run after loading, so
+adding a tracker is a YAML edit rather than another branch in a switch.
+
+Besides building the skellymodels model the viewer serves, the tracked points
+of any tracker can be read as one contiguous float32 (F, J, 3) array with
+`load_tracked_points`: float32 `.npy` files are memory-mapped, parquet files
+are read with only the columns needed, and everything else (including `.npy`
+files of another dtype) is read once and kept as a float32 sidecar `.npy` next
+to the recording's output so the next load is a memory map.
+
+Sessions open a recording with `load_skeleton_frames`, which keeps the rigid
+trajectory of the loaded model in a sidecar of its own along with the marker
+names and segments, so reopening a recording memory-maps the trajectory
+instead of loading the model again.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+from trajectory_payload import trajectory_array
+
+logger = logging.getLogger(__name__)
+
+TRACKER_MODELS_FOLDER_PATH = Path(__file__).resolve().parents[1]/'tracker_models'
+TRACKER_REGISTRY_PATH = TRACKER_MODELS_FOLDER_PATH/'trackers.yaml'
+SIDECAR_FOLDER_NAME = 'tracker_cache'
+# long-format columns of freemocap_data_by_frame.parquet; `model` and `type` are optional
+PARQUET_POINT_COLUMNS = ("frame", "keypoint", "x", "y", "z")
+PARQUET_TRAJECTORY_TYPE = "rigid_3d_xyz"
+
+
+def load_registry(registry_path: Path = TRACKER_REGISTRY_PATH) -> dict[str, dict]:
+    with open(registry_path) as registry_file:
+        return yaml.safe_load(registry_file)
+
+
+TRACKER_REGISTRY = load_registry()
+TRACKERS = tuple(TRACKER_REGISTRY)
+
+
+def tracker_spec(tracker: str) -> dict:
+    try:
+        return TRACKER_REGISTRY[tracker]
+    except KeyError:
+        raise ValueError(f"Unknown tracker '{tracker}', expected one of {TRACKERS}")
+
+
+def source_path(recording_folder_path: Path, tracker: str) -> Path:
+    return Path(recording_folder_path)/tracker_spec(tracker)["source"]["path"]
+
+
+def available_trackers(recording_folder_path: Path) -> list[str]:
+    """Trackers whose output exists in the recording folder"""
+    return [tracker for tracker in TRACKERS if source_path(recording_folder_path, tracker).exists()]
+
+
+def model_marker_names(tracker: str) -> list[str] | None:
+    """Tracked point names from the tracker's model definition, if it has one in tracker_models"""
+    model_file_name = tracker_spec(tracker).get("model")
+    if model_file_name is None:
+        return None
+    with open(TRACKER_MODELS_FOLDER_PATH/model_file_name) as model_file:
+        model = yaml.safe_load(model_file)
+    return [str(name) for name in model["aspects"]["body"]["tracked_points"]["names"]]
+
+
+def annotated_videos_path(recording_folder_path: Path, tracker: str) -> Path:
+    return Path(recording_folder_path)/tracker_spec(tracker)["annotated_videos"]
+
+
+def load_skeleton(recording_folder_path: Path, tracker: str):
+    """Load the skeleton of a recording and find the annotated videos that go with it"""
+    # skellymodels takes longer to import than the rest of the app, so it is only imported once a skeleton is loaded
+    from skellymodels.managers.animal import Animal
+    from skellymodels.managers.board import Board
+    from skellymodels.managers.human import Human
+
+    spec = tracker_spec(tracker)
+    data_path = source_path(recording_folder_path, tracker)
+    source_format = spec["source"]["format"]
+
+    if source_format == "npy":
+        skeleton = Board.from_board_definition(**spec["board"])
+        skeleton.add_tracked_points_numpy(np.load(data_path))
+    elif source_format == "human":
+        skeleton = Human.from_data(data_path)
+    elif source_format == "parquet":
+        skeleton = Human.from_parquet(data_path)
+    elif source_format == "animal":
+        skeleton = Animal.from_data(data_path)
+    else:
+        raise ValueError(f"Unknown source format '{source_format}' for tracker '{tracker}' in {TRACKER_REGISTRY_PATH.name}")
+
+    for method_name in spec.get("postprocess", []):
+        getattr(skeleton, method_name)()
+
+    return skeleton, annotated_videos_path(recording_folder_path, tracker)
+
+
+def _source_key(data_path: Path) -> dict:
+    """Size and modification time of the source file, or of every file in a source folder"""
+    files = sorted(path for path in data_path.rglob('*') if path.is_file()) if data_path.is_dir() else [data_path]
+    return {str(path.relative_to(data_path.parent)): [path.stat().st_size, path.stat().st_mtime_ns] for path in files}
+
+
+def _sidecar_paths(recording_folder_path: Path, name: str) -> tuple[Path, Path]:
+    sidecar_folder_path = Path(recording_folder_path)/'output_data'/SIDECAR_FOLDER_NAME
+    return sidecar_folder_path/f"{name}.npy", sidecar_folder_path/f"{name}.json"
+
+
+def _read_sidecar(recording_folder_path: Path, name: str, source_key: dict) -> tuple[np.ndarray, dict] | None:
+    """The memory-mapped sidecar array and its info, or None if it is missing or was written for another version of the source"""
+    sidecar_path, sidecar_info_path = _sidecar_paths(recording_folder_path, name)
+    try:
+        sidecar_info = json.loads(sidecar_info_path.read_text())
+        if sidecar_info["source"] == source_key:
+            return np.load(sidecar_path, mmap_mode='r'), sidecar_info
+    except (OSError, ValueError, KeyError):
+        pass
+    return None
+
+
+def _write_sidecar(recording_folder_path: Path, name: str, source_key: dict, array: np.ndarray, **info):
+    sidecar_path, sidecar_info_path = _sidecar_paths(recording_folder_path, name)
+    try:
+        sidecar_path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = sidecar_path.with_suffix(".tmp.npy")
+        np.save(temporary_path, np.ascontiguousarray(array, dtype="<f4"))
+        os.replace(temporary_path, sidecar_path)
+        sidecar_info_path.write_text(json.dumps({"source": source_key, **info}))
+    except OSError as e:
+        logger.warning(f"Could not write the {name} sidecar to {sidecar_path.parent}: {e}")
+
+
+def quantized_sidecar_path(recording_folder_path: Path, tracker: str, precision: float) -> Path:
+    """Where the quantized trajectory payload of a tracker is cached, see trajectory_codec.py"""
+    return Path(recording_folder_path)/'output_data'/SIDECAR_FOLDER_NAME/f"{tracker}.{precision:g}.qtraj"
+
+
+def _read_parquet_points(data_path: Path) -> tuple[np.ndarray, list[str]] | None:
+    """Pivot the long-format parquet to (F, J, 3) reading only the point columns, or None if it isn't laid out that way"""
+    if pq is None:
+        return None
+    column_names = pq.read_schema(data_path).names
+    if not set(PARQUET_POINT_COLUMNS) <= set(column_names):
+        return None
+    columns = list(PARQUET_POINT_COLUMNS) + [name for name in ("model", "type") if name in column_names]
+    table = pq.read_table(data_path, columns=columns)
+
+    mask = np.ones(table.num_rows, dtype=bool)
+    if "type" in column_names:
+        types = np.asarray(table.column("type").to_numpy(zero_copy_only=False))
+        if (types == PARQUET_TRAJECTORY_TYPE).any():
+            mask &= types == PARQUET_TRAJECTORY_TYPE
+    if "model" in column_names:
+        models = np.asarray(table.column("model").to_numpy(zero_copy_only=False))
+        body_models = [model for model in np.unique(models[mask]) if "body" in str(model)]
+        if body_models:
+            mask &= models == body_models[0]
+
+    frames = np.asarray(table.column("frame").to_numpy(zero_copy_only=False))[mask]
+    keypoints = np.asarray(table.column("keypoint").to_numpy(zero_copy_only=False))[mask]
+    unique_names, first_index, name_index = np.unique(keypoints, return_index=True, return_inverse=True)
+    # keep markers in file order rather than sorted
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    marker_names, marker_index = unique_names[order], rank[name_index]
+    frame_numbers, frame_index = np.unique(frames, return_inverse=True)
+
+    array = np.full((len(frame_numbers), len(marker_names), 3), np.nan, dtype="<f4")
+    for axis, column in enumerate(("x", "y", "z")):
+        array[frame_index, marker_index, axis] = np.asarray(table.column(column).to_numpy(zero_copy_only=False))[mask]
+    return array, [str(name) for name in marker_names]
+
+
+def load_tracked_points(recording_folder_path: Path, tracker: str) -> tuple[np.ndarray, list[str]]:
+    """
+    Tracked points of a tracker as a float32 (F, J, 3) array and their names.
+
+    float32 `.npy` sources are memory-mapped as they are. Other sources are read
+    once (converted `.npy` data, projected parquet columns, or the rigid trajectory
+    of the loaded model) and written to a float32 sidecar `.npy` that later loads
+    memory-map, rewritten whenever the source changes.
+    """
+    spec = tracker_spec(tracker)
+    data_path = source_path(recording_folder_path, tracker)
+    if not data_path.exists():
+        raise FileNotFoundError(f"No {tracker} output at {data_path}")
+
+    npy_array = None
+    if spec["source"]["format"] == "npy":
+        npy_array = np.load(data_path, mmap_mode='r')
+        npy_array = npy_array.reshape(npy_array.shape[0], -1, 3)
+        marker_names = model_marker_names(tracker) or [str(index) for index in range(npy_array.shape[1])]
+        if npy_array.dtype == np.dtype("<f4"):
+            return npy_array, marker_names
+
+    source_key = _source_key(data_path)
+    sidecar = _read_sidecar(recording_folder_path, tracker, source_key)
+    if sidecar is not None:
+        return sidecar[0], sidecar[1]["markers"]
+
+    if npy_array is not None:
+        points = npy_array.astype("<f4"), marker_names
+    elif spec["source"]["format"] == "parquet":
+        points = _read_parquet_points(data_path)
+    else:
+        points = None
+    if points is None:
+        skeleton, _ = load_skeleton(recording_folder_path, tracker)
+        points = trajectory_array(skeleton), list(skeleton.body.rigid_xyz.landmark_names)
+    array, marker_names = points
+
+    _write_sidecar(recording_folder_path, tracker, source_key, array, markers=marker_names)
+    return array, marker_names
+
+
+def load_skeleton_frames(recording_folder_path: Path, tracker: str):
+    """
+    The rigid trajectory of a tracker's skeleton as (float32 (F, J, 3) array, marker names, segment connections, model).
+
+    The first load goes through the model and writes the trajectory to a sidecar,
+    later loads memory-map the sidecar and return None for the model, which the
+    caller loads with `load_skeleton` if it needs more than the trajectory.
+    Unlike `load_tracked_points` this is the trajectory after the tracker's
+    `postprocess` steps, the one the viewer shows.
+    """
+    data_path = source_path(recording_folder_path, tracker)
+    if not data_path.exists():
+        raise FileNotFoundError(f"No {tracker} output at {data_path}")
+    sidecar_name = f"{tracker}.skeleton"
+    source_key = _source_key(data_path)
+    sidecar = _read_sidecar(recording_folder_path, sidecar_name, source_key)
+    if sidecar is not None:
+        array, sidecar_info = sidecar
+        return array, sidecar_info["markers"], sidecar_info["segments"], None
+
+    skeleton, _ = load_skeleton(recording_folder_path, tracker)
+    array = trajectory_array(skeleton)
+    marker_names = list(skeleton.body.rigid_xyz.landmark_names)
+    segment_connections = skeleton.body.anatomical_structure.segment_connections
+    _write_sidecar(recording_folder_path, sidecar_name, source_key, array, markers=marker_names, segments=segment_connections)
+    return array, marker_names, segment_connections, skeleton
@@ -0,0 +1,158 @@
+"""
+Quantized, delta-encoded trajectory payloads (`format=quantized`).
+
+Coordinates are rounded to a fixed precision (0.1 mm by default, so every
+decoded value is within half of that of the original) and sent as integer
+deltas between consecutive tracked samples of each marker: first differences,
+or second differences when the motion is smooth enough for those to be
+smaller. Samples where a marker is missing are left out of the delta stream
+entirely and sent as [start, stop) runs of rows per marker in the header, like
+the `gaps` of the JSON route (rows are frames, except in a downsampled window
+which lists its `frames`). The deltas fit int16 for all but unusually fast or
+coarse data, and after splitting the bytes of every value into planes (low
+bytes first) the stream deflates to a fraction of its float32 size. How small
+depends on the precision asked for relative to the noise in the data.
+
+Layout, in the same envelope as the float32 payloads in trajectory_payload.py:
+
+    uint32 (little-endian)   length N of the JSON header in bytes
+    N bytes                  UTF-8 JSON header (`encoding`, `precision`, `delta_dtype`, `gaps`, ...)
+    0-3 bytes                zero padding
+    rest                     zlib stream of the byte planes of the (3, S) deltas
+
+The deltas run over the tracked samples of marker 0, then marker 1 and so on,
+and the stream starts from zero, so decoding is `delta_order` cumulative sums
+over all S samples per axis. zlib is used because browsers can inflate it with
+`DecompressionStream('deflate')`; since the body is already compressed it is
+not compressed again for transfer.
+
+Full-recording payloads are kept as a sidecar next to the tracker caches in
+output_data (see `tracker_loaders.quantized_sidecar_path`), checked against
+the skeleton fingerprint before use.
+"""
+import json
+import logging
+import os
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+from trajectory_payload import HEADER_LENGTH_FORMAT, marker_gaps
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_MEDIA_TYPE = "application/x-quantized-trajectory"
+DEFAULT_PRECISION = 0.1     # millimetres
+COMPRESSION_LEVEL = 6
+INT16_RANGE = (np.iinfo(np.int16).min, np.iinfo(np.int16).max)
+
+
+def _byte_planes(values: np.ndarray) -> bytes:
+    """Little-endian bytes of `values` regrouped so the k-th byte of every value is contiguous"""
+    as_bytes = values.astype(values.dtype.newbyteorder("<"), copy=False).reshape(-1).view(np.uint8)
+    return np.ascontiguousarray(as_bytes.reshape(-1, values.dtype.itemsize).T).tobytes()
+
+
+def _from_byte_planes(data: bytes, dtype: np.dtype, count: int) -> np.ndarray:
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(np.dtype(dtype).itemsize, count)
+    return np.ascontiguousarray(planes.T).view(np.dtype(dtype).newbyteorder("<")).reshape(count)
+
+
+def encode_quantized(header: dict, array: np.ndarray, markers: list[str], precision: float = DEFAULT_PRECISION) -> bytes:
+    """
+    Quantized payload of an (F, J, 3) array, with `header` describing it extended by the codec fields.
+
+    A marker counts as missing in a frame when any of its coordinates is not finite.
+    """
+    if not precision > 0:
+        raise ValueError(f"precision must be positive, got {precision}")
+    array = np.asarray(array)
+    tracked = np.isfinite(array).all(axis=2).T                               # (J, F)
+    # marker-major so each marker's samples are consecutive in the delta stream
+    samples = np.rint(array.transpose(1, 0, 2)[tracked].astype(np.float64) / precision).astype(np.int64)
+    deltas = np.diff(samples.T, axis=1, prepend=0)                           # (3, S)
+    delta_order = 1
+    second_deltas = np.diff(deltas, axis=1, prepend=0)
+    if np.abs(second_deltas).sum() < np.abs(deltas).sum():
+        deltas, delta_order = second_deltas, 2
+
+    fits_int16 = deltas.size == 0 or (INT16_RANGE[0] <= deltas.min() and deltas.max() <= INT16_RANGE[1])
+    delta_dtype = np.dtype(np.int16 if fits_int16 else np.int32)
+    data = zlib.compress(_byte_planes(deltas.astype(delta_dtype)), COMPRESSION_LEVEL)
+
+    header = {
+        **header,
+        "shape"      : list(array.shape),
+        "encoding"   : "quantized_delta",
+        "precision"  : precision,
+        "max_error"  : precision / 2,
+        "delta_order": delta_order,
+        "delta_dtype": delta_dtype.name,
+        "byte_order" : "little",
+        "num_samples": int(deltas.shape[1]),
+        "compression": "zlib",
+        "gaps"       : marker_gaps(markers, array),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    padding = b"\x00" * (-(struct.calcsize(HEADER_LENGTH_FORMAT) + len(header_bytes)) % 4)
+    return b"".join([struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)), header_bytes, padding, data])
+
+
+def read_quantized_header(payload: bytes) -> tuple[dict, int]:
+    """Header of a quantized payload and the offset its data starts at"""
+    (header_length,) = struct.unpack_from(HEADER_LENGTH_FORMAT, payload)
+    header_end = struct.calcsize(HEADER_LENGTH_FORMAT) + header_length
+    header = json.loads(bytes(payload[struct.calcsize(HEADER_LENGTH_FORMAT):header_end]))
+    return header, header_end + (-header_end % 4)
+
+
+def decode_quantized(payload: bytes) -> tuple[dict, np.ndarray]:
+    """The header and float32 (F, J, 3) array of a quantized payload, with NaN where markers are missing"""
+    header, data_offset = read_quantized_header(payload)
+    num_frames, num_markers, _ = header["shape"]
+    num_samples = header["num_samples"]
+
+    deltas = _from_byte_planes(zlib.decompress(payload[data_offset:]), header["delta_dtype"], 3 * num_samples)
+    samples = deltas.reshape(3, num_samples).astype(np.int64)
+    for _ in range(header["delta_order"]):
+        samples = np.cumsum(samples, axis=1)
+    samples = samples.T * header["precision"]
+
+    # rebuild the tracked mask from the gap runs with one cumulative sum over +1/-1 edges
+    edges = np.zeros((num_markers, num_frames + 1), dtype=np.int32)
+    marker_index = {marker: index for index, marker in enumerate(header["markers"])}
+    for marker, runs in header["gaps"].items():
+        runs = np.asarray(runs, dtype=np.intp).reshape(-1, 2)
+        np.add.at(edges[marker_index[marker]], runs[:, 0], 1)
+        np.add.at(edges[marker_index[marker]], runs[:, 1], -1)
+    tracked = np.cumsum(edges[:, :num_frames], axis=1) == 0
+
+    array = np.full((num_markers, num_frames, 3), np.nan, dtype="<f4")
+    array[tracked] = samples
+    return header, array.transpose(1, 0, 2)
+
+
+def cached_quantized(path: Path, fingerprint: str, build) -> bytes:
+    """
+    Payload stored at `path` if it was built from the skeleton with this fingerprint, otherwise `build()` written there.
+
+    The sidecar is only a cache: failing to read or write it just means encoding again.
+    """
+    try:
+        payload = path.read_bytes()
+        if read_quantized_header(payload)[0].get("fingerprint") == fingerprint:
+            return payload
+    except (OSError, ValueError, struct.error):
+        pass
+
+    payload = build()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_suffix(".tmp")
+        temporary_path.write_bytes(payload)
+        os.replace(temporary_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write the quantized trajectory sidecar {path}: {e}")
+    return payload
@@ -0,0 +1,151 @@
+"""
+Level-of-detail access to long trajectories for plotting.
+
+`TrajectoryPyramid` keeps, for every power-of-two bucket size, the minimum and
+maximum of each marker coordinate in each bucket together with the frame they
+occur at. A window query picks the finest level that fits in `max_points` and
+returns two samples per bucket, the extremes in the order they occur, so peaks
+survive decimation (an M4 / min-max envelope, the same idea as LTTB's goal of
+keeping visually important points). Building the pyramid is O(F) and it is
+cached per skeleton, so zoomed-out views are a slice of a small array and a
+zoomed-in view only touches the frames in its window.
+"""
+import math
+import threading
+import weakref
+
+import numpy as np
+
+from trajectory_payload import skeleton_fingerprint, trajectory_array
+
+
+class TrajectoryPyramid:
+    def __init__(self, array: np.ndarray):
+        self.array = array                  # (F, J, 3) float32, level 0
+        self.num_frames = array.shape[0]
+        # levels[k - 1] holds buckets of 2**k frames: (mins, maxs, argmins, argmaxs)
+        self.levels = []
+
+        mins = maxs = array
+        argmins = argmaxs = np.broadcast_to(np.arange(self.num_frames, dtype=np.int32)[:, None, None], array.shape)
+        while mins.shape[0] > 1:
+            mins, maxs, argmins, argmaxs = self._merge_pairs(mins, maxs, argmins, argmaxs)
+            self.levels.append((mins, maxs, argmins, argmaxs))
+
+    @staticmethod
+    def _merge_pairs(mins, maxs, argmins, argmaxs):
+        if mins.shape[0] % 2:
+            # pad with an empty bucket so the last one can be paired
+            pad = lambda values, fill: np.concatenate([values, np.full((1, *values.shape[1:]), fill, dtype=values.dtype)])
+            mins, maxs = pad(mins, np.nan), pad(maxs, np.nan)
+            argmins, argmaxs = pad(argmins, -1), pad(argmaxs, -1)
+
+        left_min, right_min = mins[0::2], mins[1::2]
+        left_max, right_max = maxs[0::2], maxs[1::2]
+        take_left_min = (left_min <= right_min) | np.isnan(right_min)
+        take_left_max = (left_max >= right_max) | np.isnan(right_max)
+
+        return (np.where(take_left_min, left_min, right_min),
+                np.where(take_left_max, left_max, right_max),
+                np.where(take_left_min, argmins[0::2], argmins[1::2]),
+                np.where(take_left_max, argmaxs[0::2], argmaxs[1::2]))
+
+    @property
+    def nbytes(self) -> int:
+        return sum(level_array.nbytes for level in self.levels for level_array in level)
+
+    def _extremes(self, start: int, stop: int):
+        """(mins, maxs, argmins, argmaxs) of frames start..stop of level 0, NaN for markers without samples there"""
+        segment = self.array[start:stop]
+        missing = np.isnan(segment)
+        argmins = np.where(missing, np.inf, segment).argmin(axis=0)
+        argmaxs = np.where(missing, -np.inf, segment).argmax(axis=0)
+        return (np.take_along_axis(segment, argmins[None], axis=0)[0],
+                np.take_along_axis(segment, argmaxs[None], axis=0)[0],
+                argmins + start,
+                argmaxs + start)
+
+    def window(self, start: int = 0, end: int | None = None, stride: int = 1, max_points: int | None = None):
+        """
+        Frames `start` to `end` (exclusive) for plotting.
+
+        Returns (frames, values, bucket_size): the frame number of each sample,
+        the (N, J, 3) samples and the number of frames each pair of samples
+        summarizes (1 when the window is returned at full or strided rate).
+        """
+        end = self.num_frames if end is None else min(end, self.num_frames)
+        start = max(0, start)
+        if end <= start:
+            return np.empty(0, dtype=np.int64), self.array[:0], 1
+
+        if max_points is None or math.ceil((end - start) / stride) <= max_points:
+            frames = np.arange(start, end, stride)
+            return frames, self.array[start:end:stride], 1
+
+        # finest level with at most max_points samples (2 per bucket) in the window
+        level = 1
+        while level < len(self.levels) and 2 * math.ceil(end / 2**level - start // 2**level) > max(max_points, 2):
+            level += 1
+        bucket_size = 2**level
+        mins, maxs, argmins, argmaxs = self.levels[level - 1]
+        first_bucket, last_bucket = start // bucket_size, math.ceil(end / bucket_size)
+
+        mins, maxs = mins[first_bucket:last_bucket].copy(), maxs[first_bucket:last_bucket].copy()
+        argmins, argmaxs = argmins[first_bucket:last_bucket].copy(), argmaxs[first_bucket:last_bucket].copy()
+        # buckets cut by the window edges are summarized from the frames inside the window only
+        if start % bucket_size:
+            first_stop = min((first_bucket + 1) * bucket_size, end)
+            mins[0], maxs[0], argmins[0], argmaxs[0] = self._extremes(start, first_stop)
+        if end < min(last_bucket * bucket_size, self.num_frames):
+            last_start = max((last_bucket - 1) * bucket_size, start)
+            mins[-1], maxs[-1], argmins[-1], argmaxs[-1] = self._extremes(last_start, end)
+        min_first = argmins <= argmaxs
+        values = np.stack([np.where(min_first, mins, maxs), np.where(min_first, maxs, mins)], axis=1)
+        values = values.reshape(-1, *self.array.shape[1:])
+
+        bucket_starts = np.maximum(np.arange(first_bucket, last_bucket) * bucket_size, start)
+        bucket_ends = np.minimum(np.arange(first_bucket + 1, last_bucket + 1) * bucket_size, end) - 1
+        frames = np.stack([bucket_starts, bucket_ends], axis=1).reshape(-1)
+        return frames, values, bucket_size
+
+
+# keyed by id() since skeleton models needn't be hashable; entries are dropped when the skeleton is collected
+_pyramids: dict[int, tuple[str, TrajectoryPyramid]] = {}
+_pyramids_lock = threading.Lock()
+
+
+def pyramid_for(human) -> TrajectoryPyramid:
+    """Pyramid of the skeleton's rigid trajectory, built on first use and rebuilt if the skeleton is recalculated"""
+    fingerprint = skeleton_fingerprint(human)
+    with _pyramids_lock:
+        cached = _pyramids.get(id(human))
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        pyramid = TrajectoryPyramid(trajectory_array(human))
+        if cached is None:
+            weakref.finalize(human, _pyramids.pop, id(human), None)
+        _pyramids[id(human)] = (fingerprint, pyramid)
+    return pyramid
+
+
+def pyramid_nbytes(human) -> int:
+    """Memory held by the skeleton's cached pyramid, 0 if it hasn't been built"""
+    with _pyramids_lock:
+        cached = _pyramids.get(id(human))
+    return 0 if cached is None else cached[1].nbytes
+
+
+def skeleton_window_header(human, frames: np.ndarray, values: np.ndarray, bucket_size: int) -> dict:
+    """JSON header describing a window, matching the layout of `trajectory_payload.skeleton_header`"""
+    traj = human.body.rigid_xyz
+    return {
+        "markers"     : traj.landmark_names,
+        "segments"    : human.body.anatomical_structure.segment_connections,
+        "num_frames"  : int(traj.num_frames),
+        "frames"      : frames.tolist(),
+        "bucket_size" : bucket_size,
+        "shape"       : list(values.shape),
+        "dtype"       : "float32",
+        "byte_order"  : "little",
+        "nan_sentinel": "NaN",
+    }
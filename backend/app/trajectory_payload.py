@@ -0,0 +1,155 @@
+"""
+Binary trajectory payloads for the viewer.
+
+Layout of a payload produced by `pack_binary_payload`:
+
+    uint32 (little-endian)   length N of the JSON header in bytes
+    N bytes                  UTF-8 JSON header
+    0-3 bytes                zero padding so the data starts on a 4-byte boundary
+    F * J * 3 * 4 bytes      little-endian float32 array of shape (F, J, 3)
+
+The client can wrap the data section in a `Float32Array` without copying.
+Missing or non-finite samples are sent as float32 NaN.
+
+Streamed skeletons (`iter_binary_chunks`) are a sequence of such payloads, one
+per window of frames. The first header also carries the markers and segments;
+every header has the `start` frame and `shape` of its window, so the client
+knows how many bytes to read before the next header. The NDJSON stream
+(`iter_ndjson_chunks`) is one header line followed by one line per window.
+"""
+import hashlib
+import json
+import struct
+
+import numpy as np
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+HEADER_LENGTH_FORMAT = "<I"
+STREAM_CHUNK_FRAMES = 1000
+FINGERPRINT_SAMPLE_FRAMES = 256
+
+
+def trajectory_array(human) -> np.ndarray:
+    """Stack the rigid trajectory into one contiguous float32 (F, J, 3) array with inf replaced by NaN"""
+    traj = human.body.rigid_xyz
+    array = np.stack(list(traj.as_dict.values()), axis=1).astype("<f4", copy=False)
+    array[np.isinf(array)] = np.nan
+    return array
+
+
+def json_values(array: np.ndarray) -> list:
+    """Nested lists of the array with NaN and inf as None, masked in NumPy rather than per Python float"""
+    values = array.astype(object)
+    values[~np.isfinite(array)] = None
+    return values.tolist()
+
+
+def gap_runs(array: np.ndarray, offset: int = 0, frames: np.ndarray | None = None) -> list[list[int]]:
+    """
+    [start, stop) frame ranges where a (N, ...) trajectory has any non-finite coordinate.
+
+    Rows are frames `offset` onwards, or the frame numbers in `frames` for a downsampled window.
+    """
+    missing = ~np.isfinite(array.reshape(array.shape[0], -1)).all(axis=1)
+    runs = np.flatnonzero(np.diff(np.concatenate([[False], missing, [False]]).astype(np.int8))).reshape(-1, 2)
+    if frames is not None:
+        return np.stack([frames[runs[:, 0]], frames[runs[:, 1] - 1] + 1], axis=1).tolist()
+    return (runs + offset).tolist()
+
+
+def marker_gaps(markers: list[str], array: np.ndarray, offset: int = 0, frames: np.ndarray | None = None) -> dict[str, list[list[int]]]:
+    """Gap runs of every marker of an (N, J, 3) array that has any"""
+    missing = ~np.isfinite(array).all(axis=2)
+    return {markers[marker_index]: gap_runs(array[:, marker_index], offset, frames)
+            for marker_index in np.flatnonzero(missing.any(axis=0))}
+
+
+def skeleton_fingerprint(human) -> str:
+    """
+    Cheap content hash of the rigid trajectory, from its shape and a few hundred evenly spaced frames.
+
+    Changes when the skeleton is recalculated (`calculate`, `put_skeleton_on_ground`), so
+    anything derived from the trajectory can be cached against it.
+    """
+    traj = human.body.rigid_xyz
+    num_frames = int(traj.num_frames)
+    step = max(1, num_frames // FINGERPRINT_SAMPLE_FRAMES)
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(f"{num_frames}:{','.join(traj.landmark_names)}".encode("utf-8"))
+    for values in traj.as_dict.values():
+        digest.update(np.ascontiguousarray(values[::step]).tobytes())
+    return digest.hexdigest()
+
+
+def skeleton_header(human, array: np.ndarray) -> dict:
+    """Describe the data section of a binary payload"""
+    traj = human.body.rigid_xyz
+    return {
+        "markers"     : traj.landmark_names,
+        "segments"    : human.body.anatomical_structure.segment_connections,
+        "num_frames"  : int(array.shape[0]),
+        "shape"       : list(array.shape),
+        "dtype"       : "float32",
+        "byte_order"  : "little",
+        "nan_sentinel": "NaN",
+    }
+
+
+def pack_binary_payload(header: dict, array: np.ndarray) -> bytes:
+    """Prefix the raw array buffer with its length-prefixed JSON header"""
+    header_bytes = json.dumps(header).encode("utf-8")
+    padding = b"\x00" * (-(struct.calcsize(HEADER_LENGTH_FORMAT) + len(header_bytes)) % 4)
+    data = np.ascontiguousarray(array, dtype="<f4")
+    return b"".join([struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)), header_bytes, padding, memoryview(data).cast("B")])
+
+
+def human_to_binary_payload(human) -> bytes:
+    """Binary counterpart to `human_to_custom_dict` that never builds per-element Python objects"""
+    array = trajectory_array(human)
+    return pack_binary_payload(skeleton_header(human, array), array)
+
+
+def trajectory_window(human, start: int, stop: int) -> np.ndarray:
+    """Frames start..stop of the rigid trajectory as float32 (F, J, 3), without stacking the whole recording"""
+    traj = human.body.rigid_xyz
+    array = np.stack([values[start:stop] for values in traj.as_dict.values()], axis=1).astype("<f4", copy=False)
+    array[np.isinf(array)] = np.nan
+    return array
+
+
+def _stream_header(human, chunk_frames: int) -> dict:
+    traj = human.body.rigid_xyz
+    return {
+        "markers"     : traj.landmark_names,
+        "segments"    : human.body.anatomical_structure.segment_connections,
+        "num_frames"  : int(traj.num_frames),
+        "chunk_frames": chunk_frames,
+    }
+
+
+def iter_binary_chunks(human, chunk_frames: int = STREAM_CHUNK_FRAMES):
+    """Yield the skeleton as consecutive binary payloads of `chunk_frames` frames each"""
+    num_frames = int(human.body.rigid_xyz.num_frames)
+    first_header = _stream_header(human, chunk_frames)
+    first_header.update(dtype="float32", byte_order="little", nan_sentinel="NaN")
+    for start in range(0, num_frames, chunk_frames):
+        array = trajectory_window(human, start, start + chunk_frames)
+        header = first_header if start == 0 else {}
+        header.update(start=start, shape=list(array.shape))
+        yield pack_binary_payload(header, array)
+
+
+def iter_ndjson_chunks(human, chunk_frames: int = STREAM_CHUNK_FRAMES):
+    """Yield a header line, then one line per window with `trajectories[marker][frame]` and `gaps` like the JSON route"""
+    markers = human.body.rigid_xyz.landmark_names
+    num_frames = int(human.body.rigid_xyz.num_frames)
+    yield json.dumps(_stream_header(human, chunk_frames)).encode("utf-8") + b"\n"
+    for start in range(0, num_frames, chunk_frames):
+        array = trajectory_window(human, start, start + chunk_frames)
+        chunk = {
+            "start": start,
+            "trajectories": dict(zip(markers, json_values(array.transpose(1, 0, 2)))),
+            "gaps": marker_gaps(markers, array, offset=start),
+        }
+        yield json.dumps(chunk).encode("utf-8") + b"\n"
@@ -0,0 +1,242 @@
+"""
+Composite export videos: the three.js render of the skeleton with the annotated
+camera videos overlaid on it.
+"""
+import logging
+
+import cv2
+import numpy as np
+from tqdm import tqdm
+
+from metrics import function_seconds, timed
+
+logger = logging.getLogger(__name__)
+
+
+# decode flags that let OpenCV produce a 1/2, 1/4 or 1/8 scale image directly
+REDUCED_DECODE_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+
+
+def _decode_flag_for(source_size, target_size):
+    """Largest reduced decode that still yields at least the target size"""
+    source_width, source_height = source_size
+    target_width, target_height = target_size
+    for factor, flag in REDUCED_DECODE_FLAGS.items():
+        if source_width // factor >= target_width and source_height // factor >= target_height:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _first_encoded_frame(video_frames):
+    """First frame a video has, synced cameras (frame_sync.SyncedFrames) have none before they started recording"""
+    for frame_number in range(len(video_frames)):
+        encoded_frame = video_frames[frame_number]
+        if encoded_frame is not None:
+            return encoded_frame
+    return None
+
+
+def multi_video_layout(video_frames_dict, frame_width, frame_height, padding=5):
+    """
+    Slot rectangle of every video in the 2-column overlay grid.
+
+    Computed once per export. Each slot is (x, y, width, height) in the output
+    frame, or None for a video without frames.
+    """
+    # Calculate the size for each video overlay
+    overlay_height = int(frame_height / 4)
+    max_overlay_width = int(frame_width / 2)
+
+    # Pre-calculate video sizes
+    video_sizes = []
+    source_sizes = []
+    for video_frames in video_frames_dict.values():
+        encoded_frame = _first_encoded_frame(video_frames)
+        if encoded_frame is not None:
+            first_frame = cv2.imdecode(np.frombuffer(encoded_frame, np.uint8), cv2.IMREAD_COLOR)
+            aspect_ratio = first_frame.shape[1] / first_frame.shape[0]
+            new_height = overlay_height
+            new_width = min(int(new_height * aspect_ratio), max_overlay_width)
+            video_sizes.append((new_width, new_height))
+            source_sizes.append((first_frame.shape[1], first_frame.shape[0]))
+        else:
+            video_sizes.append((0, 0))
+            source_sizes.append(None)
+
+    # Calculate the width for each column (including padding)
+    column_width = max((size[0] for size in video_sizes), default=0) + padding
+
+    slots = []
+    decode_flags = []
+    for i, ((new_width, new_height), source_size) in enumerate(zip(video_sizes, source_sizes)):
+        if source_size is None or new_width == 0:
+            slots.append(None)
+            decode_flags.append(cv2.IMREAD_COLOR)
+            continue
+        # Calculate position for 2-column layout
+        row = i // 2
+        col = i % 2
+        y_start = row * (overlay_height + padding)
+        x_start = col * column_width
+        # clip overlays that would fall off the bottom of the frame
+        new_height = min(new_height, frame_height - y_start)
+        if new_height <= 0:
+            slots.append(None)
+            decode_flags.append(cv2.IMREAD_COLOR)
+            continue
+        slots.append((x_start, y_start, new_width, new_height))
+        decode_flags.append(_decode_flag_for(source_size, (new_width, new_height)))
+
+    return {
+        "frame_size": (frame_width, frame_height),
+        "slots": slots,
+        "decode_flags": decode_flags,
+    }
+
+
+class MultiVideoCompositor:
+    """
+    Overlays every camera onto the three.js frame using a precomputed layout.
+
+    The output frame is allocated once and reused: `composite` returns the same
+    buffer every call, so write or copy it before compositing the next frame.
+    """
+
+    def __init__(self, layout):
+        self.layout = layout
+        frame_width, frame_height = layout["frame_size"]
+        self._output = np.empty((frame_height, frame_width, 3), dtype=np.uint8)
+        # views of the output frame each overlay is decoded and resized into
+        self._slot_views = [None if slot is None else self._output[slot[1]:slot[1]+slot[3], slot[0]:slot[0]+slot[2]]
+                            for slot in layout["slots"]]
+
+    def composite(self, threejs_frame, frame_number, video_frames_dict):
+        frame_width, frame_height = self.layout["frame_size"]
+        if threejs_frame.shape[:2] == (frame_height, frame_width):
+            np.copyto(self._output, threejs_frame)
+        else:
+            cv2.resize(threejs_frame, (frame_width, frame_height), dst=self._output)
+
+        for video_frames, view, decode_flag in zip(video_frames_dict.values(), self._slot_views, self.layout["decode_flags"]):
+            if view is None or frame_number >= len(video_frames):
+                continue
+            encoded_frame = video_frames[frame_number]
+            if encoded_frame is None:
+                continue
+            video_frame = cv2.imdecode(np.frombuffer(encoded_frame, np.uint8), decode_flag)
+            if video_frame is None:
+                continue
+            if video_frame.shape[:2] == view.shape[:2]:
+                np.copyto(view, video_frame)
+            else:
+                cv2.resize(video_frame, (view.shape[1], view.shape[0]), dst=view)
+
+        return self._output
+
+
+@timed(function_seconds, function="create_multi_video_composite")
+def create_multi_video_composite(video_name, threejs_frames, video_frames_dict, width, height):
+    try:
+        # Get the size of the threejs frames
+        first_threejs_frame = list(threejs_frames.values())[0]
+        frame_height, frame_width = first_threejs_frame.shape[:2]
+
+        # Initialize VideoWriter
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, (frame_width, frame_height))
+
+        compositor = MultiVideoCompositor(multi_video_layout(video_frames_dict, frame_width, frame_height))
+
+        total_frames = len(threejs_frames)
+        for frame_number in tqdm(range(total_frames), desc="Creating composite video"):
+            out.write(compositor.composite(threejs_frames[frame_number], frame_number, video_frames_dict))
+
+        out.release()
+        logger.info(f"Composite video saved as {video_name}")
+
+    except Exception as e:
+        logger.error(f"Error in create_multi_video_composite: {str(e)}")
+
+
+def combined_video_frame(threejs_frame, video_frame, width, height):
+    """Camera frame and three.js frame side by side, each resized to (width, height)"""
+    video_img = cv2.imdecode(np.frombuffer(video_frame, np.uint8), cv2.IMREAD_COLOR)
+    video_img = cv2.resize(video_img, (width, height))
+    threejs_frame = cv2.resize(threejs_frame, (width, height))
+    return np.hstack((video_img, threejs_frame))
+
+
+@timed(function_seconds, function="create_combined_video")
+def create_combined_video(video_name, threejs_frames, video_frames, width, height):
+    try:
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, (width * 2, height))
+
+        num_frames = min(len(threejs_frames), len(video_frames))
+        for i in tqdm(range(num_frames)):
+            out.write(combined_video_frame(threejs_frames[i], video_frames[i], width, height))
+
+        out.release()
+        logger.info(f"Combined video saved as {video_name}")
+
+    except Exception as e:
+        logger.error(f"Error in create_combined_video: {str(e)}")
+
+
+def composite_video_layout(first_threejs_frame, video_frames):
+    """Frame size of the export and size of the single video overlay in its top-left corner"""
+    # Get the size of the threejs frames (height, width, channels)
+    frame_height, frame_width = first_threejs_frame.shape[:2]
+
+    # Get the size of the first video frame to determine aspect ratio
+    first_video_frame = cv2.imdecode(np.frombuffer(video_frames[0], np.uint8), cv2.IMREAD_COLOR)
+    video_height, video_width = first_video_frame.shape[:2]
+    video_aspect_ratio = video_width / video_height
+
+    # Calculate the size of the overlay video
+    overlay_height = int(frame_height / 4)
+    overlay_width = int(overlay_height * video_aspect_ratio)
+
+    return {
+        "frame_size": (frame_width, frame_height),
+        "overlay_size": (overlay_width, overlay_height),
+    }
+
+
+def composite_video_frame(threejs_frame, video_frame, layout):
+    """Overlay a single camera frame onto the top-left corner of a three.js frame"""
+    frame_width, frame_height = layout["frame_size"]
+    overlay_width, overlay_height = layout["overlay_size"]
+
+    # Resize and copy the threejs frame
+    threejs_frame = cv2.resize(threejs_frame, (frame_width, frame_height))
+    composite_frame = threejs_frame.copy()
+
+    # Decode and resize the video frame
+    video_frame = cv2.imdecode(np.frombuffer(video_frame, np.uint8), cv2.IMREAD_COLOR)
+    video_frame_resized = cv2.resize(video_frame, (overlay_width, overlay_height))
+
+    # Overlay the video frame onto the threejs frame
+    composite_frame[0:overlay_height, 0:overlay_width] = video_frame_resized
+    return composite_frame
+
+
+@timed(function_seconds, function="create_composite_video")
+def create_composite_video(video_name, threejs_frames, video_frames, width, height):
+    try:
+        layout = composite_video_layout(threejs_frames[0], video_frames)
+
+        # Initialize VideoWriter with the correct frame size (width, height)
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        out = cv2.VideoWriter(str(video_name), fourcc, 30.0, layout["frame_size"])
+
+        # Process frames
+        num_frames = min(len(threejs_frames), len(video_frames))
+        for i in tqdm(range(num_frames)):
+            out.write(composite_video_frame(threejs_frames[i], video_frames[i], layout))
+
+        out.release()
+        logger.info(f"Composite video saved as {video_name}")
+
+    except Exception as e:
+        logger.error(f"Error in create_composite_video: {str(e)}")
@@ -0,0 +1,40 @@
+"""
+Length-prefixed binary stream of encoded video frames.
+
+A payload is a sequence of records, one per (frame, camera):
+
+    uint32 (little-endian)   frame index
+    uint16 (little-endian)   camera id
+    uint32 (little-endian)   length L of the WebP bytes, 0 if the frame could not be read
+    L bytes                  raw WebP image
+
+Records are ordered by frame, then camera, so a client can turn each one into
+an image as soon as it has been received.
+"""
+import hashlib
+import struct
+from typing import Iterable
+
+BINARY_MEDIA_TYPE = "application/octet-stream"
+FRAME_RECORD_FORMAT = "<IHI"
+MAX_FRAMES_PER_REQUEST = 300
+
+
+def pack_frame_records(records: Iterable[tuple[int, int, bytes | memoryview | None]]) -> bytes:
+    """Concatenate (frame index, camera id, encoded frame) records into one payload"""
+    chunks = []
+    for frame_index, camera_id, encoded_frame in records:
+        length = 0 if encoded_frame is None else len(encoded_frame)
+        chunks.append(struct.pack(FRAME_RECORD_FORMAT, frame_index, camera_id, length))
+        if length:
+            chunks.append(encoded_frame)
+    return b"".join(chunks)
+
+
+def frame_range_etag(frame_stores: dict, camera_ids: list[int], start: int, count: int) -> str:
+    """Strong ETag for a frame range, changes whenever one of the videos, the encoding settings or the camera sync change"""
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(f"{start}:{count}".encode())
+    for camera_id in camera_ids:
+        digest.update(f"|{camera_id}:{frame_stores[camera_id].version}:{frame_stores[camera_id].time_source}".encode())
+    return f'"{digest.hexdigest()}"'
@@ -0,0 +1,226 @@
+"""
+Benchmarks of the API and export paths against a synthetic recording.
+
+Generates camera videos and an (F, J, 3) skeleton with the mediapipe or ferret
+topology, starts the app in-process with the skeleton loader swapped for the
+synthetic one, and measures:
+
+    startup      importing main, the lifespan startup and the time until /ready
+    data         /data latency and payload size, cold and cached, for json and binary
+    video        /video/frames throughput with several concurrent clients, cold and warm
+    export       create_multi_video_composite and render_video_parallel frames/sec
+
+Requests go through httpx's ASGI transport, so the numbers are server-side cost
+without the network. Results are written as JSON to compare between commits:
+
+    python backend/benchmarks/run_benchmarks.py --topology mediapipe --frames 3000 --cameras 4
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from synthetic import TOPOLOGIES, make_synthetic_recording, synthetic_skeleton
+
+BENCHMARKS_FOLDER_PATH = Path(__file__).resolve().parent
+APP_FOLDER_PATH = BENCHMARKS_FOLDER_PATH.parent/'app'
+RESULTS_FOLDER_PATH = BENCHMARKS_FOLDER_PATH/'results'
+
+
+def _summary(seconds: list[float]) -> dict:
+    ordered = sorted(seconds)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BENCHMARKS_FOLDER_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+READY_POLL_SECONDS = 0.01
+
+
+def import_app(skeleton, annotated_video_folder_path: Path):
+    """Import main with the skeleton loader replaced by one returning the synthetic skeleton"""
+    sys.path.insert(0, str(APP_FOLDER_PATH))
+    import tracker_loaders
+    tracker_loaders.load_skeleton = lambda *args, **kwargs: (skeleton, annotated_video_folder_path)
+
+    import main
+    return main
+
+
+async def wait_until_ready(client: httpx.AsyncClient) -> dict:
+    while True:
+        response = await client.get("/ready")
+        if response.status_code == 200:
+            return response.json()
+        if response.json()["status"] == "failed":
+            raise RuntimeError(f"The synthetic recording failed to load: {response.json()['error']}")
+        await asyncio.sleep(READY_POLL_SECONDS)
+
+
+async def bench_data(client: httpx.AsyncClient, response_cache, repeats: int) -> dict:
+    results = {}
+    for format in ("json", "binary"):
+        cold, warm = [], []
+        for _ in range(repeats):
+            response_cache.invalidate()
+            start = time.perf_counter()
+            response = await client.get("/data/mediapipe", params={"format": format}, headers={"Accept-Encoding": "identity"})
+            cold.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+            start = time.perf_counter()
+            await client.get("/data/mediapipe", params={"format": format}, headers={"Accept-Encoding": "identity"})
+            warm.append(time.perf_counter() - start)
+        gzipped = await client.get("/data/mediapipe", params={"format": format}, headers={"Accept-Encoding": "gzip"})
+        results[format] = {
+            "bytes": len(response.content),
+            "gzip_bytes": int(gzipped.headers.get("content-length", len(gzipped.content))),
+            "cold": _summary(cold),
+            "cached": _summary(warm),
+        }
+    return results
+
+
+async def _video_client(client: httpx.AsyncClient, first_frame: int, num_frames: int, count: int, latencies: list[float]) -> int:
+    """Play through `num_frames` frames from `first_frame` like the frontend prefetch does, returns the bytes received"""
+    received = 0
+    end = first_frame + num_frames
+    for start in range(first_frame, end, count):
+        request_start = time.perf_counter()
+        response = await client.get("/video/frames", params={"start": start, "count": min(count, end - start)})
+        latencies.append(time.perf_counter() - request_start)
+        response.raise_for_status()
+        received += len(response.content)
+    return received
+
+
+async def bench_video(client: httpx.AsyncClient, num_frames: int, num_clients: int, count: int) -> dict:
+    # each client plays its own part of the recording, so the cold pass decodes every frame once
+    frames_per_client = max(1, num_frames // num_clients)
+    results = {}
+    for phase in ("cold", "warm"):
+        latencies = []
+        start = time.perf_counter()
+        received = await asyncio.gather(*(_video_client(client, index * frames_per_client, frames_per_client, count, latencies)
+                                          for index in range(num_clients)))
+        elapsed = time.perf_counter() - start
+        results[phase] = {
+            "frames_per_second": frames_per_client * num_clients / elapsed,
+            "megabytes_per_second": sum(received) / elapsed / 1e6,
+            "requests": _summary(latencies),
+        }
+    results["clients"] = num_clients
+    results["frames_per_request"] = count
+    return results
+
+
+def bench_export(frame_stores: dict, num_frames: int, width: int, height: int, output_folder_path: Path, chunk_size: int) -> dict:
+    from parallel_export import render_video_parallel
+    from video_export import create_multi_video_composite
+    rng = np.random.default_rng(0)
+    threejs_frame = rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8)
+    threejs_frames = {frame_number: threejs_frame for frame_number in range(num_frames)}
+    start = time.perf_counter()
+    create_multi_video_composite(output_folder_path/'composite.mp4', threejs_frames, frame_stores, width, height)
+    serial_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    render_video_parallel("multi", output_folder_path/'composite_parallel.mp4', threejs_frames, frame_stores, width, height,
+                          chunk_size=chunk_size)
+    parallel_seconds = time.perf_counter() - start
+    return {"frames": num_frames, "seconds": serial_seconds, "frames_per_second": num_frames / serial_seconds,
+            "parallel_seconds": parallel_seconds, "parallel_frames_per_second": num_frames / parallel_seconds,
+            "chunk_size": chunk_size, "frame_size": [width, height]}
+
+
+async def run(args, work_folder_path: Path) -> dict:
+    recording_folder_path = work_folder_path/'synthetic_recording'
+    start = time.perf_counter()
+    annotated_video_folder_path = make_synthetic_recording(recording_folder_path, args.frames, args.cameras, args.width, args.height)
+    skeleton = synthetic_skeleton(args.topology, args.frames)
+    generation_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    main = import_app(skeleton, annotated_video_folder_path)
+    import_seconds = time.perf_counter() - start
+
+    results = {"generation_seconds": generation_seconds}
+    # every folder the app writes to is inside the synthetic recording
+    app = main.create_app(main.AppConfig(recording_folder_path, "mediapipe"))
+    start = time.perf_counter()
+    async with main.lifespan_manager(app):
+        lifespan_seconds = time.perf_counter() - start
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+            await wait_until_ready(client)
+            results["startup"] = {"import_seconds": import_seconds, "lifespan_seconds": lifespan_seconds,
+                                  "ready_seconds": time.perf_counter() - start}
+            results["data"] = await bench_data(client, main.response_cache, args.repeats)
+            results["video"] = await bench_video(client, args.frames, args.clients, args.frames_per_request)
+        results["export"] = bench_export(main.default_session.frame_stores, min(args.frames, args.export_frames),
+                                         args.width, args.height, work_folder_path, args.export_chunk_size)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API and export paths against a synthetic recording")
+    parser.add_argument("--topology", choices=sorted(TOPOLOGIES), default="mediapipe")
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--cameras", type=int, default=4)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--repeats", type=int, default=5, help="times each /data request is timed")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent /video/frames clients")
+    parser.add_argument("--frames-per-request", type=int, default=30)
+    parser.add_argument("--export-frames", type=int, default=600)
+    parser.add_argument("--export-chunk-size", type=int, default=150, help="frames per render_video_parallel chunk")
+    parser.add_argument("--work-folder", type=Path, default=None, help="keep the synthetic recording here instead of a temporary folder")
+    parser.add_argument("--output", type=Path, default=None, help="results file, defaults to a timestamped file in benchmarks/results")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one line per request otherwise
+
+    timestamp = datetime.datetime.now(datetime.timezone.utc)
+    if args.work_folder is None:
+        with tempfile.TemporaryDirectory(prefix="viz-benchmark-") as work_folder:
+            results = asyncio.run(run(args, Path(work_folder)))
+    else:
+        args.work_folder.mkdir(parents=True, exist_ok=True)
+        results = asyncio.run(run(args, args.work_folder))
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": timestamp.isoformat(),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.platform()},
+        "config": {name: str(value) if isinstance(value, Path) else value for name, value in vars(args).items()},
+        "results": results,
+    }
+    output_path = args.output or RESULTS_FOLDER_PATH/f"{timestamp:%Y%m%dT%H%M%SZ}_{args.topology}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report["results"], indent=2))
+    print(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Synthetic recordings for the benchmarks.
+
+Skeletons are smooth random walks shaped like the mediapipe body model or a
+model definition from backend/tracker_models, wrapped in an object exposing the
+same attributes of a skellymodels model that the server reads. Camera videos
+are mp4 files with moving shapes, so decode and WebP encode cost is close to
+real footage rather than that of a flat colour.
+"""
+from pathlib import Path
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import yaml
+
+TRACKER_MODELS_FOLDER_PATH = Path(__file__).resolve().parents[1]/'tracker_models'
+
+MEDIAPIPE_BODY_MARKERS = [
+    "nose", "left_eye_inner", "left_eye", "left_eye_outer", "right_eye_inner", "right_eye", "right_eye_outer",
+    "left_ear", "right_ear", "mouth_left", "mouth_right", "left_shoulder", "right_shoulder", "left_elbow",
+    "right_elbow", "left_wrist", "right_wrist", "left_pinky", "right_pinky", "left_index", "right_index",
+    "left_thumb", "right_thumb", "left_hip", "right_hip", "left_knee", "right_knee", "left_ankle", "right_ankle",
+    "left_heel", "right_heel", "left_foot_index", "right_foot_index",
+]
+MEDIAPIPE_BODY_SEGMENTS = {
+    "head": ("left_ear", "right_ear"),
+    "trunk_shoulders": ("left_shoulder", "right_shoulder"),
+    "trunk_hips": ("left_hip", "right_hip"),
+    "left_trunk": ("left_shoulder", "left_hip"),
+    "right_trunk": ("right_shoulder", "right_hip"),
+    "left_upper_arm": ("left_shoulder", "left_elbow"),
+    "right_upper_arm": ("right_shoulder", "right_elbow"),
+    "left_forearm": ("left_elbow", "left_wrist"),
+    "right_forearm": ("right_elbow", "right_wrist"),
+    "left_hand": ("left_wrist", "left_index"),
+    "right_hand": ("right_wrist", "right_index"),
+    "left_thigh": ("left_hip", "left_knee"),
+    "right_thigh": ("right_hip", "right_knee"),
+    "left_shank": ("left_knee", "left_ankle"),
+    "right_shank": ("right_knee", "right_ankle"),
+    "left_foot": ("left_heel", "left_foot_index"),
+    "right_foot": ("right_heel", "right_foot_index"),
+}
+
+
+def mediapipe_topology() -> tuple[list[str], dict]:
+    segments = {name: {"proximal": proximal, "distal": distal} for name, (proximal, distal) in MEDIAPIPE_BODY_SEGMENTS.items()}
+    return list(MEDIAPIPE_BODY_MARKERS), segments
+
+
+def model_topology(model_file_name: str) -> tuple[list[str], dict]:
+    """Markers and segments of a model definition in backend/tracker_models, e.g. dlc_ferret.yaml"""
+    with open(TRACKER_MODELS_FOLDER_PATH/model_file_name) as model_file:
+        body = yaml.safe_load(model_file)["aspects"]["body"]
+    return [str(name) for name in body["tracked_points"]["names"]], body.get("segment_connections", {})
+
+
+TOPOLOGIES = {
+    "mediapipe": mediapipe_topology,
+    "dlc_ferret": lambda: model_topology("dlc_ferret.yaml"),
+}
+
+
+def random_walk_skeleton(num_frames: int, num_markers: int, seed: int = 0, missing_fraction: float = 0.01) -> np.ndarray:
+    """Smooth (F, J, 3) float32 trajectories in millimetres with a few dropped-out samples"""
+    rng = np.random.default_rng(seed)
+    offsets = rng.normal(scale=300.0, size=(1, num_markers, 3))
+    walk = np.cumsum(rng.normal(scale=2.0, size=(num_frames, num_markers, 3)), axis=0)
+    array = (offsets + walk).astype(np.float32)
+    array[rng.random((num_frames, num_markers)) < missing_fraction] = np.nan
+    return array
+
+
+class SyntheticSkeleton:
+    """The parts of a skellymodels model the server reads: `body.rigid_xyz`, `body.anatomical_structure`, `body.trajectories`"""
+
+    def __init__(self, array: np.ndarray, markers: list[str], segment_connections: dict):
+        rigid_xyz = SimpleNamespace(
+            as_dict={marker: array[:, index] for index, marker in enumerate(markers)},
+            landmark_names=list(markers),
+            num_frames=array.shape[0],
+        )
+        self.body = SimpleNamespace(
+            rigid_xyz=rigid_xyz,
+            trajectories={"rigid_3d_xyz": rigid_xyz},
+            anatomical_structure=SimpleNamespace(segment_connections=segment_connections),
+        )
+
+
+def synthetic_skeleton(topology: str, num_frames: int, seed: int = 0) -> SyntheticSkeleton:
+    markers, segments = TOPOLOGIES[topology]()
+    return SyntheticSkeleton(random_walk_skeleton(num_frames, len(markers), seed), markers, segments)
+
+
+def write_synthetic_video(video_path: Path, num_frames: int, width: int = 1280, height: int = 720, fps: float = 30.0, seed: int = 0):
+    """An mp4 of moving circles over a noisy gradient"""
+    rng = np.random.default_rng(seed)
+    background = np.clip(np.linspace(0, 255, width)[None, :, None] + rng.normal(scale=20, size=(height, width, 3)), 0, 255).astype(np.uint8)
+    centers = rng.uniform((0, 0), (width, height), size=(8, 2))
+    velocities = rng.normal(scale=6.0, size=(8, 2))
+    colors = rng.integers(0, 255, size=(8, 3))
+
+    out = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    frame = np.empty_like(background)
+    for frame_number in range(num_frames):
+        np.copyto(frame, background)
+        positions = (centers + velocities * frame_number) % (width, height)
+        for (x, y), color in zip(positions, colors):
+            cv2.circle(frame, (int(x), int(y)), 40, tuple(int(channel) for channel in color), -1)
+        cv2.putText(frame, str(frame_number), (20, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 3)
+        out.write(frame)
+    out.release()
+
+
+def make_synthetic_recording(recording_folder_path: Path, num_frames: int, num_cameras: int = 4,
+                             width: int = 1280, height: int = 720, seed: int = 0) -> Path:
+    """Recording folder with annotated camera videos and an output_data folder. Returns the annotated video folder."""
+    annotated_video_folder_path = Path(recording_folder_path)/'annotated_videos'
+    annotated_video_folder_path.mkdir(parents=True, exist_ok=True)
+    (Path(recording_folder_path)/'output_data').mkdir(exist_ok=True)
+    for camera in range(num_cameras):
+        video_path = annotated_video_folder_path/f'camera_{camera}.mp4'
+        if not video_path.exists():
+            write_synthetic_video(video_path, num_frames, width, height, seed=seed + camera)
+    return annotated_video_folder_path
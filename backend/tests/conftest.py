@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the backend runs from backend/app and imports its modules as siblings
+sys.path.insert(0, str(Path(__file__).parents[1] / "app"))
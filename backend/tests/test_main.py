@@ -0,0 +1,10 @@
+import subprocess
+import sys
+from pathlib import Path
+
+
+def test_importing_main_does_not_load_cv2():
+    # a fresh interpreter, other tests have already imported cv2 into this one
+    result = subprocess.run([sys.executable, "-c", "import sys, main; print(sorted({'cv2', 'tqdm'} & set(sys.modules)))"],
+                            cwd=Path(__file__).parents[1] / "app", capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
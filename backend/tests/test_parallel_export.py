@@ -0,0 +1,57 @@
+import pickle
+
+import cv2
+import numpy as np
+
+from export_jobs import ExportJobManager
+from frame_store import VideoFrameStore
+from frame_sync import SyncedFrames
+from parallel_export import CHUNK_SIZE, _chunk_of
+from skeleton_render import Camera, export_rendered_skeleton
+
+
+def _video(path, frame_count, width=64, height=48):
+    out = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), 30.0, (width, height))
+    for frame_number in range(frame_count):
+        out.write(np.full((height, width, 3), frame_number * 10 % 256, dtype=np.uint8))
+    out.release()
+    return path
+
+
+def test_synced_frames_are_sent_as_the_store_and_frame_map(tmp_path):
+    store = VideoFrameStore(_video(tmp_path / "cam.mp4", 10))
+    store.attach_frame_map(np.array([-1, 0, 1, 2, 4, 6, 8, 9], dtype=np.int32), "timestamps")
+    frames = SyncedFrames(store)
+
+    chunk = _chunk_of(frames, 2, 6)
+
+    assert chunk is frames
+    copy = pickle.loads(pickle.dumps(chunk))
+    assert len(copy) == 8
+    assert copy[0] is None
+    assert bytes(copy[5]) == bytes(frames[5])
+    copy.frame_store.close()
+    store.close()
+
+
+def test_render_export_chunks_run_on_the_shared_pool(tmp_path):
+    manager = ExportJobManager(tmp_path / "staging", chunk_processes=2)
+    store = VideoFrameStore(_video(tmp_path / "cam.mp4", 20))
+    total_frames = CHUNK_SIZE + 20
+    skeleton_frames = np.random.default_rng(0).uniform(-100, 100, (total_frames, 2, 3)).astype(np.float32)
+    camera = Camera((0.0, 250.0, 500.0), (0.0, 0.0, 0.0), (0.0, 0.0, 1.0), 75.0)
+    job = manager.create_job("render", total_frames, tmp_path / "render.mp4")
+    try:
+        manager.start_chunked(job, export_rendered_skeleton, job.output_path, {"cam": SyncedFrames(store)}, skeleton_frames,
+                              ["a", "b"], {"ab": {"proximal": "a", "distal": "b"}}, camera, 64, 48, 0, total_frames, 30.0)
+        job.future.result(timeout=120)
+
+        assert job.status == "done"
+        # the job only coordinated, no export worker was started to render it
+        assert not manager._executor._processes
+        capture = cv2.VideoCapture(str(job.output_path))
+        assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == total_frames
+        capture.release()
+    finally:
+        manager.shutdown()
+        store.close()
@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from playback_stream import PlaybackSession
+
+
+def _playback_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.websocket("/ws")
+    async def websocket_endpoint(websocket: WebSocket):
+        await websocket.accept()
+        try:
+            await PlaybackSession(websocket, np.zeros((10, 2, 3), dtype=np.float32), {}).run()
+        except WebSocketDisconnect:
+            pass
+
+    return app
+
+
+def _next_text(websocket) -> dict:
+    """The next JSON text message, skipping frame packets"""
+    while True:
+        message = websocket.receive()
+        if message.get("text") is not None:
+            return json.loads(message["text"])
+
+
+def test_binary_message_is_rejected_without_closing_the_session():
+    with TestClient(_playback_app()).websocket_connect("/ws") as websocket:
+        assert _next_text(websocket)["type"] == "state"
+
+        websocket.send_bytes(b"\x00\x01")
+        error = _next_text(websocket)
+        assert error["type"] == "error"
+        assert "binary" in error["message"]
+
+        websocket.send_text(json.dumps({"type": "rate", "rate": 0.5}))
+        state = _next_text(websocket)
+        assert state["type"] == "state"
+        assert state["rate"] == 0.5
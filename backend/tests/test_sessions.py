@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import sessions
+import tracker_loaders
+from sessions import RecordingSession, SessionManager
+
+MARKERS = ["left_hip", "right_hip", "nose"]
+SEGMENTS = {"pelvis": {"proximal": "left_hip", "distal": "right_hip"}}
+
+
+def _fake_skeleton(num_frames=20):
+    rng = np.random.default_rng(0)
+    rigid_xyz = SimpleNamespace(as_dict={name: rng.normal(size=(num_frames, 3)) for name in MARKERS},
+                                landmark_names=MARKERS, num_frames=num_frames)
+    return SimpleNamespace(body=SimpleNamespace(rigid_xyz=rigid_xyz, anatomical_structure=SimpleNamespace(segment_connections=SEGMENTS)))
+
+
+def _recording(tmp_path, name="recording"):
+    recording_folder_path = tmp_path / name
+    source_folder_path = tracker_loaders.source_path(recording_folder_path, "mediapipe")
+    source_folder_path.mkdir(parents=True)
+    (source_folder_path / "body.npy").write_bytes(b"tracked points")
+    return recording_folder_path
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Replace the skellymodels loader with one returning a fake skeleton, recording the trackers it loads"""
+    loads = []
+    skeleton = _fake_skeleton()
+
+    def load_skeleton(recording_folder_path, tracker):
+        loads.append(tracker)
+        return skeleton, tracker_loaders.annotated_videos_path(recording_folder_path, tracker)
+
+    monkeypatch.setattr(tracker_loaders, "load_skeleton", load_skeleton)
+    monkeypatch.setattr(sessions, "load_skeleton", load_skeleton)
+    return loads
+
+
+def test_reopening_a_recording_reads_the_trajectory_sidecar(tmp_path, loads):
+    recording_folder_path = _recording(tmp_path)
+
+    first = RecordingSession("recording", recording_folder_path, "mediapipe")
+    assert loads == ["mediapipe"]
+    second = RecordingSession("recording", recording_folder_path, "mediapipe")
+    assert loads == ["mediapipe"]
+
+    assert isinstance(second.skeleton_frames, np.memmap)
+    np.testing.assert_array_equal(second.skeleton_frames, first.skeleton_frames)
+    assert second.marker_names == MARKERS
+    assert second.segment_connections == SEGMENTS
+
+    # the model is only loaded once something needs more than the trajectory
+    assert second.ensure_skeleton() is first.skeleton
+    assert loads == ["mediapipe", "mediapipe"]
+
+
+def test_unknown_recordings_rescan_off_the_event_loop_at_most_every_interval(tmp_path, monkeypatch):
+    scans = []
+    monkeypatch.setattr(sessions, "find_recordings", lambda recordings_root_path: scans.append(threading.get_ident()) or {})
+    manager = SessionManager(tmp_path)
+
+    async def look_up(times):
+        for _ in range(times):
+            with pytest.raises(KeyError):
+                await manager.get("missing")
+        return threading.get_ident()
+
+    event_loop_thread = asyncio.run(look_up(5))
+    assert len(scans) == 1
+    assert event_loop_thread not in scans
+
+    monkeypatch.setattr(sessions, "RECORDINGS_REFRESH_SECONDS", 0)
+    asyncio.run(look_up(1))
+    assert len(scans) == 2
+
+
+def test_evicted_sessions_close_off_the_event_loop(tmp_path, monkeypatch, loads):
+    recordings = {name: _recording(tmp_path, name) for name in ("first", "second")}
+    monkeypatch.setattr(sessions, "find_recordings", lambda recordings_root_path: recordings)
+    closed = []
+    monkeypatch.setattr(RecordingSession, "close", lambda session: closed.append((session.id, threading.get_ident())))
+    manager = SessionManager(tmp_path, memory_budget_bytes=0)
+
+    async def load_both():
+        async with manager.use("first"):
+            await manager.get("second")
+            # held by this request, closed when it is released
+            assert closed == []
+        await asyncio.sleep(0)
+        return threading.get_ident()
+
+    event_loop_thread = asyncio.run(load_both())
+    assert [session_id for session_id, _ in closed] == ["first"]
+    assert closed[0][1] != event_loop_thread
+
+    async def load_unheld():
+        # nobody holds "second" when "first" is loaded again, so it is closed right away
+        await manager.get("first")
+        await asyncio.gather(*manager._closing)
+        return threading.get_ident()
+
+    event_loop_thread = asyncio.run(load_unheld())
+    assert [session_id for session_id, _ in closed] == ["first", "second"]
+    assert closed[1][1] != event_loop_thread
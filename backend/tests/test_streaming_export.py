@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+
+from export_jobs import JobContext
+from streaming_export import export_staged_upload, stage_upload_batch
+
+
+def _encoded_frame(frame_number, width=64, height=48):
+    frame = np.full((height, width, 3), frame_number * 10 % 256, dtype=np.uint8)
+    return cv2.imencode(".png", frame)[1].tobytes()
+
+
+def test_missing_frame_is_skipped(tmp_path):
+    total_frames = 12
+    missing_frame = 6
+    context = JobContext(tmp_path / "job")
+    context.staging_folder_path.mkdir()
+    stage_upload_batch(context, [(frame_number, _encoded_frame(frame_number))
+                                 for frame_number in range(total_frames) if frame_number != missing_frame], "png", (64, 48))
+    video_path = tmp_path / "export.mp4"
+
+    export_staged_upload(context, video_path, {}, total_frames, (64, 48), frame_timeout=0.5, staged_timeout=10)
+
+    progress = context.staging_folder_path / "progress.json"
+    assert '"skipped_frames": 1' in progress.read_text()
+    capture = cv2.VideoCapture(str(video_path))
+    assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == total_frames - 1
+    capture.release()
+    assert not list(context.frames_folder_path.glob("*.img"))
+
+
+def test_upload_batch_decode_is_reported_per_batch(tmp_path):
+    context = JobContext(tmp_path / "job")
+    frames = [(frame_number, _encoded_frame(frame_number)) for frame_number in range(8)] + [(8, b"not an image")]
+
+    decode_seconds, stage_seconds = stage_upload_batch(context, frames, "png", (32, 24))
+
+    assert decode_seconds > 0 and stage_seconds > 0
+    staged = context.take_staged_frames(len(frames))
+    assert [frame_number for frame_number, _ in staged] == list(range(9))
+    # decoded and resized to the export size, the frame that didn't decode is staged empty
+    assert all(len(contents) == 32 * 24 * 3 for _, contents in staged[:-1])
+    assert staged[-1][1] == b""
@@ -0,0 +1,62 @@
+// Client for the /ws playback stream (see backend/app/playback_stream.py for the protocol)
+
+const parseFramePacket = (buffer) => {
+  const view = new DataView(buffer);
+  const headerLength = view.getUint32(0, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+
+  // the skeleton slice starts on the next 4-byte boundary after the header
+  let offset = 4 + headerLength + ((4 - ((4 + headerLength) % 4)) % 4);
+  const [numMarkers, numDims] = header.shape;
+  const skeleton = new Float32Array(buffer, offset, numMarkers * numDims);
+  offset += skeleton.byteLength;
+
+  const videoFrames = {};
+  for (const { id, length } of header.cameras) {
+    if (length > 0) {
+      videoFrames[id] = new Blob([buffer.slice(offset, offset + length)], { type: 'image/webp' });
+    }
+    offset += length;
+  }
+  return { frameNumber: header.frame, skeleton, videoFrames };
+};
+
+export const connectPlaybackStream = ({ url = `ws://${window.location.host}/api/ws`, onFrame, onState, onError, onOpen, onClose } = {}) => {
+  const socket = new WebSocket(url);
+  socket.binaryType = 'arraybuffer';
+
+  socket.onopen = () => onOpen?.();
+  // the server closes with 1011 when it fails to send frames and 1013 while the recording is still loading
+  socket.onclose = (event) => onClose?.(event);
+
+  const send = (message) => {
+    if (socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify(message));
+    }
+  };
+
+  socket.onmessage = (event) => {
+    if (typeof event.data === 'string') {
+      const message = JSON.parse(event.data);
+      if (message.type === 'error') {
+        onError?.(message.message);
+      } else {
+        onState?.(message);
+      }
+      return;
+    }
+    const packet = parseFramePacket(event.data);
+    onFrame?.(packet);
+    // acknowledge once the frame has been handed off so the server can send the next one
+    send({ type: 'ack', frame: packet.frameNumber });
+  };
+
+  return {
+    play: () => send({ type: 'play' }),
+    pause: () => send({ type: 'pause' }),
+    seek: (frame) => send({ type: 'seek', frame }),
+    setRate: (rate) => send({ type: 'rate', rate }),
+    isOpen: () => socket.readyState === WebSocket.OPEN,
+    close: () => socket.close(),
+  };
+};
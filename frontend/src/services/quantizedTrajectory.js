@@ -0,0 +1,68 @@
+// Decoder for /data/{tracker}?format=quantized (see backend/app/trajectory_codec.py for the layout)
+
+const inflate = async (bytes) => {
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('deflate'));
+  return new Uint8Array(await new Response(stream).arrayBuffer());
+};
+
+// Undo the byte planes: byte k of value i is at planes[k * count + i]
+const fromBytePlanes = (planes, bytesPerValue, count) => {
+  const interleaved = new Uint8Array(bytesPerValue * count);
+  for (let k = 0; k < bytesPerValue; k++) {
+    const plane = planes.subarray(k * count, (k + 1) * count);
+    for (let i = 0; i < count; i++) {
+      interleaved[i * bytesPerValue + k] = plane[i];
+    }
+  }
+  return bytesPerValue === 2 ? new Int16Array(interleaved.buffer) : new Int32Array(interleaved.buffer);
+};
+
+// Returns { header, data } with data a Float32Array of shape header.shape (frames, markers, 3), NaN where missing
+export const decodeQuantizedTrajectory = async (buffer) => {
+  const view = new DataView(buffer);
+  const headerLength = view.getUint32(0, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+  const offset = 4 + headerLength + ((4 - ((4 + headerLength) % 4)) % 4);
+
+  const [numFrames, numMarkers] = header.shape;
+  const numSamples = header.num_samples;
+  const bytesPerValue = header.delta_dtype === 'int16' ? 2 : 4;
+  const deltas = fromBytePlanes(await inflate(new Uint8Array(buffer, offset)), bytesPerValue, 3 * numSamples);
+
+  const tracked = new Uint8Array(numMarkers * numFrames).fill(1);
+  header.markers.forEach((marker, markerIndex) => {
+    for (const [start, stop] of header.gaps[marker] ?? []) {
+      tracked.fill(0, markerIndex * numFrames + start, markerIndex * numFrames + stop);
+    }
+  });
+
+  const data = new Float32Array(numFrames * numMarkers * 3).fill(NaN);
+  for (let axis = 0; axis < 3; axis++) {
+    const axisDeltas = deltas.subarray(axis * numSamples, (axis + 1) * numSamples);
+    // running sums are exact integers well inside the float64 range
+    let value = 0;
+    let velocity = 0;
+    let sample = 0;
+    for (let markerIndex = 0; markerIndex < numMarkers; markerIndex++) {
+      for (let frame = 0; frame < numFrames; frame++) {
+        if (!tracked[markerIndex * numFrames + frame]) continue;
+        if (header.delta_order === 2) {
+          velocity += axisDeltas[sample++];
+          value += velocity;
+        } else {
+          value += axisDeltas[sample++];
+        }
+        data[(frame * numMarkers + markerIndex) * 3 + axis] = value * header.precision;
+      }
+    }
+  }
+  return { header, data };
+};
+
+export const fetchQuantizedTrajectory = async ({ url = '/api/data/mediapipe', precision = 0.1 } = {}) => {
+  const response = await fetch(`${url}?format=quantized&precision=${precision}`);
+  if (!response.ok) {
+    throw new Error(`Failed to fetch quantized skeleton data. HTTP status: ${response.status}`);
+  }
+  return decodeQuantizedTrajectory(await response.arrayBuffer());
+};
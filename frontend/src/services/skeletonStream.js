@@ -0,0 +1,36 @@
+// Reader for /data/{tracker}/stream?format=ndjson (see iter_ndjson_chunks in backend/app/trajectory_payload.py)
+
+// Calls onHeader once with { markers, segments, num_frames, chunk_frames }, then onChunk with
+// { start, trajectories } for every window of frames as soon as it has arrived
+export const streamSkeletonData = async ({ url = '/api/data/mediapipe/stream', onHeader, onChunk } = {}) => {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Failed to stream skeleton data. HTTP status: ${response.status}`);
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffered = '';
+  let header = null;
+
+  const handleLine = (line) => {
+    if (!line) return;
+    const message = JSON.parse(line);
+    if (header === null) {
+      header = message;
+      onHeader?.(header);
+    } else {
+      onChunk?.(message);
+    }
+  };
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffered += value;
+    const lines = buffered.split('\n');
+    buffered = lines.pop();
+    lines.forEach(handleLine);
+  }
+  handleLine(buffered);
+  return header;
+};
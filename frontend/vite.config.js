@@ -21,6 +21,7 @@ export default defineConfig({
       '/api': {
         target: 'http://localhost:8000',  // The backend server (FastAPI)
         changeOrigin: true,               // Ensures correct origin headers
+        ws: true,                         // Also proxy the /ws playback stream
         secure: false,                    // Disable if using HTTPS with self-signed certs
         rewrite: (path) => path.replace(/^\/api/, ''), // Removes the /api prefix before sending to the backend
       },
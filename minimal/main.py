@@ -1,14 +1,17 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.responses import FileResponse, JSONResponse
 from pathlib import Path
+import argparse
 import numpy as np
 import logging
+import os
+import threading
+import time
 
-from skellymodels.create_model_skeleton import create_mediapipe_skeleton_model
-from skellymodels.experimental.model_redo.managers.human import Human
-from skellymodels.experimental.model_redo.tracker_info.model_info import MediapipeModelInfo, ModelInfo
+# skellymodels is imported by load_skeleton, so importing the app doesn't pay for it
 
-app = FastAPI()
+router = APIRouter()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -68,27 +71,65 @@ def test_it_works(
             print(f"{seg_name:<25} {std:10.6f}   {status}")
 
 
-recording_folder_path = Path(r"D:\ferret_recording")
-data_path = recording_folder_path/"output_data"/"dlc_body_3d_xyz.npy"
+# recording_folder_path = Path(r"D:\ferret_recording")
+# data_path = recording_folder_path/"output_data"/"dlc_body_3d_xyz.npy"
 
-data_path = Path(r"C:\Users\aaron\Downloads\raw_dlc_3d_array_iteration_12.npy")
+DEFAULT_DATA_PATH = Path(r"C:\Users\aaron\Downloads\raw_dlc_3d_array_iteration_12.npy")
 
 path_to_ferret_yaml = Path(__file__).parents[0]/'dlc_ferret.yaml'
-ferret_model_info = ModelInfo(config_path=path_to_ferret_yaml)
+html_path = Path(__file__).parents[0]/'index.html'
 
-landmarks_array = np.load(data_path)
-landmarks_array = np.nan_to_num(landmarks_array)
+# loaded in a background thread after startup, see /ready
+data_path = None
+skeleton = None
+load_error = None
 
-skeleton = Human.from_landmarks_numpy_array(name="ferret",
-               model_info=ferret_model_info,
-               landmarks_numpy_array=landmarks_array)
-skeleton.calculate()
-test_it_works(human=skeleton)
 
-html_path = Path(__file__).parents[0]/'index.html'
+def load_skeleton(data_path: Path):
+    from skellymodels.experimental.model_redo.managers.human import Human
+    from skellymodels.experimental.model_redo.tracker_info.model_info import ModelInfo
+
+    ferret_model_info = ModelInfo(config_path=path_to_ferret_yaml)
+
+    landmarks_array = np.load(data_path)
+    landmarks_array = np.nan_to_num(landmarks_array)
 
+    skeleton = Human.from_landmarks_numpy_array(name="ferret",
+                   model_info=ferret_model_info,
+                   landmarks_numpy_array=landmarks_array)
+    skeleton.calculate()
+    return skeleton
+
+
+def _load_in_background(data_path: Path):
+    global skeleton, load_error
+    start_time = time.perf_counter()
+    try:
+        skeleton = load_skeleton(data_path)
+    except Exception as e:
+        logger.error(f"Could not load {data_path}: {e}")
+        load_error = f"{type(e).__name__}: {e}"
+        return
+    logger.info(f"Loaded {data_path} in {time.perf_counter() - start_time:.2f} seconds")
 
-def human_to_custom_dict(human: Human) -> dict:
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    threading.Thread(target=_load_in_background, args=(data_path,), daemon=True, name="skeleton-loader").start()
+    yield
+
+
+def create_app(path: Path | None = None) -> FastAPI:
+    """The app serving the array at `path`, by default VIZ_DATA_PATH. Run with `uvicorn main:create_app --factory`."""
+    global data_path, skeleton, load_error
+    data_path = Path(path or os.environ.get("VIZ_DATA_PATH", DEFAULT_DATA_PATH))
+    skeleton, load_error = None, None
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router)
+    return app
+
+
+def human_to_custom_dict(human) -> dict:
     """
     Mirror the legacy `to_custom_dict` for the new Human/Trajectory API.
     Returns only what the thin-client viewer needs.
@@ -115,13 +156,22 @@ def human_to_custom_dict(human: Human) -> dict:
     }
 
 
-@app.get("/")
+@router.get("/")
 async def serve_index():
     return FileResponse(html_path)
 
 
-@app.get("/data")
+@router.get("/ready")
+async def get_ready():
+    if skeleton is None:
+        return JSONResponse(status_code=503, content={"status": "loading" if load_error is None else "failed", "error": load_error})
+    return {"status": "ready", "data_path": str(data_path)}
+
+
+@router.get("/data")
 async def get_data():
+    if skeleton is None:
+        raise HTTPException(status_code=503, detail=load_error or f"Still loading {data_path}, see /ready")
     try:
         return JSONResponse(human_to_custom_dict(skeleton))
     except Exception as e:
@@ -132,4 +182,7 @@ async def get_data():
     
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Serve a 3d landmarks array to index.html")
+    parser.add_argument("--data", type=Path, default=None, help="(frames, landmarks, 3) .npy array, defaults to VIZ_DATA_PATH")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.data), host="127.0.0.1", port=8000, log_level="info")
\ No newline at end of file